@@ -1,6 +1,10 @@
+from fastapi.concurrency import run_in_threadpool
+
 from app.gcp.big_query.big_query_client import (
     BigQueryClient,
 )
+from app.gcp.big_query.query_budget import QueryBudgetReservation
+from app.gcp.big_query.query_cache import query_result_cache
 from app import (
     __version__,
     __appname__,
@@ -9,6 +13,16 @@ from app import (
 )
 
 
+async def get_client_async(bq_client: BigQueryClient = None) -> BigQueryClient:
+    """
+    return the passed client, or build one in a worker thread: resolving the project-id and creating the
+    shared clients can block, e.g. on the metadata-server, and must not stall the event loop
+    :param bq_client: BigQueryClient | (optional) client created beforehand, e.g. at startup
+    :return: BigQueryClient
+    """
+    return bq_client or await run_in_threadpool(BigQueryClient)
+
+
 class Api:
     @staticmethod
     def get_app_details() -> dict:
@@ -19,6 +33,16 @@ class Api:
             "author": __author__,
         }
 
+    @staticmethod
+    def get_query_cache_stats() -> dict:
+        return query_result_cache.get_stats()
+
+    @staticmethod
+    async def check_query_budget(
+            _query: str, caller: str = None, bq_client: BigQueryClient = None
+    ) -> QueryBudgetReservation:
+        return await (await get_client_async(bq_client)).check_query_budget_async(sql_query=_query, caller=caller)
+
     @staticmethod
     def get_bigquery_operation_results(
             _query: str, gbq_table_id: str = None
@@ -29,6 +53,53 @@ class Api:
         )
         return {"response": _bigquery_response}
 
+    @staticmethod
+    async def get_bigquery_operation_results_async(
+            _query: str,
+            gbq_table_id: str = None,
+            budget_reservation: QueryBudgetReservation = None,
+            bq_client: BigQueryClient = None,
+    ) -> dict:
+        _bigquery_response = await (await get_client_async(bq_client)).execute_query_async(
+            sql_query=_query,
+            as_json=True,
+            budget_reservation=budget_reservation,
+        )
+        return {"response": _bigquery_response}
+
+    @staticmethod
+    async def get_bigquery_operation_results_page(
+            _query: str,
+            page_size: int,
+            page_token: str = None,
+            gbq_table_id: str = None,
+            budget_reservation: QueryBudgetReservation = None,
+            bq_client: BigQueryClient = None,
+    ) -> dict:
+        _bigquery_response = await (await get_client_async(bq_client)).execute_query_page_async(
+            sql_query=_query,
+            page_size=page_size,
+            page_token=page_token,
+            budget_reservation=budget_reservation,
+        )
+        return {
+            "response": _bigquery_response,
+            "next_page_token": _bigquery_response.pop("next_page_token", None),
+            "page_tokens": _bigquery_response.pop("page_tokens", None),
+            "total_rows": _bigquery_response.pop("total_rows", None),
+        }
+
+    @staticmethod
+    async def get_bigquery_operation_results_stream(
+            _query: str,
+            gbq_table_id: str = None,
+            budget_reservation: QueryBudgetReservation = None,
+            bq_client: BigQueryClient = None,
+    ):
+        return await (await get_client_async(bq_client)).execute_query_ndjson_stream(
+            sql_query=_query, budget_reservation=budget_reservation
+        )
+
 
 if __name__ == "__main__":
     print(Api().get_bigquery_operation_results(
@@ -1,15 +1,74 @@
 """
 Base-client for GCP APIs
 """
-from dotenv import load_dotenv
+import os
+import threading
+from typing import Callable
 
-from app.utils.cloud_project_utils import CloudProjectUtils
+from app.utils.cloud_project_utils import get_cached_project_id_and_secrets_env
+
+# process-wide registry of API clients, keyed by (client-type, project-id)
+_SHARED_CLIENTS: dict = {}
+_SHARED_CLIENTS_LOCK = threading.RLock()  # factories may create other shared clients
+
+
+def get_threadpool_size() -> int:
+    """
+    number of concurrent requests handled by one worker, i.e. the size of starlette's threadpool
+    can be set using env-var THREADPOOL_SIZE, default=40 (anyio default)
+    :return: int
+    """
+    return int(os.getenv("THREADPOOL_SIZE") or 40)
+
+
+def get_http_pool_size() -> int:
+    """
+    size of the HTTP connection-pool of the shared clients
+    can be set using env-var HTTP_POOL_SIZE, else follows the threadpool size of the worker
+    :return: int
+    """
+    return int(os.getenv("HTTP_POOL_SIZE") or get_threadpool_size())
+
+
+def get_shared_client(
+        client_type: str, project_id: str, client_factory: Callable
+) -> object:
+    """
+    return the process-wide client for given client-type and project, creating it once if needed
+    :param client_type: str | identifier for the kind of client, e.g. "bigquery"
+    :param project_id: str | GCP project-id the client is bound to
+    :param client_factory: Callable | called with project_id to create the client
+    :return: object | shared client
+    """
+    _key = (client_type, project_id)
+    if _key not in _SHARED_CLIENTS:
+        with _SHARED_CLIENTS_LOCK:
+            if _key not in _SHARED_CLIENTS:
+                _SHARED_CLIENTS[_key] = client_factory(project_id)
+    return _SHARED_CLIENTS[_key]
+
+
+def close_shared_clients() -> None:
+    """
+    close and drop all shared clients, e.g. on app shutdown
+    :return:
+    """
+    with _SHARED_CLIENTS_LOCK:
+        for client in _SHARED_CLIENTS.values():
+            if client is not None and hasattr(client, "close"):
+                try:
+                    client.close()
+                except Exception as e:
+                    print(f"Exception caught while closing client: {e}")
+        _SHARED_CLIENTS.clear()
 
 
 class BaseClient:
 
     def __init__(self, project_id: str = None):
-        load_dotenv()
-        _pid_senv = CloudProjectUtils().get_project_id_and_secrets_env()
-        self.project_id = project_id or _pid_senv.get("project_id")
-        self.secrets_env = _pid_senv.get("secrets_env") or None
+        # only resolved if not passed, which may ask the metadata-server
+        self.project_id = project_id or get_cached_project_id_and_secrets_env().get("project_id")
+
+    @property
+    def secrets_env(self):
+        return get_cached_project_id_and_secrets_env().get("secrets_env") or None
@@ -1,17 +1,311 @@
 """
 class to interact with BigQuery tables using google apis
 """
+from anyio import to_thread
+from anyio.lowlevel import RunVar
 from google.cloud import bigquery
 from app.utils.data_string_utils import pretty_print_df
+import asyncio
+import base64
+import functools
+import hashlib
+import hmac
 import json
+import os
 
-from app.gcp.base_client import BaseClient
+from app.gcp.big_query.query_builder import SelectQueryBuilder
+from app.gcp.big_query.table_replicas import create_table_replicas
+from app.gcp.big_query.query_budget import QueryBudgetReservation, query_budget, query_estimate_cache
+from app.gcp.big_query.query_cache import (
+    get_query_cache_key,
+    get_referenced_tables,
+    is_cacheable_query,
+    normalize_sql,
+    query_result_cache,
+    table_modified_cache,
+)
+from app.gcp.base_client import (
+    BaseClient,
+    get_http_pool_size,
+    get_shared_client,
+)
+
+# max number of page-tokens of following pages returned with the first page, see execute_query_page_async
+MAX_PAGE_TOKENS = 1000
+# bound of the blocking calls of the async paths per event loop, see get_blocking_calls_semaphore
+_blocking_calls_semaphore = RunVar("_blocking_calls_semaphore")
+
+
+def create_bigquery_client(project_id: str = None):
+    """
+    create the BigQuery client of the configured backend, set using env-var BIGQUERY_BACKEND:
+    * "bigquery" (default): Google BigQuery
+    * "local": in-process DuckDB stand-in, e.g. for offline development and measurements
+    :param project_id: str | (optional) GCP project-id
+    :return: bigquery.Client or a client implementing the used subset of it
+    """
+    backend = (os.getenv("BIGQUERY_BACKEND") or "bigquery").lower()
+    if (client_factory := BIGQUERY_BACKENDS.get(backend)) is None:
+        raise ValueError(f"Unknown BIGQUERY_BACKEND: {backend}")
+    return client_factory(project_id)
+
+
+def create_google_bigquery_client(project_id: str = None) -> bigquery.Client:
+    """
+    create a BigQuery client with a pooled HTTP transport, sized to the concurrency of the worker
+    :param project_id: str | (optional) GCP project-id, default project of the credentials is used otherwise
+    :return: bigquery.Client
+    """
+    import google.auth
+    from google.auth.transport.requests import AuthorizedSession
+    from requests.adapters import HTTPAdapter
+
+    credentials, _ = google.auth.default(scopes=bigquery.Client.SCOPE)
+    http_session = AuthorizedSession(credentials)
+    http_session.mount(
+        "https://",
+        HTTPAdapter(pool_connections=1, pool_maxsize=get_http_pool_size()),
+    )
+    return bigquery.Client(
+        project=project_id, credentials=credentials, _http=http_session
+    )
+
+
+def create_local_bigquery_client(project_id: str = None):
+    """
+    create the DuckDB-backed stand-in for bigquery.Client, kept in memory unless env-var
+    LOCAL_BIGQUERY_DATABASE names a database file
+    :param project_id: str | (optional) project-id reported by the client
+    :return: LocalBigQueryClient
+    """
+    from app.gcp.big_query.local_backend import LocalBigQueryClient
+
+    return LocalBigQueryClient(
+        project=project_id, database=os.getenv("LOCAL_BIGQUERY_DATABASE") or ":memory:"
+    )
+
+
+BIGQUERY_BACKENDS = {
+    "bigquery": create_google_bigquery_client,
+    "local": create_local_bigquery_client,
+}
+
+
+def create_bigquery_read_client(project_id: str = None):
+    """
+    create a client for the BigQuery Storage Read API, used for fast Arrow-based downloads of results
+    :param project_id: str | (optional) GCP project-id, unused as read-sessions are billed to the query project
+    :return: BigQueryReadClient, None if google-cloud-bigquery-storage is not installed
+    """
+    if (os.getenv("BIGQUERY_BACKEND") or "bigquery").lower() != "bigquery":
+        return None
+    try:
+        from google.cloud import bigquery_storage
+    except ImportError:
+        print("google-cloud-bigquery-storage not installed, falling back to REST for downloading results")
+        return None
+    return bigquery_storage.BigQueryReadClient()
+
+
+def create_bigquery_write_client(project_id: str = None):
+    """
+    create a client for the BigQuery Storage Write API, used for streaming ingest
+    :param project_id: str | (optional) GCP project-id, unused as write-streams are bound to their table
+    :return: BigQueryWriteClient, None if google-cloud-bigquery-storage is not installed
+    """
+    if (os.getenv("BIGQUERY_BACKEND") or "bigquery").lower() != "bigquery":
+        return None
+    try:
+        from google.cloud import bigquery_storage_v1
+    except ImportError:
+        print("google-cloud-bigquery-storage not installed, streaming ingest is not available")
+        return None
+    return bigquery_storage_v1.BigQueryWriteClient()
+
+
+def get_blocking_calls_semaphore() -> asyncio.Semaphore:
+    """
+    semaphore of the running event loop bounding the blocking calls of the async paths to the size of anyio's
+    threadpool, read on first use: the CapacityLimiter of anyio 3.x can lend more tokens than it has under
+    contention, as a token released to a waiting task can be taken by a new one before the waiting task wakes
+    up, while asyncio.Semaphore checks again on wake-up
+    :return: asyncio.Semaphore
+    """
+    try:
+        return _blocking_calls_semaphore.get()
+    except LookupError:
+        semaphore = asyncio.Semaphore(to_thread.current_default_thread_limiter().total_tokens)
+        _blocking_calls_semaphore.set(semaphore)
+        return semaphore
+
+
+def get_page_token_secret() -> bytes:
+    """
+    key of the signatures of page-tokens, set using env-var PAGE_TOKEN_SECRET; it must be the same for all
+    workers and instances serving the API, so a token issued by one of them is valid on the others
+    :return: bytes, raises ValueError if it isn't set
+    """
+    if not (secret := os.getenv("PAGE_TOKEN_SECRET")):
+        raise ValueError("PAGE_TOKEN_SECRET must be set to sign page-tokens")
+    return secret.encode()
+
+
+def encode_page_token(sql_query: str, destination: str, start_index: int) -> str:
+    """
+    encode a cursor to a page of a query's results, signed so clients can't point it to other tables
+    :param sql_query: str | SQL query the results belong to
+    :param destination: str | table-id of the query-job's destination table
+    :param start_index: int | index of the first row of the page
+    :return: str | url-safe page-token
+    """
+    _cursor = base64.urlsafe_b64encode(
+        json.dumps(
+            {
+                "query_hash": _get_query_hash(sql_query),
+                "destination": destination,
+                "start_index": start_index,
+            }
+        ).encode()
+    ).decode()
+    return f"{_cursor}.{_sign_page_cursor(_cursor)}"
+
+
+def decode_page_token(sql_query: str, page_token: str) -> dict:
+    """
+    decode a cursor created by encode_page_token, validating its signature and that it belongs to the query
+    :param sql_query: str | SQL query the results belong to
+    :param page_token: str | url-safe page-token
+    :return: dict | with keys destination and start_index, raises ValueError for invalid page-tokens
+    """
+    _cursor, _, _signature = page_token.rpartition(".")
+    if not hmac.compare_digest(_signature, _sign_page_cursor(_cursor)):
+        raise ValueError("Invalid page_token: signature doesn't match")
+    try:
+        _cursor = json.loads(base64.urlsafe_b64decode(_cursor.encode()))
+    except ValueError as e:
+        raise ValueError(f"Invalid page_token: {e}") from e
+    if _cursor.get("query_hash") != _get_query_hash(sql_query):
+        raise ValueError("page_token does not belong to this query")
+    return _cursor
+
+
+def _sign_page_cursor(cursor: str) -> str:
+    return hmac.new(get_page_token_secret(), cursor.encode(), hashlib.sha256).hexdigest()
+
+
+def _get_query_hash(sql_query: str) -> str:
+    return hashlib.sha256(normalize_sql(sql_query).encode()).hexdigest()
 
 
 class BigQueryClient(BaseClient):
     def __init__(self, project_id: str = None):
         super().__init__(project_id)
-        self.bq_client = bigquery.Client()
+        self.bq_client = get_shared_client(
+            client_type="bigquery",
+            project_id=self.project_id,
+            client_factory=create_bigquery_client,
+        )
+
+    @property
+    def bqstorage_client(self):
+        """
+        shared BigQuery Storage Read API client, None if it's not available
+        """
+        return get_shared_client(
+            client_type="bigquery_storage",
+            project_id=self.project_id,
+            client_factory=create_bigquery_read_client,
+        )
+
+    @property
+    def bqwrite_client(self):
+        """
+        shared BigQuery Storage Write API client, None if it's not available
+        """
+        return get_shared_client(
+            client_type="bigquery_write",
+            project_id=self.project_id,
+            client_factory=create_bigquery_write_client,
+        )
+
+    @property
+    def table_replicas(self):
+        """
+        shared local replicas of the tables configured in replica_tables.json, None if there are none
+        """
+        return get_shared_client(
+            client_type="table_replicas",
+            project_id=self.project_id,
+            client_factory=create_table_replicas,
+        )
+
+    def query_table_replicas(self, sql_query: str, query_parameters: list = None):
+        """
+        answer a read-only query from the local table replicas, if it only reads replicated tables
+        :param sql_query: str | SQL query as plaintext
+        :param query_parameters: list | (optional) query parameters referenced in the query
+        :return: RowIterator-like results, None if the query has to go to BigQuery
+        """
+        if (table_replicas := self.table_replicas) is None:
+            return None
+        return table_replicas.query(
+            client=self, sql_query=sql_query, query_parameters=query_parameters
+        )
+
+    def refresh_table_replicas(self) -> None:
+        """
+        download outdated table replicas, e.g. on startup so the first queries are answered locally
+        :return:
+        """
+        if (table_replicas := self.table_replicas) is not None:
+            table_replicas.refresh_all(client=self)
+
+    def convert_row_iterator(
+        self, row_iterator: bigquery.table.RowIterator, result_format: str = "pandas"
+    ):
+        """
+        download the rows of a RowIterator in the requested format
+        arrow/pandas downloads use parallel Storage Read API streams when available
+        :param row_iterator: RowIterator | results of a finished query-job or list_rows call
+        :param result_format: str | one of:
+            * "pandas": pd.DataFrame
+            * "arrow": pyarrow.Table
+            * "arrow_batches": iterator of pyarrow.RecordBatch, for results too large to hold in memory
+            * "rows": list of dicts
+            * "json": list of dicts, with json-compatible values
+        :return: results in requested format
+        """
+        _bqstorage_kwargs = {
+            "bqstorage_client": self.bqstorage_client,
+            "create_bqstorage_client": False,
+        }
+        if result_format == "pandas":
+            return row_iterator.to_dataframe(**_bqstorage_kwargs)
+        elif result_format == "arrow":
+            return row_iterator.to_arrow(**_bqstorage_kwargs)
+        elif result_format == "arrow_batches":
+            return row_iterator.to_arrow_iterable(
+                bqstorage_client=self.bqstorage_client
+            )
+        elif result_format == "rows":
+            return [dict(row.items()) for row in row_iterator]
+        elif result_format == "json":
+            return row_iterator.to_dataframe(**_bqstorage_kwargs).to_dict(
+                orient="records"
+            )
+        raise ValueError(f"Unknown result_format: {result_format}")
+
+    def get_query_results(self, sql_query: str, result_format: str = "pandas"):
+        """
+        execute an SQL query and download its results in the requested format
+        :param sql_query: str | SQL query as plaintext
+        :param result_format: str | pandas/arrow/arrow_batches/rows/json, see convert_row_iterator
+        :return: results in requested format
+        """
+        return self.convert_row_iterator(
+            row_iterator=self.bq_client.query(sql_query).result(),
+            result_format=result_format,
+        )
 
     def get_dataset_tables_list(
         self, dataset_name: str, stdout_print: bool = True
@@ -39,50 +333,457 @@ class BigQueryClient(BaseClient):
 
     def get_select_query_results(
         self,
-        select_query: str,
+        select_query: str = None,
         limit: int = None,
         pretty_print: bool = False,
-    ) -> dict:
+        table_id: str = None,
+        columns: list = None,
+        predicates: list = None,
+        partition_field: str = None,
+        partition_range: tuple = None,
+        order_by: list = None,
+    ) -> list:
         """
         get results from executing a select query on a BigQuery table
         optionally also pretty prints the result
+        instead of a raw select_query, the read can be described by table_id, columns, predicates,
+        partition_range and order_by: the query is built by SelectQueryBuilder with parameterized values,
+        reading only the needed columns and partitions. Without predicates or order, rows are read
+        directly from the table, which scans no bytes at all; columns are matched case-insensitively like in
+        queries, unknown columns raise a ValueError
         :param select_query: str|query to be executed on the table
-        :param limit: int|number of records to fetch, if a value>100 is passed, limit=100 is used, default=10
+        :param limit: int|(optional) max number of records to fetch
         :param pretty_print: bool|should the result be pretty-printed, default=False
-        :return: dict|query results
-        """
-        if limit is not None:
-            select_query = f"{select_query} LIMIT {limit}"
-            query_results = self.execute_query(sql_query=select_query)
-            query_results = (
-                query_results.get("results").to_dataframe()
-                if query_results.get("errors") is None
-                else {}
-            )
-            if pretty_print:
-                pretty_print_df(dataframe=query_results)
-            return json.loads(query_results.to_json(orient="records"))
+        :param table_id: str|(optional) full table-id to read from, instead of select_query
+        :param columns: list|(optional) columns to read, all if None
+        :param predicates: list|(optional) tuples of (column, operator, value), see SelectQueryBuilder.where
+        :param partition_field: str|(optional) partitioning column, None for ingestion-time partitioned tables
+        :param partition_range: tuple|(optional) (start, end) of partitions to read, end exclusive
+        :param order_by: list|(optional) columns to order by, prefixed with "-" for descending order
+        :return: list|query results as records
+        """
+        query_parameters = None
+        if table_id:
+            query_builder = SelectQueryBuilder(table_id=table_id, columns=columns)
+            for _predicate in predicates or []:
+                query_builder.where(*_predicate)
+            if partition_range:
+                query_builder.partition_range(*partition_range, partition_field=partition_field)
+            query_builder.order_by(*(order_by or []))
+            if not query_builder.has_filters and not any("." in _col for _col in columns or []):
+                table = self.bq_client.get_table(query_builder.table_id)
+                selected_fields = None
+                if columns:
+                    fields = {_field.name.lower(): _field for _field in table.schema}
+                    if unknown_columns := [_col for _col in columns if _col.lower() not in fields]:
+                        raise ValueError(f"Unknown columns of {query_builder.table_id}: {unknown_columns}")
+                    selected_fields = [fields[_col.lower()] for _col in columns]
+                row_iterator = self.bq_client.list_rows(
+                    table, selected_fields=selected_fields, max_results=limit
+                )
+                return self._get_select_results(row_iterator, pretty_print=pretty_print, columns=columns)
+            select_query, query_parameters = query_builder.limit(limit).build()
+        elif limit is not None:
+            select_query = f"{select_query} LIMIT {int(limit)}"
+        query_results = self.execute_query(
+            sql_query=select_query, query_parameters=query_parameters
+        )
+        if (_error := query_results.get("error")) is not None:
+            print(f"Exception occurred: {_error}")
+            return []
+        return self._get_select_results(query_results.get("results"), pretty_print=pretty_print)
 
-    def execute_query(self, sql_query: str, as_json: bool = False) -> dict:
+    def _get_select_results(
+        self, row_iterator: bigquery.table.RowIterator, pretty_print: bool = False, columns: list = None
+    ) -> list:
+        query_results = self.convert_row_iterator(row_iterator)
+        if columns:
+            # listed rows have the columns in order and case of the table-schema, not as requested
+            _schema_columns = {_col.lower(): _col for _col in query_results.columns}
+            query_results = query_results[[_schema_columns[_col.lower()] for _col in columns]]
+            query_results.columns = columns
+        if pretty_print:
+            pretty_print_df(dataframe=query_results)
+        return json.loads(query_results.to_json(orient="records"))
+
+    def execute_query(
+        self,
+        sql_query: str,
+        as_json: bool = False,
+        use_cache: bool = True,
+        query_parameters: list = None,
+    ) -> dict:
         """
         execute an SQL query on a GBQ table of project
+        json-results of deterministic SELECT-queries are served from the query-result-cache while
+        the tables they read are unmodified, or from local replicas if they only read replicated tables
         :param sql_query: str | SQL query as plaintext
         :param as_json: bool | (optional, default=False) return type
+        :param use_cache: bool | (optional, default=True) use the query-result-cache for json-results
+        :param query_parameters: list | (optional) ScalarQueryParameter/ArrayQueryParameter referenced in the query
         :return: Union[dict, RowIterator], depending on as_json param
         """
         try:
-            query_job = self.bq_client.query(sql_query)
+            if as_json and (
+                    replica_results := self.query_table_replicas(
+                        sql_query=sql_query, query_parameters=query_parameters
+                    )
+            ) is not None:
+                # rows like the async path, so NULLs stay None instead of becoming NaN in a dataframe
+                return {
+                    "errors": None,
+                    "results": self.convert_row_iterator(replica_results, result_format="rows"),
+                }
+            cache_key = (
+                self.get_query_cache_key(
+                    sql_query=sql_query, query_parameters=query_parameters, result_format="json"
+                )
+                if as_json and use_cache
+                else None
+            )
+            if cache_key and (cached_results := query_result_cache.get(cache_key)) is not None:
+                return {"errors": None, "results": cached_results}
+            query_job = self.bq_client.query(
+                sql_query,
+                job_config=bigquery.QueryJobConfig(query_parameters=query_parameters or []),
+            )
             query_results = query_job.result()
-            return {
+            if not as_json:
+                return {"errors": None, "results": query_results}
+            records = self.convert_row_iterator(query_results, result_format="json")
+            if cache_key:
+                query_result_cache.put(cache_key, records)
+            return {"errors": None, "results": records}
+        except Exception as e:
+            print(f"Exception occurred: {e}")
+            return {"error": e}
+
+    def get_query_cache_key(
+        self, sql_query: str, query_parameters: list = None, result_format: str = "json"
+    ) -> str:
+        """
+        return the query-result-cache key for a query, made of the normalized query, its parameters and
+        the modified-timestamps of the tables it reads, which are cached for TABLE_MODIFIED_TTL_SECONDS
+        queries of views and external tables are not cached, as their modified-timestamps don't change with
+        the data they read
+        :param sql_query: str | SQL query as plaintext
+        :param query_parameters: list | (optional) query parameters referenced in the query
+        :param result_format: str | (optional, default="json") format of the cached results,
+            see convert_row_iterator
+        :return: str | cache-key, None if the query can't be cached
+        """
+        normalized_sql = normalize_sql(sql_query)
+        if not is_cacheable_query(normalized_sql) or not (
+                table_ids := get_referenced_tables(normalized_sql)
+        ):
+            return None
+        tables_modified = {}
+        for _table_id in table_ids:
+            _table_id = _table_id if _table_id.count(".") == 2 else f"{self.project_id}.{_table_id}"
+            if (_table_modified := table_modified_cache.get(_table_id)) is None:
+                try:
+                    _table = self.bq_client.get_table(_table_id)
+                except Exception as e:
+                    # e.g. a qualified column like in EXTRACT(YEAR FROM t.created_at), taken for a table
+                    print(f"Query results are not cached, as {_table_id} could not be looked up: {e}")
+                    return None
+                _table_modified = (_table.modified, _table.table_type)
+                table_modified_cache.put(_table_id, _table_modified)
+            _modified, _table_type = _table_modified
+            if _table_type != "TABLE":
+                return None
+            tables_modified[_table_id] = _modified
+        if query_parameters:
+            normalized_sql += json.dumps(
+                [_parameter.to_api_repr() for _parameter in query_parameters], default=str
+            )
+        return get_query_cache_key(
+            normalized_sql=normalized_sql, tables_modified=tables_modified, result_format=result_format
+        )
+
+    def estimate_query_bytes(self, sql_query: str, use_cache: bool = True) -> int:
+        """
+        estimate the bytes a query will process using a dry-run, which is free and doesn't run the query
+        estimates are cached by normalized query for QUERY_ESTIMATE_TTL_SECONDS
+        :param sql_query: str | SQL query as plaintext
+        :param use_cache: bool | (optional, default=True) use cached estimates
+        :return: int | total_bytes_processed of the dry-run, raises if the query is invalid
+        """
+        cache_key = _get_query_hash(sql_query)
+        if use_cache and (estimated_bytes := query_estimate_cache.get(cache_key)) is not None:
+            return estimated_bytes
+        dry_run_job = self.bq_client.query(
+            sql_query,
+            job_config=bigquery.QueryJobConfig(dry_run=True, use_query_cache=False),
+        )
+        estimated_bytes = dry_run_job.total_bytes_processed or 0
+        query_estimate_cache.put(cache_key, estimated_bytes)
+        return estimated_bytes
+
+    def check_query_budget(self, sql_query: str, caller: str = None) -> QueryBudgetReservation:
+        """
+        estimate the bytes a query will process and admit it against the per-request and per-caller budgets
+        no dry-run is made if no budget is configured
+        :param sql_query: str | SQL query as plaintext
+        :param caller: str | (optional) identifier of the caller, charged with the estimate
+        :return: QueryBudgetReservation | with the estimated bytes, None if no budget is configured;
+            raises QueryBudgetExceeded if a budget would be exceeded
+        """
+        if not query_budget.enabled:
+            return None
+        estimated_bytes = self.estimate_query_bytes(sql_query=sql_query)
+        return query_budget.reserve(estimated_bytes=estimated_bytes, caller=caller)
+
+    async def check_query_budget_async(self, sql_query: str, caller: str = None) -> QueryBudgetReservation:
+        """
+        check_query_budget without blocking the event-loop during the dry-run
+        :param sql_query: str | SQL query as plaintext
+        :param caller: str | (optional) identifier of the caller, charged with the estimate
+        :return: QueryBudgetReservation | with the estimated bytes, None if no budget is configured;
+            raises QueryBudgetExceeded if a budget would be exceeded
+        """
+        if not query_budget.enabled:
+            return None
+        return await self._run_blocking(self.check_query_budget, sql_query, caller)
+
+    @staticmethod
+    def refund_query_budget(budget_reservation: QueryBudgetReservation = None) -> None:
+        """
+        refund a reservation of check_query_budget, for queries that failed or scanned no bytes
+        :param budget_reservation: QueryBudgetReservation | (optional) nothing is refunded without
+        """
+        query_budget.release(budget_reservation)
+
+    async def execute_query_async(
+        self,
+        sql_query: str,
+        as_json: bool = False,
+        poll_interval: float = 0.2,
+        max_poll_interval: float = 2.0,
+        use_cache: bool = True,
+        budget_reservation: QueryBudgetReservation = None,
+    ) -> dict:
+        """
+        execute an SQL query on a GBQ table of project, without holding a thread while the job runs:
+        the job is submitted, its state is polled with backoff, and result-pages are fetched one at a time
+        :param sql_query: str | SQL query as plaintext
+        :param as_json: bool | (optional, default=False) return type
+        :param poll_interval: float | (optional) initial seconds between job-state polls
+        :param max_poll_interval: float | (optional) upper bound for seconds between job-state polls
+        :param use_cache: bool | (optional, default=True) use the query-result-cache for json-results
+        :param budget_reservation: QueryBudgetReservation | (optional) of check_query_budget, refunded if the
+            query fails or the results are served from the query-result-cache, replicas or BigQuery's cache
+        :return: Union[dict, RowIterator], depending on as_json param
+        """
+        try:
+            if as_json and (
+                    replica_results := await self._run_blocking(self.query_table_replicas, sql_query)
+            ) is not None:
+                self.refund_query_budget(budget_reservation)
+                return {
+                    "errors": None,
+                    "results": self.convert_row_iterator(replica_results, result_format="rows"),
+                }
+            cache_key = (
+                await self._run_blocking(
+                    functools.partial(self.get_query_cache_key, sql_query, result_format="rows")
+                )
+                if as_json and use_cache
+                else None
+            )
+            if cache_key and (cached_results := query_result_cache.get(cache_key)) is not None:
+                self.refund_query_budget(budget_reservation)
+                return {"errors": None, "results": cached_results}
+            query_job = await self.submit_query_async(sql_query=sql_query)
+            await self.wait_for_job_async(
+                gbq_job=query_job,
+                poll_interval=poll_interval,
+                max_poll_interval=max_poll_interval,
+            )
+            if budget_reservation is not None and query_job.cache_hit:
+                self.refund_query_budget(budget_reservation)
+            if not as_json:
+                return {"errors": None, "results": await self._run_blocking(query_job.result)}
+            records = []
+            async for page in self.iter_result_pages_async(query_job=query_job):
+                records.extend(dict(row.items()) for row in page)
+            if cache_key:
+                query_result_cache.put(cache_key, records)
+            return {"errors": None, "results": records}
+        except Exception as e:
+            print(f"Exception occurred: {e}")
+            self.refund_query_budget(budget_reservation)
+            return {"error": e}
+
+    async def submit_query_async(self, sql_query: str) -> bigquery.QueryJob:
+        """
+        submit a query-job without waiting for it to finish
+        :param sql_query: str | SQL query as plaintext
+        :return: bigquery.QueryJob
+        """
+        return await self._run_blocking(self.bq_client.query, sql_query)
+
+    async def wait_for_job_async(
+        self,
+        gbq_job: bigquery.job._AsyncJob,
+        poll_interval: float = 0.2,
+        max_poll_interval: float = 2.0,
+    ) -> bigquery.job._AsyncJob:
+        """
+        await completion of a GBQ job, sleeping on the event-loop between short job-state polls
+        :param gbq_job: job to wait for
+        :param poll_interval: float | initial seconds between polls, doubled after every poll
+        :param max_poll_interval: float | upper bound for seconds between polls
+        :return: finished job, raises the job's exception if it failed
+        """
+        while gbq_job.state != "DONE":
+            await asyncio.sleep(poll_interval)
+            poll_interval = min(poll_interval * 2, max_poll_interval)
+            await self._run_blocking(gbq_job.reload)
+        if gbq_job.error_result:
+            raise gbq_job.exception() or Exception(gbq_job.error_result)
+        return gbq_job
+
+    async def execute_query_page_async(
+        self,
+        sql_query: str,
+        page_size: int,
+        page_token: str = None,
+        budget_reservation: QueryBudgetReservation = None,
+    ) -> dict:
+        """
+        execute an SQL query and return one page of its results, with a cursor to the next page
+        pages are read from the destination table of the query-job, so the query is not re-run for later pages;
+        page-tokens point to the first row of their page, so the tokens of all pages returned with the first
+        one can be used in parallel
+        :param sql_query: str | SQL query as plaintext
+        :param page_size: int | max number of rows in the page
+        :param page_token: str | (optional) cursor returned with a previous page, first page if None
+        :param budget_reservation: QueryBudgetReservation | (optional) of check_query_budget for the first page,
+            refunded if the query fails or the results are served from BigQuery's cache
+        :return: dict | with keys errors, results, total_rows, next_page_token and, for the first page,
+            page_tokens of the following pages (up to MAX_PAGE_TOKENS); raises ValueError for invalid page-tokens
+        """
+        _cursor = decode_page_token(sql_query=sql_query, page_token=page_token) if page_token else None
+        try:
+            if _cursor:
+                destination, start_index = _cursor.get("destination"), int(_cursor.get("start_index") or 0)
+            else:
+                query_job = await self.submit_query_async(sql_query=sql_query)
+                await self.wait_for_job_async(gbq_job=query_job)
+                if budget_reservation is not None and query_job.cache_hit:
+                    self.refund_query_budget(budget_reservation)
+                destination = (
+                    f"{query_job.destination.project}."
+                    f"{query_job.destination.dataset_id}."
+                    f"{query_job.destination.table_id}"
+                )
+                start_index = 0
+            row_iterator = await self._run_blocking(
+                functools.partial(
+                    self.bq_client.list_rows, destination, page_size=page_size, start_index=start_index
+                )
+            )
+            page = await self._run_blocking(next, iter(row_iterator.pages), [])
+            records = [dict(row.items()) for row in page]
+            next_start_index = start_index + len(records)
+            if (total_rows := row_iterator.total_rows) is None:
+                # not reported by the API, only known to go on if there's a next page
+                total_rows = next_start_index + (1 if row_iterator.next_page_token else 0)
+            query_page = {
                 "errors": None,
-                "results": query_results.to_dataframe().to_dict(orient="records")
-                if as_json
-                else query_results,
+                "results": records,
+                "total_rows": total_rows,
+                "next_page_token": encode_page_token(
+                    sql_query=sql_query, destination=destination, start_index=next_start_index
+                )
+                if records and next_start_index < total_rows
+                else None,
             }
+            if not _cursor:
+                query_page["page_tokens"] = [
+                    encode_page_token(sql_query=sql_query, destination=destination, start_index=_start_index)
+                    for _start_index in range(page_size, total_rows, page_size)[:MAX_PAGE_TOKENS]
+                ]
+            return query_page
         except Exception as e:
             print(f"Exception occurred: {e}")
+            self.refund_query_budget(budget_reservation)
             return {"error": e}
 
+    async def iter_result_pages_async(
+        self, query_job: bigquery.QueryJob, page_size: int = None
+    ):
+        """
+        async-generator over the result-pages of a finished query-job, each page is fetched on demand
+        :param query_job: bigquery.QueryJob | finished query-job
+        :param page_size: int | (optional) max number of rows per page
+        :return: AsyncGenerator of pages, each page being an iterable of Rows
+        """
+        row_iterator = await self._run_blocking(
+            functools.partial(query_job.result, page_size=page_size)
+        )
+        pages = iter(row_iterator.pages)
+        while (page := await self._run_blocking(next, pages, None)) is not None:
+            yield page
+
+    async def execute_query_ndjson_stream(
+        self, sql_query: str, page_size: int = 10000, budget_reservation: QueryBudgetReservation = None
+    ):
+        """
+        execute an SQL query and return its results as a stream of newline-delimited JSON
+        the job is awaited before returning, so failing queries raise here instead of mid-stream
+        :param sql_query: str | SQL query as plaintext
+        :param page_size: int | (optional) max number of rows fetched and encoded at a time
+        :param budget_reservation: QueryBudgetReservation | (optional) of check_query_budget, refunded if the
+            query fails or the results are served from BigQuery's cache
+        :return: AsyncGenerator of bytes, one chunk per result-page
+        """
+        try:
+            query_job = await self.submit_query_async(sql_query=sql_query)
+            await self.wait_for_job_async(gbq_job=query_job)
+        except Exception:
+            self.refund_query_budget(budget_reservation)
+            raise
+        if budget_reservation is not None and query_job.cache_hit:
+            self.refund_query_budget(budget_reservation)
+        return self.iter_ndjson_pages_async(query_job=query_job, page_size=page_size)
+
+    async def iter_ndjson_pages_async(
+        self, query_job: bigquery.QueryJob, page_size: int = None
+    ):
+        """
+        async-generator over the result-pages of a finished query-job, encoded as newline-delimited JSON
+        :param query_job: bigquery.QueryJob | finished query-job
+        :param page_size: int | (optional) max number of rows per page
+        :return: AsyncGenerator of bytes
+        """
+        async for page in self.iter_result_pages_async(
+                query_job=query_job, page_size=page_size
+        ):
+            # encoding a page takes long enough to stall other requests if it ran on the event-loop
+            yield await self._run_blocking(self.encode_ndjson_page, page)
+
+    @staticmethod
+    def encode_ndjson_page(page) -> bytes:
+        """
+        encode a page of rows as newline-delimited JSON, non-json values as strings
+        :param page: iterable of Rows
+        :return: bytes
+        """
+        return "".join(
+            f"{json.dumps(dict(row.items()), default=str)}\n" for row in page
+        ).encode()
+
+    @staticmethod
+    async def _run_blocking(func, *args):
+        """
+        run a short blocking call (single API request) in a worker thread of anyio, bounded by the same
+        limiter as starlette's threadpool, see THREADPOOL_SIZE, and by get_blocking_calls_semaphore
+        """
+        async with get_blocking_calls_semaphore():
+            return await to_thread.run_sync(functools.partial(func, *args))
+
 
 if __name__ == "__main__":
     _query = """
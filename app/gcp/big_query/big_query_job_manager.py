@@ -0,0 +1,390 @@
+"""
+class to run many BigQuery query/load jobs concurrently, tracked as futures
+"""
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Callable
+import heapq
+import itertools
+import os
+import threading
+import time
+
+from google.api_core import exceptions as api_exceptions
+from google.cloud import bigquery
+import pandas as pd
+
+from app.gcp.base_client import get_shared_client
+from app.gcp.big_query.big_query_client import BigQueryClient
+
+# rank of job priorities in the local queue, INTERACTIVE jobs are started first
+PRIORITY_RANKS = {
+    bigquery.QueryPriority.INTERACTIVE: 0,
+    bigquery.QueryPriority.BATCH: 1,
+}
+QUOTA_ERROR_REASONS = ("quotaExceeded", "rateLimitExceeded")
+
+
+def is_quota_error(error: Exception) -> bool:
+    """
+    check if an API error was caused by exceeded quotas/rate-limits, i.e. the job can be retried later
+    :param error: Exception
+    :return: bool
+    """
+    if isinstance(error, api_exceptions.TooManyRequests):
+        return True
+    if isinstance(error, api_exceptions.Forbidden):
+        _reasons = {_error.get("reason") for _error in getattr(error, "errors", None) or []}
+        return bool(_reasons & set(QUOTA_ERROR_REASONS)) or any(
+            _reason in str(error) for _reason in QUOTA_ERROR_REASONS
+        )
+    return False
+
+
+class ProjectJobLimiter:
+    """
+    concurrency of the GBQ jobs of a project, shared by all job managers of the process, see get_job_limiter:
+    * at most max_concurrent_jobs jobs run at the same time
+    * quota/rate-limit errors halve the concurrency and hold back new jobs for a growing backoff,
+      every successfully finished job raises the concurrency by one again
+    """
+
+    def __init__(
+        self,
+        max_concurrent_jobs: int,
+        min_backoff_seconds: float = 1.0,
+        max_backoff_seconds: float = 60.0,
+    ):
+        self.max_concurrent_jobs = max_concurrent_jobs
+        self.min_backoff_seconds = min_backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.concurrency = max_concurrent_jobs
+        self.running = 0
+        self._backoff_seconds = 0.0
+        self._backoff_until = 0.0
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> bool:
+        """
+        take a slot for a job, if the concurrency and backoff allow one more
+        :return: bool | True if a slot was taken, to be returned with release
+        """
+        with self._lock:
+            if time.monotonic() < self._backoff_until or self.running >= self.concurrency:
+                return False
+            self.running += 1
+            return True
+
+    def release(self, succeeded: bool = False, quota_error: bool = False) -> None:
+        """
+        return the slot of a job
+        :param succeeded: bool | the job finished successfully, raising the concurrency again
+        :param quota_error: bool | the job hit a quota/rate-limit error, applying backpressure
+        :return:
+        """
+        with self._lock:
+            self.running = max(self.running - 1, 0)
+            if quota_error:
+                self._backoff_seconds = min(
+                    max(self._backoff_seconds * 2, self.min_backoff_seconds), self.max_backoff_seconds
+                )
+                self._backoff_until = time.monotonic() + self._backoff_seconds
+                self.concurrency = max(self.concurrency // 2, 1)
+            elif succeeded:
+                self.concurrency = min(self.concurrency + 1, self.max_concurrent_jobs)
+                self._backoff_seconds = 0.0
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "running": self.running,
+                "concurrency": self.concurrency,
+                "backoff_seconds": self._backoff_seconds,
+            }
+
+
+def get_job_limiter(project_id: str) -> ProjectJobLimiter:
+    """
+    return the process-wide job limiter of a project, capped by env-var BQ_MAX_CONCURRENT_JOBS (default=50)
+    :param project_id: str | GCP project-id
+    :return: ProjectJobLimiter
+    """
+    return get_shared_client(
+        client_type="bigquery_job_limiter",
+        project_id=project_id,
+        client_factory=lambda _: ProjectJobLimiter(
+            max_concurrent_jobs=int(os.getenv("BQ_MAX_CONCURRENT_JOBS") or 50)
+        ),
+    )
+
+
+def get_job_manager(project_id: str) -> "BigQueryJobManager":
+    """
+    return the process-wide job manager of a project, shut down with the other shared clients
+    :param project_id: str | GCP project-id
+    :return: BigQueryJobManager
+    """
+    return get_shared_client(
+        client_type="bigquery_job_manager",
+        project_id=project_id,
+        client_factory=lambda _project_id: BigQueryJobManager(project_id=_project_id),
+    )
+
+
+class BigQueryJobManager(BigQueryClient):
+    """
+    submits many query/load jobs and tracks them as futures:
+    * jobs wait in a local queue in which INTERACTIVE jobs go before BATCH jobs, and are started while the
+      limiter of the project allows, see ProjectJobLimiter
+    * states of running jobs are polled in parallel by a background thread, one jobs.get request per running
+      job and poll, instead of a blocking wait per job
+    * on quota/rate-limit errors the job is re-queued and the limiter applies backpressure
+    """
+
+    def __init__(
+        self,
+        project_id: str = None,
+        poll_interval: float = 1.0,
+        max_start_threads: int = 16,
+    ):
+        super().__init__(project_id=project_id)
+        self.limiter = get_job_limiter(self.project_id)
+        self.poll_interval = poll_interval
+        self._pending = []  # heap of (priority-rank, sequence, job_factory, future, started)
+        self._sequence = itertools.count()
+        self._running = {}  # job_id: (job, queue-entry)
+        self._futures = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        # starts jobs and polls their states, as both are blocking API requests
+        self._dispatcher = ThreadPoolExecutor(
+            max_workers=max_start_threads, thread_name_prefix="bq-job-start"
+        )
+        self._poller = threading.Thread(
+            target=self._poll_loop, name="bq-job-poller", daemon=True
+        )
+        self._poller.start()
+
+    def submit_query(
+        self,
+        sql_query: str,
+        priority: str = bigquery.QueryPriority.INTERACTIVE,
+        job_config: bigquery.QueryJobConfig = None,
+    ) -> Future:
+        """
+        queue a query-job
+        :param sql_query: str | SQL query as plaintext
+        :param priority: str | INTERACTIVE (default) or BATCH
+        :param job_config: bigquery.QueryJobConfig | (optional) further job options
+        :return: Future | resolves to the finished QueryJob, or raises its error
+        """
+        job_config = job_config or bigquery.QueryJobConfig()
+        job_config.priority = priority
+        return self.submit(
+            job_factory=lambda: self.bq_client.query(sql_query, job_config=job_config),
+            priority=priority,
+        )
+
+    def submit_load_from_dataframe(
+        self,
+        data_df: pd.DataFrame,
+        table_id: str,
+        job_config: bigquery.LoadJobConfig = None,
+        priority: str = bigquery.QueryPriority.INTERACTIVE,
+    ) -> Future:
+        """
+        queue a load-job of a dataframe, e.g. with the job-config of BigQueryTable.get_load_job_config
+        :param data_df: pd.DataFrame | data to load
+        :param table_id: str | full table-id
+        :param job_config: bigquery.LoadJobConfig | (optional) load-job options
+        :param priority: str | rank in the local queue, INTERACTIVE or BATCH
+        :return: Future | resolves to the finished LoadJob, or raises its error
+        """
+        return self.submit(
+            job_factory=lambda: self.bq_client.load_table_from_dataframe(
+                data_df, table_id, job_config=job_config, parquet_compression="snappy"
+            ),
+            priority=priority,
+        )
+
+    def submit(
+        self, job_factory: Callable, priority: str = bigquery.QueryPriority.INTERACTIVE
+    ) -> Future:
+        """
+        queue any GBQ job
+        :param job_factory: Callable | starts the job and returns it, called again if it hits a quota error
+        :param priority: str | rank in the local queue, INTERACTIVE or BATCH
+        :return: Future | resolves to the finished job, or raises its error
+        """
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("job manager is shut down")
+            heapq.heappush(
+                self._pending,
+                (PRIORITY_RANKS.get(priority, 0), next(self._sequence), job_factory, future, False),
+            )
+            self._futures.append(future)
+        self._wakeup.set()
+        return future
+
+    def wait_all(self, timeout: float = None) -> dict:
+        """
+        wait for all submitted jobs
+        :param timeout: float | (optional) max seconds to wait
+        :return: dict | with lists of done and not_done futures
+        """
+        with self._lock:
+            _futures = list(self._futures)
+        done, not_done = wait(_futures, timeout=timeout)
+        return {"done": list(done), "not_done": list(not_done)}
+
+    def shutdown(self, wait_for_jobs: bool = True) -> None:
+        """
+        stop accepting jobs and stop the poller, optionally after all queued jobs finished
+        without waiting, queued jobs are cancelled, and futures of started jobs fail, as they aren't polled
+        anymore; the jobs themselves keep running on BigQuery
+        :param wait_for_jobs: bool | wait for queued and running jobs first
+        :return:
+        """
+        if wait_for_jobs:
+            self.wait_all()
+        with self._lock:
+            self._closed = True
+        self._wakeup.set()
+        self._poller.join()
+        self._dispatcher.shutdown(wait=True)
+        with self._lock:
+            _pending, self._pending = self._pending, []
+            _running, self._running = self._running, {}
+        for _entry in _pending:
+            _future = _entry[3]
+            if not _future.cancel() and not _future.done():
+                # re-queued after a quota error, i.e. already running
+                _future.set_exception(RuntimeError("job manager was shut down before the job was restarted"))
+        for _job_id, (_job, _entry) in _running.items():
+            self.limiter.release()
+            _entry[3].set_exception(
+                RuntimeError(f"job manager was shut down before job {_job_id} finished")
+            )
+
+    def close(self) -> None:
+        self.shutdown(wait_for_jobs=False)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "pending": len(self._pending),
+                "running": len(self._running),
+                **{f"project_{_key}": _value for _key, _value in self.limiter.get_stats().items()},
+            }
+
+    def _poll_loop(self) -> None:
+        while True:
+            with self._lock:
+                if self._closed:
+                    return
+            try:
+                self._dispatch_pending()
+                self._poll_running()
+            except Exception as e:
+                # the poller must outlive errors, else futures of running and queued jobs never resolve
+                print(f"Exception caught while polling jobs: {e}")
+            self._wakeup.wait(timeout=self.poll_interval)
+            self._wakeup.clear()
+
+    def _dispatch_pending(self) -> None:
+        with self._lock:
+            while self._pending and self.limiter.try_acquire():
+                _entry = heapq.heappop(self._pending)
+                _future, _started = _entry[3], _entry[4]
+                if not _started and not _future.set_running_or_notify_cancel():
+                    self.limiter.release()
+                    continue
+                self._dispatcher.submit(self._start_job, _entry)
+
+    def _start_job(self, entry: tuple) -> None:
+        job_factory, future = entry[2], entry[3]
+        try:
+            job = job_factory()
+        except Exception as e:
+            with self._lock:
+                if is_quota_error(e):
+                    print(f"Quota error caught while starting job, re-queueing: {e}")
+                    self._requeue(entry)
+                    return
+            self.limiter.release()
+            future.set_exception(e)
+            return
+        with self._lock:
+            self._running[job.job_id] = (job, entry)
+        self._wakeup.set()
+
+    def _poll_running(self) -> None:
+        with self._lock:
+            _running = {_job_id: _job for _job_id, (_job, _) in self._running.items()}
+        if not _running:
+            return
+        # one jobs.get request per running job, run in parallel
+        for job_id, is_done in zip(_running, self._dispatcher.map(self._reload_job, _running.values())):
+            if not is_done:
+                continue
+            with self._lock:
+                if (_running_entry := self._running.pop(job_id, None)) is None:
+                    continue
+            self._resolve(*_running_entry)
+
+    @staticmethod
+    def _reload_job(job) -> bool:
+        """
+        refresh the state of a job, e.g. for QueryJob.destination/result() of the caller's job object
+        :return: bool | True if the job is done, or can't be polled anymore
+        """
+        try:
+            job.reload()
+        except api_exceptions.NotFound:
+            return True
+        except Exception as e:
+            print(f"Exception occurred while polling job {job.job_id}: {e}")
+            return False
+        return job.state == "DONE"
+
+    def _resolve(self, job, entry: tuple) -> None:
+        future = entry[3]
+        if job.state != "DONE":
+            self.limiter.release()
+            future.set_exception(Exception(f"Job {job.job_id} was not found anymore"))
+            return
+        if error_result := job.error_result:
+            if error_result.get("reason") in QUOTA_ERROR_REASONS:
+                print(f"Job {job.job_id} failed on quota, re-queueing: {error_result}")
+                with self._lock:
+                    self._requeue(entry)
+                return
+            self.limiter.release()
+            future.set_exception(
+                Exception(f"Job {job.job_id} failed: {error_result.get('message', error_result)}")
+            )
+            return
+        self.limiter.release(succeeded=True)
+        future.set_result(job)
+
+    def _requeue(self, entry: tuple) -> None:
+        """
+        put a job back into the queue after a quota error and apply backpressure, to be called holding the lock
+        """
+        _rank, _sequence, job_factory, future, _started = entry
+        heapq.heappush(self._pending, (_rank, _sequence, job_factory, future, True))
+        self.limiter.release(quota_error=True)
+
+
+if __name__ == "__main__":
+    job_manager = BigQueryJobManager()
+    futures = [
+        job_manager.submit_query(
+            sql_query=f"SELECT {i} AS n", priority=bigquery.QueryPriority.BATCH
+        )
+        for i in range(10)
+    ]
+    job_manager.shutdown()
+    print([list(future.result().result()) for future in futures])
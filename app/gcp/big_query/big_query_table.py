@@ -4,16 +4,45 @@ class to abstract interactions with BigQuery Tables
 from google.cloud import bigquery
 from google.cloud.exceptions import NotFound
 from app.gcp.big_query.big_query_client import BigQueryClient
+from app.gcp.big_query.big_query_job_manager import get_job_manager
+from app.gcp.big_query.big_query_stream_writer import BigQueryStreamWriter
+from app.gcp.big_query.query_builder import SelectQueryBuilder
+from app.gcp.big_query.query_cache import table_modified_cache
+from app.gcp.big_query.watermark_store import watermark_store
 from app.utils.data_string_utils import pretty_print_df
-from app.utils.gbq_utils import get_gbq_schema_from_json
+from app.utils.file_utils import write_ndjson
+from app.utils.gbq_utils import (
+    get_gbq_schema_from_json,
+    gbq_schema_registry,
+    update_write_disposition,
+)
 from app.models.models import GbqUploadResults
-from dotenv import load_dotenv
+from concurrent.futures import Future
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from functools import cached_property
 from typing import Union
 import pandas as pd
+import pyarrow as pa
 import json
+import os
+import tempfile
+import threading
+import time
+import uuid
 
 
 class BigQueryTable(BigQueryClient):
+    # lazily computed attributes, see invalidate()
+    CACHED_ATTRIBUTES = ("exists", "highest_pkey_value", "schema", "load_format")
+    # json/arrow uploads are spooled to disk beyond this size
+    NDJSON_SPOOL_MAX_BYTES = 64 * 1024 * 1024
+    # formats available for loading dataframes
+    LOAD_FORMATS = {
+        "parquet": bigquery.SourceFormat.PARQUET,
+        "csv": bigquery.SourceFormat.CSV,
+    }
+
     def __init__(
             self,
             project_id: str,
@@ -21,22 +50,233 @@ class BigQueryTable(BigQueryClient):
             table_name: str,
             p_key: str = None,
             schema_id: str = None,
+            watermark_partition_days: int = None,
+            metadata_ttl_seconds: float = None,
+            load_format: str = None,
     ):
         super().__init__(project_id=project_id)
-        load_dotenv()
         self.dataset_name = dataset_name
         self.table_name = table_name
         self.table_id = f"{self.project_id}.{self.dataset_name}.{self.table_name}"
         self.p_key = p_key
-        self.exists = self.check_exists()
-        self.highest_pkey_value = self.get_highest_pkey_value() if self.exists else None
-        self.schema = (
+        self.schema_id = schema_id
+        self.watermark_partition_days = watermark_partition_days
+        self._load_format = load_format
+        self.metadata_ttl_seconds = (
+            metadata_ttl_seconds
+            if metadata_ttl_seconds is not None
+            else float(os.getenv("TABLE_METADATA_TTL_SECONDS") or 60)
+        )
+        self._table_metadata = None
+        self._table_metadata_fetched_at = None
+        self._col_name_types_mapping = None
+        # the metadata is shared by threads of one instance, e.g. chunks of chunked uploads
+        self._metadata_lock = threading.RLock()
+
+    def get_table_metadata(self, refresh: bool = False) -> bigquery.Table:
+        """
+        return the Table resource of the table, shared by all metadata accessors
+        it's fetched at most once per metadata_ttl_seconds, schema-derived values are only rebuilt
+        if the etag of the refreshed resource changed
+        :param refresh: bool | fetch the resource even if the cached one is still fresh
+        :return: bigquery.Table, raises NotFound if table doesn't exist
+        """
+        with self._metadata_lock:
+            if (
+                    refresh
+                    or self._table_metadata is None
+                    or time.monotonic() - self._table_metadata_fetched_at > self.metadata_ttl_seconds
+            ):
+                try:
+                    table = self.bq_client.get_table(self.table_id)  # Make an API request.
+                except NotFound:
+                    self.clear_table_metadata()
+                    raise
+                self.set_table_metadata(table)
+            return self._table_metadata
+
+    def set_table_metadata(self, table: bigquery.Table) -> None:
+        """
+        cache a Table resource of the table, e.g. as returned by create_table
+        :param table: bigquery.Table
+        :return:
+        """
+        with self._metadata_lock:
+            if self._table_metadata is None or self._table_metadata.etag != table.etag:
+                self._col_name_types_mapping = None
+            self._table_metadata = table
+            self._table_metadata_fetched_at = time.monotonic()
+
+    def clear_table_metadata(self) -> None:
+        """
+        drop the cached Table resource, e.g. after the table was written to
+        :return:
+        """
+        table_modified_cache.delete(self.table_id)
+        with self._metadata_lock:
+            self._table_metadata = None
+            self._table_metadata_fetched_at = None
+            self._col_name_types_mapping = None
+
+    @cached_property
+    def exists(self) -> bool:
+        return self.check_exists()
+
+    @cached_property
+    def highest_pkey_value(self):
+        """
+        high-watermark of p_key, taken from the watermark-store and only queried if it's not known yet
+        """
+        if not self.p_key:
+            return None
+        if (watermark := watermark_store.get(self.table_id, self.p_key)) is not None:
+            return watermark
+        return self.refresh_highest_pkey_value() if self.exists else None
+
+    def refresh_highest_pkey_value(self):
+        """
+        query the highest p_key value and overwrite the stored watermark with it,
+        e.g. when the table was also written to by other processes
+        :return: highest p_key value
+        """
+        _highest_pkey_value = self.get_highest_pkey_value(
+            recent_partition_days=self.watermark_partition_days
+        )
+        watermark_store.set(self.table_id, self.p_key, _highest_pkey_value)
+        self.__dict__["highest_pkey_value"] = watermark_store.get(self.table_id, self.p_key)
+        return self.__dict__["highest_pkey_value"]
+
+    def advance_highest_pkey_value(self, data_df: Union[pd.DataFrame, list]):
+        """
+        advance the stored watermark with the highest p_key value of uploaded rows, no query needed
+        values are compared by the GBQ data-type of p_key, see get_comparable_pkey_values
+        :param data_df: pd.DataFrame or list of dicts | uploaded rows
+        :return: highest p_key value after the update
+        """
+        if isinstance(data_df, list):
+            if not self.p_key:
+                return None
+            data_df = pd.DataFrame(
+                {self.p_key: [_record.get(self.p_key) for _record in data_df]}
+            )
+        if not self.p_key or self.p_key not in data_df.columns:
+            return self.__dict__.get("highest_pkey_value")
+        p_key_values = self.get_comparable_pkey_values(data_df[self.p_key].dropna())
+        if p_key_values.empty:
+            return self.__dict__.get("highest_pkey_value")
+        self.__dict__["highest_pkey_value"] = watermark_store.advance(
+            self.table_id, self.p_key, p_key_values.max()
+        )
+        return self.__dict__["highest_pkey_value"]
+
+    def get_comparable_pkey_values(self, p_key_values: pd.Series) -> pd.Series:
+        """
+        convert p_key values for comparisons with the high-watermark, by the GBQ data-type of p_key (the
+        pandas dtype is no indicator, e.g. NUMERIC values and ISO-timestamp strings are both object dtype):
+        * STRING: lower-cased, like get_highest_pkey_value compares them
+        * TIMESTAMP/DATETIME/DATE: timestamps, TIMESTAMPs in UTC
+        * NUMERIC/BIGNUMERIC: Decimals, other numeric types: numbers
+        :param p_key_values: pd.Series | p_key values without missing values, e.g. a p_key column or watermark
+        :return: pd.Series
+        """
+        try:
+            p_key_type = self.get_col_name_types_mapping().get(self.p_key)
+        except NotFound:
+            p_key_type = None
+        if p_key_type == "STRING":
+            return p_key_values.astype(str).str.lower()
+        if p_key_type == "TIMESTAMP":
+            return pd.to_datetime(p_key_values, utc=True)
+        if p_key_type in ("DATETIME", "DATE"):
+            p_key_values = pd.to_datetime(p_key_values)
+            return p_key_values.dt.tz_convert(None) if p_key_values.dt.tz is not None else p_key_values
+        if p_key_type in ("NUMERIC", "BIGNUMERIC"):
+            return p_key_values.map(lambda _value: Decimal(str(_value)))
+        if p_key_type in ("INTEGER", "INT64", "FLOAT", "FLOAT64"):
+            return pd.to_numeric(p_key_values)
+        return p_key_values
+
+    def get_above_watermark_mask(self, p_key_values: pd.Series) -> pd.Series:
+        """
+        vectorized check which p_key values are above the high-watermark, compared by the GBQ data-type of
+        p_key, see get_comparable_pkey_values; missing values are never above it
+        :param p_key_values: pd.Series | p_key column of rows to upload
+        :return: pd.Series | boolean mask
+        """
+        if (watermark := self.highest_pkey_value) is None:
+            return pd.Series(True, index=p_key_values.index)
+        watermark = self.get_comparable_pkey_values(pd.Series([watermark])).iloc[0]
+        above_watermark = self.get_comparable_pkey_values(p_key_values.dropna()) > watermark
+        return above_watermark.reindex(p_key_values.index, fill_value=False)
+
+    def filter_above_watermark(
+            self, data: Union[pd.DataFrame, pa.Table]
+    ) -> Union[pd.DataFrame, pa.Table]:
+        """
+        keep only rows whose p_key is above the high-watermark, i.e. rows not uploaded yet
+        the watermark is re-read from the store, as other workers may have advanced or dropped it, and
+        dropped if the table has no rows anymore, e.g. after it was truncated or recreated
+        if the table is written to without this store, call refresh_highest_pkey_value() first
+        :param data: pd.DataFrame or pa.Table | rows to upload
+        :return: pd.DataFrame or pa.Table | rows above the watermark, data as-is without p_key
+        """
+        if not self.p_key:
+            return data
+        self.invalidate("highest_pkey_value")
+        if self.highest_pkey_value is not None and not self.has_rows():
+            print(f"Dropping the watermark {self.highest_pkey_value} of {self.p_key}, as {self.table_id} is empty")
+            watermark_store.delete(self.table_id)
+            self.__dict__["highest_pkey_value"] = None
+        if isinstance(data, pa.Table):
+            if self.p_key not in data.column_names:
+                return data
+            return data.filter(
+                pa.array(self.get_above_watermark_mask(data.column(self.p_key).to_pandas()))
+            )
+        if self.p_key not in data.columns:
+            return data
+        return data[self.get_above_watermark_mask(data[self.p_key])]
+
+    @cached_property
+    def schema(self) -> list:
+        return (
                 get_gbq_schema_from_json(
-                    table_name_key=self.table_name, schema_name_key=schema_id
+                    table_name_key=self.table_name, schema_name_key=self.schema_id
                 )
                 or None
         )
 
+    @cached_property
+    def load_format(self) -> str:
+        """
+        format dataframes are serialized to for load-jobs: csv (default) or parquet
+        parquet is smaller and faster, but needs column dtypes matching the schema (e.g. no '1' strings for
+        INTEGER columns), so it's enabled per table using the load_format param or "load_format" in the
+        mapping config file, or for all tables using env-var DEFAULT_LOAD_FORMAT
+        """
+        if self._load_format:
+            return self._load_format.lower()
+        try:
+            _table_config = gbq_schema_registry.get_table_config(
+                table_name_key=self.table_name, schema_name_key=self.schema_id
+            )
+        except FileNotFoundError:
+            _table_config = {}
+        return (
+            _table_config.get("load_format") or os.getenv("DEFAULT_LOAD_FORMAT") or "csv"
+        ).lower()
+
+    def invalidate(self, *attributes: str) -> None:
+        """
+        drop cached values of lazily computed attributes, so they are recomputed on next access
+        :param attributes: str | names of attributes to invalidate, all of CACHED_ATTRIBUTES if none passed
+        :return:
+        """
+        for _attribute in attributes or self.CACHED_ATTRIBUTES:
+            if _attribute not in self.CACHED_ATTRIBUTES:
+                raise ValueError(f"{_attribute} is not a cached attribute")
+            self.__dict__.pop(_attribute, None)
+
     def create(self) -> None:
         """
         create table using schema provided
@@ -51,22 +291,26 @@ class BigQueryTable(BigQueryClient):
             schema=self.schema,
         )
         table = self.bq_client.create_table(table)
+        self.set_table_metadata(table)
         self.exists = True
         print(f"Created table {table.project}.{table.dataset_id}.{table.table_id}")
 
     def check_exists(self) -> bool:
         try:
-            self.bq_client.get_table(self.table_id)  # Make an API request.
+            self.get_table_metadata()
             return True
         except NotFound:
             print(f"Table {self.table_id} is not found.")
             return False
 
     def delete(self):
+        self.clear_table_metadata()
         if self.check_exists():
             print(f"Deleting table and contents of {self.table_id}")
             try:
                 self.bq_client.delete_table(self.table_id, not_found_ok=True)
+                self.clear_table_metadata()
+                watermark_store.delete(self.table_id)
                 self.highest_pkey_value = None
                 self.exists = False
             except Exception as e:
@@ -76,49 +320,97 @@ class BigQueryTable(BigQueryClient):
         else:
             print(f"{self.table_id} doesn't exist yet. Skipping deletion...")
 
+    def has_rows(self) -> bool:
+        """
+        check on fresh table metadata if the table has rows, incl. rows still in the streaming buffer
+        :return: bool | False if the table is empty or doesn't exist
+        """
+        try:
+            table = self.get_table_metadata(refresh=True)
+        except NotFound:
+            return False
+        return bool(table.num_rows or table.streaming_buffer)
+
     def get_num_rows(self):
         # FIXME this doesnt work well, keeps returning 0 frequently
         num_rows = None
         try:
-            num_rows = self.bq_client.get_table(self.table_id).num_rows
+            num_rows = self.get_table_metadata().num_rows
         except Exception as e:
             print(f"Exception occurred: {e}")
         return num_rows
 
-    def get_highest_pkey_value(self):
+    def get_highest_pkey_value(self, recent_partition_days: int = None):
         """
-
-        :return:
+        get the highest p_key value in the table using a MAX aggregate, STRING keys are compared lower-cased
+        :param recent_partition_days: int | (optional) only scan partitions of the last n days,
+            only valid if p_key grows together with the partitioning column of the table
+        :return: highest p_key value, None if table has no p_key or no rows
         """
-        if self.p_key:
-            p_key_dtype = self.get_col_name_types_mapping().get(self.p_key)
-            if p_key_dtype and p_key_dtype == "STRING":
-                select_query = f"""SELECT lower({self.p_key}) as {self.p_key} 
-                FROM `{self.table_id}` 
-                ORDER BY lower({self.p_key}) DESC 
-                LIMIT 1"""
-            else:
-                select_query = f"""SELECT {self.p_key} 
-                    FROM `{self.table_id}` 
-                    ORDER BY {self.p_key} DESC 
-                    LIMIT 1"""
+        if not self.p_key:
+            return None
+        try:
+            table = self.get_table_metadata()
+            col_name_types_mapping = self.get_col_name_types_mapping()
+            p_key_expression = (
+                f"lower({self.p_key})"
+                if col_name_types_mapping.get(self.p_key) == "STRING"
+                else self.p_key
+            )
+            select_query = f"SELECT MAX({p_key_expression}) AS {self.p_key} FROM `{self.table_id}`"
+            if recent_partition_days and table.time_partitioning:
+                select_query += " WHERE " + self.get_recent_partitions_predicate(
+                    partition_field=table.time_partitioning.field,
+                    partition_field_type=col_name_types_mapping.get(
+                        table.time_partitioning.field
+                    ),
+                    days=recent_partition_days,
+                )
             print(select_query)
-            query_results = self.get_select_query_results(
-                select_query=select_query, pretty_print=True
+            query_results = self.get_query_results(
+                sql_query=select_query, result_format="rows"
             )
-            if query_results and isinstance(query_results, list):
-                return query_results[0].get(self.p_key, None)
-        return None
+            return query_results[0].get(self.p_key) if query_results else None
+        except Exception as e:
+            print(f"Exception occurred: {e}")
+            return None
+
+    @staticmethod
+    def get_recent_partitions_predicate(
+            partition_field: str = None,
+            partition_field_type: str = None,
+            days: int = 1,
+            table_alias: str = None,
+    ) -> str:
+        """
+        return a WHERE-predicate restricting a scan to the partitions of the last n days
+        :param partition_field: str | partitioning column, None for ingestion-time partitioned tables
+        :param partition_field_type: str | GBQ data-type of the partitioning column
+        :param days: int | number of days
+        :param table_alias: str | (optional) alias to qualify the column with, e.g. in a MERGE condition
+        :return: str
+        """
+        _column = partition_field or "_PARTITIONTIME"
+        if table_alias:
+            _column = f"{table_alias}.{_column}"
+        if partition_field_type == "DATE":
+            return f"{_column} >= DATE_SUB(CURRENT_DATE(), INTERVAL {int(days)} DAY)"
+        if partition_field_type == "DATETIME":
+            return f"{_column} >= DATETIME_SUB(CURRENT_DATETIME(), INTERVAL {int(days)} DAY)"
+        return f"{_column} >= TIMESTAMP_SUB(CURRENT_TIMESTAMP(), INTERVAL {int(days)} DAY)"
 
     def get_col_name_types_mapping(self) -> dict:
         """
         return a mapping dict with col-name and col-datatype for the GBQ table
         :return: dict | mapping {col_name: col-type}
         """
-        return {
-            _col.name: _col.field_type
-            for _col in self.bq_client.get_table(self.table_id).schema
-        }
+        with self._metadata_lock:
+            table = self.get_table_metadata()
+            if self._col_name_types_mapping is None:
+                self._col_name_types_mapping = {
+                    _col.name: _col.field_type for _col in table.schema
+                }
+            return self._col_name_types_mapping
 
     def get_table_properties(
             self,
@@ -137,20 +429,24 @@ class BigQueryTable(BigQueryClient):
         table_name = table_name or self.table_name
         table_id = f"{self.project_id}.{dataset_name}.{table_name}"
 
-        table = self.bq_client.get_table(table_id)
+        table = (
+            self.get_table_metadata()
+            if table_id == self.table_id
+            else self.bq_client.get_table(table_id)
+        )
         if print_stdout:
             # View table properties
             print(
                 f"""Got table '{table.project}.{table.dataset_id}.{table.table_id}'.
                     Table schema: {table.schema}
                     Table description: {table.description}
-                    Table has {self.get_num_rows()} rows        
+                    Table has {table.num_rows} rows        
                 """
             )
         return {
             "schema": table.schema,
             "description": table.description,
-            "num_rows": self.get_num_rows(),
+            "num_rows": table.num_rows,
         }
 
     def get_records_in_table(
@@ -177,7 +473,9 @@ class BigQueryTable(BigQueryClient):
             LIMIT {min(limit, 100)};
         """
         try:
-            query_results = self.bq_client.query(select_query).to_dataframe()
+            query_results = self.convert_row_iterator(
+                self.bq_client.query(select_query).result()
+            )
             if pretty_print:
                 pretty_print_df(dataframe=query_results)
             return json.loads(query_results.to_json(orient="records"))
@@ -186,88 +484,372 @@ class BigQueryTable(BigQueryClient):
 
     def update_from_json_data(self, data_json: Union[dict, list]) -> GbqUploadResults:
         """
-
-        :param data_json:
-        :return:
+        upload json records to the table: records are streamed as newline-delimited json into a
+        spooled temp-file (kept in memory up to NDJSON_SPOOL_MAX_BYTES) and loaded from there
+        :param data_json: dict or list of dicts | records to upload
+        :return: GbqUploadResults
         """
         job_config = self.get_load_job_config(source="json")
-        if isinstance(data_json, dict):
-            df = pd.DataFrame([data_json])
-        else:
-            df = pd.DataFrame(data_json)
-            print(f"created a Dataframe of {df.shape[0]} records for uploading..")
+        records = [data_json] if isinstance(data_json, dict) else data_json
         try:
-            json_object = json.loads(df.to_json(orient="records"))
-
-            job = self.bq_client.load_table_from_json(
-                json_object, self.table_id, job_config=job_config
-            )
+            with tempfile.SpooledTemporaryFile(max_size=self.NDJSON_SPOOL_MAX_BYTES) as ndjson_file:
+                num_rows = write_ndjson(records=records, fp=ndjson_file)
+                print(f"serialized {num_rows} records for uploading..")
+                job = self.bq_client.load_table_from_file(
+                    ndjson_file, self.table_id, job_config=job_config, rewind=True
+                )
             if not job.errors:
-                return self.get_job_success_dict(gbq_job=job, num_rows=df.shape[0])
+                job_success_dict = self.get_job_success_dict(gbq_job=job, num_rows=num_rows)
+                self.advance_highest_pkey_value(data_df=records)
+                return job_success_dict
             else:
                 print(f"Errors occurred! {iter(job.errors)}")
         except Exception as ex:
-            raise f"Exception caught while updating BigQuery: {ex}" from ex
+            raise Exception(f"Exception caught while updating BigQuery: {ex}") from ex
 
-    def update_from_dataframe(self, data_df: pd.DataFrame) -> GbqUploadResults:
+    def update_from_dataframe(
+            self, data_df: pd.DataFrame, load_format: str = None
+    ) -> GbqUploadResults:
         """
+        upload a dataframe to the table using a load-job
+        :param data_df: pd.DataFrame | data to upload
+        :param load_format: str | (optional) parquet/csv, default is the table's load_format
+        :return: GbqUploadResults
+        """
+        try:
+            job = self.load_dataframe(data_df=data_df, load_format=load_format)
+            if not job.errors:
+                return self.finish_update_from_dataframe(gbq_job=job, data_df=data_df)
+            else:
+                print(f"Errors occurred! {job.errors}")
+        except Exception as ex:
+            raise Exception(f"Exception caught while updating BigQuery: {ex}") from ex
 
-        :param data_df:
-        :return:
+    def load_dataframe(
+            self, data_df: pd.DataFrame, load_format: str = None, job_id: str = None
+    ) -> bigquery.LoadJob:
         """
+        submit a load-job of a dataframe to the table, without any follow-up like advancing the watermark
+        :param data_df: pd.DataFrame | data to upload
+        :param load_format: str | (optional) parquet/csv, default is the table's load_format
+        :param job_id: str | (optional) id of the load-job, e.g. to look it up again after a failure
+        :return: bigquery.LoadJob
+        """
+        load_format = (load_format or self.load_format).lower()
         print(
-            f"INFO: Uploading a Dataframe of {data_df.shape[0]} records to {self.table_id}"
+            f"INFO: Uploading a Dataframe of {data_df.shape[0]} records to {self.table_id} as {load_format}"
+        )
+        return self.bq_client.load_table_from_dataframe(
+            data_df,
+            self.table_id,
+            job_config=self.get_load_job_config(source="df", load_format=load_format),
+            parquet_compression="snappy",
+            job_id=job_id,
         )
 
+    def submit_load_from_dataframe(
+            self,
+            data_df: pd.DataFrame,
+            load_format: str = None,
+            priority: str = bigquery.QueryPriority.INTERACTIVE,
+    ) -> Future:
+        """
+        queue a load-job of a dataframe with the job manager of the project, e.g. to load many tables in
+        parallel; follow up on the finished job with finish_update_from_dataframe
+        :param data_df: pd.DataFrame | data to upload
+        :param load_format: str | (optional) parquet/csv, default is the table's load_format
+        :param priority: str | rank in the queue of the job manager, INTERACTIVE or BATCH
+        :return: Future | resolves to the finished LoadJob, or raises its error
+        """
+        load_format = (load_format or self.load_format).lower()
+        print(
+            f"INFO: Queueing a load of {data_df.shape[0]} records to {self.table_id} as {load_format}"
+        )
+        return get_job_manager(self.project_id).submit_load_from_dataframe(
+            data_df=data_df,
+            table_id=self.table_id,
+            job_config=self.get_load_job_config(source="df", load_format=load_format),
+            priority=priority,
+        )
+
+    def finish_update_from_dataframe(
+            self, gbq_job: bigquery.LoadJob, data_df: pd.DataFrame
+    ) -> GbqUploadResults:
+        """
+        follow up on a successful load-job of a dataframe: drop the cached metadata and advance the watermark
+        :param gbq_job: bigquery.LoadJob | finished load-job
+        :param data_df: pd.DataFrame | loaded data
+        :return: GbqUploadResults
+        """
+        job_success_dict = self.get_job_success_dict(
+            gbq_job=gbq_job, num_rows=data_df.shape[0]
+        )
+        self.advance_highest_pkey_value(data_df=data_df)
+        return job_success_dict
+
+    def update_from_arrow(self, data_table: pa.Table) -> GbqUploadResults:
+        """
+        upload an arrow table to the table: it's written as snappy-compressed parquet into a spooled
+        temp-file and loaded from there, without converting it to a dataframe
+        :param data_table: pa.Table | data to upload
+        :return: GbqUploadResults
+        """
+        import pyarrow.parquet as pq
+
+        print(
+            f"INFO: Uploading an Arrow table of {data_table.num_rows} records to {self.table_id}"
+        )
         try:
-            job = self.bq_client.load_table_from_dataframe(
-                data_df,
-                self.table_id,
-                job_config=self.get_load_job_config(source="df"),
-            )
+            with tempfile.SpooledTemporaryFile(max_size=self.NDJSON_SPOOL_MAX_BYTES) as parquet_file:
+                pq.write_table(data_table, parquet_file, compression="snappy")
+                job = self.bq_client.load_table_from_file(
+                    parquet_file,
+                    self.table_id,
+                    job_config=self.get_load_job_config(source="parquet"),
+                    rewind=True,
+                )
             if not job.errors:
-                return self.get_job_success_dict(gbq_job=job, num_rows=data_df.shape[0])
+                job_success_dict = self.get_job_success_dict(
+                    gbq_job=job, num_rows=data_table.num_rows
+                )
+                if self.p_key in data_table.column_names:
+                    self.advance_highest_pkey_value(
+                        data_df=data_table.select([self.p_key]).to_pandas()
+                    )
+                return job_success_dict
             else:
                 print(f"Errors occurred! {job.errors}")
         except Exception as ex:
-            raise f"Exception caught while updating BigQuery: {ex}" from ex
+            raise Exception(f"Exception caught while updating BigQuery: {ex}") from ex
+
+    def upsert_from_dataframe(
+            self,
+            data_df: pd.DataFrame,
+            recent_partition_days: int = None,
+            partition_predicates: list = None,
+            staging_expiration_minutes: int = 60,
+    ) -> GbqUploadResults:
+        """
+        upsert a dataframe on p_key: it's loaded into a staging table, which is merged into the table using
+        one MERGE statement, so only the affected rows are rewritten; the staging table is deleted afterwards
+        and expires by itself if that fails. If a p_key occurs more than once, its last row wins.
+        partition pruning restricts the rows of the table the MERGE reads, rows outside the pruned partitions
+        aren't matched and would be inserted again
+        :param data_df: pd.DataFrame | rows to insert or update
+        :param recent_partition_days: int | (optional) only match rows in partitions of the last n days
+        :param partition_predicates: list | (optional) further conditions on the table's rows, tuples of
+            (column, operator, value) as in SelectQueryBuilder.where, with values passed as query parameters
+        :param staging_expiration_minutes: int | lifetime of the staging table
+        :return: GbqUploadResults, with the number of inserted/updated rows as num_rows
+        """
+        if not self.p_key:
+            raise ValueError(f"Upserting to {self.table_id} requires a p_key")
+        if self.p_key not in data_df.columns:
+            raise ValueError(f"p_key {self.p_key} is missing in the data to upsert")
+        partition_query = SelectQueryBuilder(table_id=self.table_id, table_alias="T")
+        for _predicate in partition_predicates or []:
+            partition_query.where(*_predicate)
+        partition_condition, query_parameters = partition_query.get_condition()
+        if not self.exists:
+            self.create()
+        table = self.get_table_metadata()
+        columns = [_col.name for _col in table.schema if _col.name in data_df.columns]
+        data_df = data_df.drop_duplicates(subset=[self.p_key], keep="last")[columns]
+        staging_table_id = f"{self.table_id}__staging_{uuid.uuid4().hex[:12]}"
+        print(
+            f"INFO: Upserting {data_df.shape[0]} records to {self.table_id} using {staging_table_id}"
+        )
+        try:
+            staging_table = bigquery.Table(
+                staging_table_id,
+                schema=[_col for _col in table.schema if _col.name in columns],
+            )
+            staging_table.expires = datetime.now(timezone.utc) + timedelta(
+                minutes=staging_expiration_minutes
+            )
+            self.bq_client.create_table(staging_table)
+            job_config = update_write_disposition(
+                bigquery.LoadJobConfig(
+                    schema=staging_table.schema,
+                    source_format=bigquery.SourceFormat.PARQUET,
+                ),
+                write_disposition="overwrite",
+            )
+            self.bq_client.load_table_from_dataframe(
+                data_df, staging_table_id, job_config=job_config, parquet_compression="snappy"
+            ).result()
+            merge_condition = [f"T.`{self.p_key}` = S.`{self.p_key}`"]
+            if recent_partition_days and table.time_partitioning:
+                merge_condition.append(
+                    self.get_recent_partitions_predicate(
+                        partition_field=table.time_partitioning.field,
+                        partition_field_type=self.get_col_name_types_mapping().get(
+                            table.time_partitioning.field
+                        ),
+                        days=recent_partition_days,
+                        table_alias="T",
+                    )
+                )
+            if partition_condition:
+                merge_condition.append(partition_condition)
+            merge_query = self.get_merge_query(
+                staging_table_id=staging_table_id,
+                columns=columns,
+                merge_condition=" AND ".join(merge_condition),
+            )
+            print(merge_query)
+            job = self.bq_client.query(
+                merge_query, job_config=bigquery.QueryJobConfig(query_parameters=query_parameters)
+            )
+            job.result()
+        except Exception as ex:
+            raise Exception(f"Exception caught while upserting to BigQuery: {ex}") from ex
+        finally:
+            self.bq_client.delete_table(staging_table_id, not_found_ok=True)
+        self.clear_table_metadata()
+        self.advance_highest_pkey_value(data_df=data_df)
+        return GbqUploadResults(
+            table_id=self.table_id,
+            job_id=job.job_id,
+            errors=None,
+            num_rows=job.num_dml_affected_rows or 0,
+        )
+
+    def get_merge_query(
+            self, staging_table_id: str, columns: list, merge_condition: str
+    ) -> str:
+        """
+        build a MERGE statement updating rows of the table matched by the staging table, inserting the others
+        :param staging_table_id: str | full table-id of the staging table
+        :param columns: list | columns to update/insert
+        :param merge_condition: str | ON-condition, the table is aliased as T and the staging table as S
+        :return: str
+        """
+        _update_columns = [_col for _col in columns if _col != self.p_key]
+        _insert_columns = ", ".join(f"`{_col}`" for _col in columns)
+        _merge_query = f"""
+            MERGE `{self.table_id}` T
+            USING `{staging_table_id}` S
+            ON {merge_condition}
+        """
+        if _update_columns:
+            _merge_query += f"""
+            WHEN MATCHED THEN
+                UPDATE SET {", ".join(f"`{_col}` = S.`{_col}`" for _col in _update_columns)}
+        """
+        return _merge_query + f"""
+            WHEN NOT MATCHED THEN
+                INSERT ({_insert_columns})
+                VALUES ({", ".join(f"S.`{_col}`" for _col in columns)})
+        """
+
+    def get_stream_writer(
+            self, stream_type: str = "default", max_in_flight: int = 20
+    ) -> BigQueryStreamWriter:
+        """
+        open a Storage Write API stream to the table, e.g. to keep appending rows of a near-real-time feed;
+        the table is created first if needed
+        :param stream_type: str | default (at-least-once, shared stream) or committed (own stream, exactly-once)
+        :param max_in_flight: int | max number of unacknowledged append-requests
+        :return: BigQueryStreamWriter, to be closed by the caller
+        """
+        if not self.exists:
+            self.create()
+        return BigQueryStreamWriter(
+            write_client=self.bqwrite_client,
+            table_id=self.table_id,
+            schema=self.get_table_metadata().schema,
+            stream_type=stream_type,
+            max_in_flight=max_in_flight,
+        )
+
+    def stream_rows(
+            self,
+            data: Union[dict, list, pd.DataFrame, pa.Table],
+            stream_type: str = "default",
+            max_in_flight: int = 20,
+    ) -> GbqUploadResults:
+        """
+        upload rows using the Storage Write API instead of a load-job: rows land within seconds and
+        don't count against load-job quotas
+        :param data: dict, list of dicts, pd.DataFrame or pa.Table | rows to upload
+        :param stream_type: str | default or committed, see get_stream_writer
+        :param max_in_flight: int | max number of unacknowledged append-requests
+        :return: GbqUploadResults, with the write-stream as job_id
+        """
+        try:
+            with self.get_stream_writer(
+                    stream_type=stream_type, max_in_flight=max_in_flight
+            ) as stream_writer:
+                stream_writer.append_rows(data)
+            print(
+                f"INFO: Streamed {stream_writer.num_rows} records to {self.table_id} "
+                f"in {stream_writer.num_requests} requests"
+            )
+        except Exception as ex:
+            raise Exception(f"Exception caught while streaming to BigQuery: {ex}") from ex
+        self.clear_table_metadata()
+        if isinstance(data, pa.Table):
+            if self.p_key in data.column_names:
+                self.advance_highest_pkey_value(data_df=data.select([self.p_key]).to_pandas())
+        else:
+            self.advance_highest_pkey_value(data_df=[data] if isinstance(data, dict) else data)
+        return GbqUploadResults(
+            table_id=self.table_id,
+            job_id=stream_writer.stream_name,
+            errors=None,
+            num_rows=stream_writer.num_rows,
+        )
 
     def get_job_success_dict(
             self, gbq_job: bigquery.job, num_rows: int
     ) -> GbqUploadResults:
+        job_id = gbq_job.result().job_id
+        # the load changed num_rows/modified of the table
+        self.clear_table_metadata()
         return GbqUploadResults(
             **{
                 "table_id": self.table_id,
-                "job_id": gbq_job.result().job_id,
+                "job_id": job_id,
                 "errors": None,
                 "num_rows": num_rows,
             }
         )
 
-    def get_load_job_config(self, source: str = None) -> bigquery.LoadJobConfig:
+    def get_load_job_config(
+            self, source: str = None, load_format: str = None
+    ) -> bigquery.LoadJobConfig:
         """
         get GBQ load-job config for different types of sources
-        :param source: str | json/csv/df
+        :param source: str | json/csv/df/parquet
+        :param load_format: str | (optional) format dataframes are serialized to, for source=df: parquet/csv
         :return:
         """
+        if source == "df":
+            source = (load_format or self.load_format).lower()
+            if source not in self.LOAD_FORMATS:
+                raise ValueError(f"Unsupported load_format: {source}")
         if source == "json":
             source_format = bigquery.SourceFormat.NEWLINE_DELIMITED_JSON
-        elif source in {"df", "csv"}:
-            source_format = bigquery.SourceFormat.CSV
         else:
-            source_format = None
+            source_format = self.LOAD_FORMATS.get(source)
+        # csv options are only valid for csv sources
+        _csv_options = (
+            {"allow_quoted_newlines": True, "allow_jagged_rows": True}
+            if source_format in {None, bigquery.SourceFormat.CSV}
+            else {}
+        )
         if self.schema:
             return bigquery.LoadJobConfig(
                 autodetect=False,
                 schema=self.schema,
                 source_format=source_format,
-                allow_quoted_newlines=True,
-                allow_jagged_rows=True,
+                **_csv_options,
             )
         return bigquery.LoadJobConfig(
             autodetect=True,
-            allow_quoted_newlines=True,
-            allow_jagged_rows=True,
+            source_format=source_format,
+            **_csv_options,
         )
 
 
@@ -3,50 +3,288 @@ class to upload data to BigQuery
 """
 from __future__ import annotations
 from app.gcp.big_query.big_query_table import BigQueryTable
+from app.models.models import GbqUploadResults
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from google.cloud import bigquery
+from google.cloud.exceptions import NotFound
 import pandas as pd
+import pyarrow as pa
+import time
+import uuid
 from app.utils.data_type_utils import (
     fix_special_characters_in_json_keys,
 )
 
 
 class BigQueryUploader(BigQueryTable):
+    # bounds and target duration for adaptively sized chunks of chunked uploads
+    MIN_CHUNK_ROWS = 1000
+    MAX_CHUNK_BYTES = 1024 * 1024 * 1024
+    TARGET_CHUNK_SECONDS = 30
+
     def __init__(
         self,
         project_id: str,
         dataset_name: str,
         table_name: str,
-        data_to_upload: dict | list[dict] | pd.DataFrame,
+        data_to_upload: dict | list[dict] | pd.DataFrame | pa.Table,
         schema_id: str = None,
+        p_key: str = None,
     ):
         super().__init__(
             project_id=project_id,
             dataset_name=dataset_name,
             table_name=table_name,
+            p_key=p_key,
             schema_id=schema_id,
         )
-        if not self.exists:
-            self.create()
         self.data_to_upload = fix_special_characters_in_json_keys(
             data_to_update=data_to_upload
         )
 
-    def do_upload(self) -> dict:
+    def do_upload(
+        self,
+        chunk_rows: int = None,
+        chunk_bytes: int = None,
+        max_concurrent_jobs: int = 4,
+        max_retries: int = 2,
+        upsert: bool = False,
+        recent_partition_days: int = None,
+        incremental: bool = False,
+    ) -> dict:
         """
-
-        :return:
+        upload data to the table, creating it if needed
+        if chunk_rows or chunk_bytes is passed, the data is uploaded in chunks, see upload_dataframe_in_chunks
+        if upsert is set, rows are inserted or updated on p_key instead, see upsert_from_dataframe
+        if incremental is set, only rows with p_key above the table's high-watermark are uploaded
+        :param chunk_rows: int | (optional) initial number of rows per chunk
+        :param chunk_bytes: int | (optional) initial (in-memory) size of a chunk in bytes
+        :param max_concurrent_jobs: int | (optional) max number of load-jobs running at the same time
+        :param max_retries: int | (optional) number of retries of a failed chunk
+        :param upsert: bool | (optional) merge the data on p_key instead of appending it
+        :param recent_partition_days: int | (optional) for upserts, only match rows in partitions of the last n days
+        :param incremental: bool | (optional) skip rows that were uploaded already, based on p_key
+        :return: dict | upload results
         """
         upload_results = {"table_id": self.table_id}
         try:
-            if isinstance(self.data_to_upload, dict):
-                _df_to_upload = pd.DataFrame(self.data_to_upload, index=[0])
-            elif isinstance(self.data_to_upload, list):
-                _df_to_upload = pd.DataFrame(self.data_to_upload)
-            elif isinstance(self.data_to_upload, pd.DataFrame):
-                _df_to_upload = self.data_to_upload
-            else:
+            if not self.exists:
+                self.create()
+            if (_df_to_upload := self.get_data_to_upload(as_dataframe=upsert)) is None:
                 upload_results["errors"] = Exception("No suitable data found for uploading.")
                 return upload_results
-            upload_results["jobs"] = self.update_from_dataframe(data_df=_df_to_upload).dict()
+            if incremental:
+                _num_rows = _df_to_upload.shape[0]
+                _df_to_upload = self.filter_above_watermark(data=_df_to_upload)
+                upload_results["skipped_rows"] = _num_rows - _df_to_upload.shape[0]
+                print(
+                    f"INFO: Skipping {upload_results['skipped_rows']} of {_num_rows} records "
+                    f"at or below the watermark {self.highest_pkey_value} of {self.p_key}"
+                )
+                if _df_to_upload.shape[0] == 0:
+                    return upload_results
+            if isinstance(_df_to_upload, pa.Table):
+                upload_results["jobs"] = self.update_from_arrow(data_table=_df_to_upload).dict()
+                return upload_results
+            if upsert:
+                upload_results["jobs"] = self.upsert_from_dataframe(
+                    data_df=_df_to_upload, recent_partition_days=recent_partition_days
+                ).dict()
+            elif chunk_rows or chunk_bytes:
+                upload_results.update(
+                    self.upload_dataframe_in_chunks(
+                        data_df=_df_to_upload,
+                        chunk_rows=chunk_rows,
+                        chunk_bytes=chunk_bytes,
+                        max_concurrent_jobs=max_concurrent_jobs,
+                        max_retries=max_retries,
+                    )
+                )
+            else:
+                upload_results["jobs"] = self.update_from_dataframe(data_df=_df_to_upload).dict()
         except Exception as e:
             upload_results["errors"] = e
         return upload_results
+
+    def get_data_to_upload(self, as_dataframe: bool = False) -> pd.DataFrame | pa.Table | None:
+        """
+        data_to_upload as a dataframe, arrow tables are kept as-is unless as_dataframe is set
+        :param as_dataframe: bool | (optional) convert arrow tables to dataframes too
+        :return: pd.DataFrame or pa.Table, None if data_to_upload has an unsupported type
+        """
+        if isinstance(self.data_to_upload, dict):
+            return pd.DataFrame(self.data_to_upload, index=[0])
+        if isinstance(self.data_to_upload, list):
+            return pd.DataFrame(self.data_to_upload)
+        if isinstance(self.data_to_upload, pd.DataFrame):
+            return self.data_to_upload
+        if isinstance(self.data_to_upload, pa.Table):
+            return self.data_to_upload.to_pandas() if as_dataframe else self.data_to_upload
+        return None
+
+    def upload_dataframe_in_chunks(
+        self,
+        data_df: pd.DataFrame,
+        chunk_rows: int = None,
+        chunk_bytes: int = None,
+        max_concurrent_jobs: int = 4,
+        max_retries: int = 2,
+    ) -> dict:
+        """
+        upload a dataframe as multiple load-jobs, serialized and run concurrently in a worker-pool
+        the size of further chunks adapts to the throughput measured on finished chunks, so each
+        chunk takes about TARGET_CHUNK_SECONDS; only chunks whose load-job failed are retried, a chunk whose
+        job succeeded is never loaded again; the watermark is advanced once, after all chunks finished
+        :param data_df: pd.DataFrame | data to upload
+        :param chunk_rows: int | (optional) initial number of rows per chunk
+        :param chunk_bytes: int | (optional) initial (in-memory) size of a chunk in bytes
+        :param max_concurrent_jobs: int | (optional) max number of load-jobs running at the same time
+        :param max_retries: int | (optional) number of retries of a failed chunk
+        :return: dict | with keys jobs (results of uploaded chunks) and errors (of chunks failed after retries)
+        """
+        num_rows = data_df.shape[0]
+        row_bytes = max(int(data_df.memory_usage(index=False, deep=True).sum() / max(num_rows, 1)), 1)
+        chunk_rows = max(chunk_rows or int(chunk_bytes / row_bytes), 1)
+        print(
+            f"INFO: Uploading {num_rows} records to {self.table_id} in chunks of initially {chunk_rows} rows"
+        )
+        jobs, errors, loaded_chunks = [], [], []
+        bytes_per_second = None
+        offset = 0
+        with ThreadPoolExecutor(max_workers=max_concurrent_jobs) as executor:
+            in_flight = {}  # future: (start, stop, attempt, job-ids of all attempts)
+            while offset < num_rows or in_flight:
+                while offset < num_rows and len(in_flight) < max_concurrent_jobs:
+                    if bytes_per_second:
+                        chunk_rows = self._get_adaptive_chunk_rows(
+                            bytes_per_second=bytes_per_second, row_bytes=row_bytes
+                        )
+                    _stop = min(offset + chunk_rows, num_rows)
+                    _job_id = self._get_chunk_job_id()
+                    in_flight[
+                        executor.submit(self._upload_chunk, data_df.iloc[offset:_stop], _job_id)
+                    ] = (offset, _stop, 0, [_job_id])
+                    offset = _stop
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    _start, _stop, _attempt, _job_ids = in_flight.pop(future)
+                    _job_results, _seconds, _error = future.result()
+                    if _error is None:
+                        jobs.append(_job_results.dict())
+                        loaded_chunks.append(data_df.iloc[_start:_stop])
+                        _bytes_per_second = (_stop - _start) * row_bytes / max(_seconds, 1e-3)
+                        bytes_per_second = (
+                            _bytes_per_second
+                            if bytes_per_second is None
+                            else (bytes_per_second + _bytes_per_second) / 2
+                        )
+                    elif _attempt < max_retries:
+                        print(f"Chunk of rows {_start}-{_stop} failed: {_error}. Retrying..")
+                        _retry_job_id = self._get_chunk_job_id()
+                        in_flight[
+                            executor.submit(
+                                self._upload_chunk, data_df.iloc[_start:_stop], _retry_job_id, _job_ids
+                            )
+                        ] = (_start, _stop, _attempt + 1, _job_ids + [_retry_job_id])
+                    else:
+                        errors.append({"rows": [_start, _stop], "error": str(_error)})
+        # the loads changed num_rows/modified of the table
+        self.clear_table_metadata()
+        if loaded_chunks:
+            try:
+                self.advance_highest_pkey_value(data_df=pd.concat(loaded_chunks))
+            except Exception as e:
+                # the chunks are loaded, so they must not be reported as failed and uploaded again
+                print(f"Advancing the watermark of {self.p_key} failed: {e}")
+                errors.append({"rows": None, "error": f"Advancing the watermark failed: {e}"})
+        return {"jobs": jobs, "errors": errors or None}
+
+    def _upload_chunk(self, data_df: pd.DataFrame, job_id: str, previous_job_ids: list = None) -> tuple:
+        """
+        load one chunk, returning (job-results, seconds taken, error) instead of raising
+        on retries, the load-jobs of previous attempts are looked up first: if one succeeded after all
+        (e.g. only waiting for it failed), the chunk is not loaded again
+        """
+        _start_time = time.monotonic()
+        try:
+            if succeeded_job_id := next(
+                    (_job_id for _job_id in previous_job_ids or [] if self._is_succeeded_job(_job_id)), None
+            ):
+                print(f"Load job {succeeded_job_id} succeeded, skipping retry of its chunk")
+                job_id = succeeded_job_id
+            else:
+                self.load_dataframe(data_df=data_df, job_id=job_id).result()
+            return GbqUploadResults(
+                table_id=self.table_id, job_id=job_id, errors=None, num_rows=data_df.shape[0]
+            ), time.monotonic() - _start_time, None
+        except Exception as e:
+            return None, time.monotonic() - _start_time, e
+
+    def _is_succeeded_job(self, job_id: str) -> bool:
+        """
+        check if a load-job succeeded, waiting for it if it's still running
+        :return: bool, raises if the job's state can't be determined, so the chunk isn't loaded twice
+        """
+        try:
+            job = self.bq_client.get_job(job_id)
+        except NotFound:
+            return False
+        if job.state != "DONE":
+            try:
+                job.result()
+            except Exception as e:
+                if job.state != "DONE":
+                    raise Exception(f"State of load job {job_id} is unknown: {e}") from e
+        return job.error_result is None
+
+    @staticmethod
+    def _get_chunk_job_id() -> str:
+        return f"chunked_upload_{uuid.uuid4().hex}"
+
+    def _get_adaptive_chunk_rows(self, bytes_per_second: float, row_bytes: int) -> int:
+        _chunk_bytes = min(bytes_per_second * self.TARGET_CHUNK_SECONDS, self.MAX_CHUNK_BYTES)
+        return max(int(_chunk_bytes / row_bytes), self.MIN_CHUNK_ROWS)
+
+
+def upload_tables(
+    uploaders: list[BigQueryUploader],
+    priority: str = bigquery.QueryPriority.BATCH,
+    incremental: bool = False,
+) -> list[dict]:
+    """
+    upload the data of many uploaders, e.g. nightly loads of many tables: their load-jobs are queued with the
+    job manager of their project and run in parallel within its limits, instead of one after another
+    :param uploaders: list | BigQueryUploaders, each with its table and data
+    :param priority: str | (optional) rank of the loads in the queue of the job manager, BATCH or INTERACTIVE
+    :param incremental: bool | (optional) skip rows that were uploaded already, see do_upload
+    :return: list | upload results per uploader, like those of do_upload
+    """
+    all_upload_results, submitted = [], []
+    for uploader in uploaders:
+        upload_results = {"table_id": uploader.table_id}
+        all_upload_results.append(upload_results)
+        try:
+            if not uploader.exists:
+                uploader.create()
+            if (data_df := uploader.get_data_to_upload(as_dataframe=True)) is None:
+                upload_results["errors"] = Exception("No suitable data found for uploading.")
+                continue
+            if incremental:
+                _num_rows = data_df.shape[0]
+                data_df = uploader.filter_above_watermark(data=data_df)
+                upload_results["skipped_rows"] = _num_rows - data_df.shape[0]
+                if data_df.shape[0] == 0:
+                    continue
+            submitted.append(
+                (uploader, data_df, upload_results, uploader.submit_load_from_dataframe(data_df, priority=priority))
+            )
+        except Exception as e:
+            upload_results["errors"] = e
+    for uploader, data_df, upload_results, future in submitted:
+        try:
+            upload_results["jobs"] = uploader.finish_update_from_dataframe(
+                gbq_job=future.result(), data_df=data_df
+            ).dict()
+        except Exception as e:
+            upload_results["errors"] = e
+    return all_upload_results
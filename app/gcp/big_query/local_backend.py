@@ -0,0 +1,682 @@
+"""
+in-process stand-in for the subset of bigquery.Client used by this app, backed by DuckDB
+datasets become schemas and the project part of table-ids is dropped; queries are run as DuckDB SQL after
+rewriting table references, quoted literals and query parameters, so BigQuery-only functions are not available
+"""
+from collections import OrderedDict
+from datetime import datetime, timezone
+import io
+import re
+import threading
+import uuid
+
+from google.api_core import exceptions as api_exceptions
+from google.cloud import bigquery
+import pandas as pd
+import pyarrow as pa
+
+# GBQ data-types and the DuckDB types their columns are created with
+DUCKDB_COLUMN_TYPES = {
+    "STRING": "VARCHAR",
+    "BYTES": "BLOB",
+    "INTEGER": "BIGINT",
+    "INT64": "BIGINT",
+    "FLOAT": "DOUBLE",
+    "FLOAT64": "DOUBLE",
+    "NUMERIC": "DECIMAL(38, 9)",
+    "BIGNUMERIC": "DOUBLE",
+    "BOOLEAN": "BOOLEAN",
+    "BOOL": "BOOLEAN",
+    "TIMESTAMP": "TIMESTAMPTZ",
+    "DATETIME": "TIMESTAMP",
+    "DATE": "DATE",
+    "TIME": "TIME",
+    "GEOGRAPHY": "VARCHAR",
+    "JSON": "VARCHAR",
+}
+# GBQ data-types and the arrow types the BigQuery client converts dataframe columns to for parquet loads
+ARROW_COLUMN_TYPES = {
+    "STRING": pa.string(),
+    "BYTES": pa.binary(),
+    "INTEGER": pa.int64(),
+    "INT64": pa.int64(),
+    "FLOAT": pa.float64(),
+    "FLOAT64": pa.float64(),
+    "NUMERIC": pa.decimal128(38, 9),
+    "BOOLEAN": pa.bool_(),
+    "BOOL": pa.bool_(),
+    "TIMESTAMP": pa.timestamp("us", tz="UTC"),
+    "DATETIME": pa.timestamp("us"),
+    "DATE": pa.date32(),
+}
+_SQL_REWRITE_PATTERN = re.compile(
+    r"""('(?:[^'\\]|\\.)*')|"((?:[^"\\]|\\.)*)"|`([^`]*)`|@(\w+)"""
+    r"""|\b(FROM|JOIN|INTO|TABLE|UPDATE)(\s+)([\w\-]+\.[\w\-]+\.[\w\-]+)\b""",
+    re.IGNORECASE,
+)
+_IN_UNNEST_PATTERN = re.compile(r"\bIN\s+UNNEST\(\s*(@\w+)\s*\)", re.IGNORECASE)
+# BigQuery allows omitting INTO in MERGE statements, DuckDB doesn't
+_MERGE_PATTERN = re.compile(r"^\s*MERGE\s+(?!INTO\b)", re.IGNORECASE)
+_RESULT_STATEMENT_PATTERN = re.compile(r"^\(*\s*(SELECT|WITH|FROM)\b", re.IGNORECASE)
+_DML_STATEMENT_PATTERN = re.compile(r"^\s*(INSERT|UPDATE|DELETE|MERGE)\b", re.IGNORECASE)
+_ANONYMOUS_DATASET = "_anon"
+
+
+def get_duckdb_table_name(table_id: str) -> str:
+    """
+    :param table_id: str | [project.]dataset.table
+    :return: str | quoted DuckDB table name, "dataset"."table"
+    """
+    _parts = table_id.replace("`", "").split(".")[-2:]
+    if len(_parts) != 2:
+        raise ValueError(f"Invalid table-id: {table_id}")
+    return ".".join(f'"{_part}"' for _part in _parts)
+
+
+def to_local_sql(sql_query: str) -> str:
+    """
+    rewrite a BigQuery SQL query for DuckDB: table-ids lose their project, backticks and double-quoted
+    literals are quoted the DuckDB way, @params become $params and MERGE becomes MERGE INTO
+    :param sql_query: str | BigQuery SQL query
+    :return: str | DuckDB SQL query
+    """
+
+    def _replace(match: re.Match) -> str:
+        _single_quoted, _double_quoted, _backticked, _parameter, _keyword, _space, _table_id = (
+            match.groups()
+        )
+        if _single_quoted is not None:
+            return _single_quoted
+        if _double_quoted is not None:
+            return "'" + _double_quoted.replace('\\"', '"').replace("'", "''") + "'"
+        if _backticked is not None:
+            if "." in _backticked:
+                return get_duckdb_table_name(_backticked)
+            return f'"{_backticked}"'
+        if _parameter is not None:
+            return f"${_parameter}"
+        return f"{_keyword}{_space}{get_duckdb_table_name(_table_id)}"
+
+    sql_query = _IN_UNNEST_PATTERN.sub(r"IN (SELECT UNNEST(\1))", sql_query)
+    sql_query = _MERGE_PATTERN.sub("MERGE INTO ", sql_query)
+    return _SQL_REWRITE_PATTERN.sub(_replace, sql_query).strip().rstrip(";")
+
+
+def fetch_arrow_table(result) -> pa.Table:
+    """
+    fetch the rows of a DuckDB result as pyarrow.Table; arrow() returns a RecordBatchReader since duckdb 1.4
+    and fetch_arrow_table() is deprecated in favour of to_arrow_table() since duckdb 1.5
+    :param result: DuckDBPyConnection | connection an SQL query was executed on
+    :return: pa.Table
+    """
+    if hasattr(result, "to_arrow_table"):
+        return result.to_arrow_table()
+    return result.fetch_arrow_table()
+
+
+def to_bigquery_types(arrow_table: pa.Table) -> pa.Table:
+    """
+    cast columns of DuckDB results to the types BigQuery returns: integer aggregates like SUM are HUGEINT in
+    DuckDB, i.e. decimal128(38, 0) in arrow, but INT64 in BigQuery
+    :param arrow_table: pa.Table | DuckDB result
+    :return: pa.Table
+    """
+    for _i, _field in enumerate(arrow_table.schema):
+        if pa.types.is_decimal(_field.type) and _field.type.scale == 0:
+            arrow_table = arrow_table.set_column(
+                _i, _field.name, arrow_table.column(_i).cast(pa.int64())
+            )
+    return arrow_table
+
+
+def to_load_payload(
+        dataframe: pd.DataFrame, source_format: str, schema: list = None, parquet_compression: str = "snappy"
+) -> bytes:
+    """
+    serialize a dataframe for a load-job like bigquery.Client.load_table_from_dataframe: csv without header,
+    or parquet with columns converted to the types of schema, failing for dtypes not matching them
+    :param dataframe: pd.DataFrame | data to load
+    :param source_format: str | bigquery.SourceFormat.CSV or PARQUET
+    :param schema: list | (optional) SchemaFields of the destination
+    :param parquet_compression: str | compression of parquet payloads
+    :return: bytes | payload sent to BigQuery
+    """
+    payload = io.BytesIO()
+    if source_format == bigquery.SourceFormat.CSV:
+        dataframe.to_csv(payload, index=False, header=False, encoding="utf-8", float_format="%.17g")
+        return payload.getvalue()
+    import pyarrow.parquet as pq
+
+    arrow_types = {
+        _field.name: ARROW_COLUMN_TYPES.get(_field.field_type)
+        for _field in schema or []
+        if _field.mode != "REPEATED"
+    }
+    arrow_table = pa.Table.from_arrays(
+        [pa.Array.from_pandas(dataframe[_col], type=arrow_types.get(_col)) for _col in dataframe.columns],
+        names=[str(_col) for _col in dataframe.columns],
+    )
+    pq.write_table(arrow_table, payload, compression=parquet_compression)
+    return payload.getvalue()
+
+
+def read_load_payload(payload: bytes, source_format: str, column_names: list, schema: list = None) -> pa.Table:
+    """
+    parse a payload created by to_load_payload, csv values are kept as strings and cast to the column types
+    on insert if a schema is known
+    :param payload: bytes | csv or parquet payload
+    :param source_format: str | bigquery.SourceFormat.CSV or PARQUET
+    :param column_names: list | column names of the serialized dataframe
+    :param schema: list | (optional) SchemaFields of the destination
+    :return: pa.Table
+    """
+    if source_format != bigquery.SourceFormat.CSV:
+        import pyarrow.parquet as pq
+
+        return pq.read_table(pa.BufferReader(payload))
+    import pyarrow.csv as pa_csv
+
+    return pa_csv.read_csv(
+        pa.BufferReader(payload),
+        read_options=pa_csv.ReadOptions(column_names=[str(_col) for _col in column_names]),
+        parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+        convert_options=pa_csv.ConvertOptions(
+            column_types={str(_col): pa.string() for _col in column_names} if schema else None,
+            strings_can_be_null=True,
+        ),
+    )
+
+
+def get_duckdb_column_type(field: bigquery.SchemaField) -> str:
+    if field.field_type in ("RECORD", "STRUCT"):
+        _column_type = "STRUCT({})".format(
+            ", ".join(f'"{_field.name}" {get_duckdb_column_type(_field)}' for _field in field.fields)
+        )
+    else:
+        _column_type = DUCKDB_COLUMN_TYPES.get(field.field_type, "VARCHAR")
+    return f"{_column_type}[]" if field.mode == "REPEATED" else _column_type
+
+
+def get_schema_field(name: str, arrow_type: pa.DataType, mode: str = "NULLABLE") -> bigquery.SchemaField:
+    """
+    :param name: str | column name
+    :param arrow_type: pa.DataType | arrow type of the column
+    :param mode: str | NULLABLE or REPEATED
+    :return: bigquery.SchemaField
+    """
+    if pa.types.is_list(arrow_type) or pa.types.is_large_list(arrow_type):
+        return get_schema_field(name, arrow_type.value_type, mode="REPEATED")
+    if pa.types.is_struct(arrow_type):
+        return bigquery.SchemaField(
+            name,
+            "RECORD",
+            mode=mode,
+            fields=[get_schema_field(_field.name, _field.type) for _field in arrow_type],
+        )
+    if pa.types.is_boolean(arrow_type):
+        field_type = "BOOLEAN"
+    elif pa.types.is_integer(arrow_type) or (pa.types.is_decimal(arrow_type) and arrow_type.scale == 0):
+        field_type = "INTEGER"
+    elif pa.types.is_floating(arrow_type):
+        field_type = "FLOAT"
+    elif pa.types.is_decimal(arrow_type):
+        field_type = "NUMERIC"
+    elif pa.types.is_timestamp(arrow_type):
+        field_type = "TIMESTAMP" if arrow_type.tz else "DATETIME"
+    elif pa.types.is_date(arrow_type):
+        field_type = "DATE"
+    elif pa.types.is_time(arrow_type):
+        field_type = "TIME"
+    elif pa.types.is_binary(arrow_type) or pa.types.is_large_binary(arrow_type):
+        field_type = "BYTES"
+    else:
+        field_type = "STRING"
+    return bigquery.SchemaField(name, field_type, mode=mode)
+
+
+class LocalRowIterator:
+    """
+    results of a query or list_rows call, with the accessors of bigquery.table.RowIterator used by the app
+    """
+
+    def __init__(self, arrow_table: pa.Table, page_size: int = None, start_index: int = 0):
+        self._arrow_table = arrow_table
+        self.schema = [get_schema_field(_field.name, _field.type) for _field in arrow_table.schema]
+        self.total_rows = arrow_table.num_rows
+        self._page_size = page_size or max(arrow_table.num_rows, 1)
+        self._start_index = start_index
+        self._field_to_index = {_name: _i for _i, _name in enumerate(arrow_table.column_names)}
+
+    @property
+    def next_page_token(self) -> str:
+        _next_index = self._start_index + self._page_size
+        return str(_next_index) if _next_index < self.total_rows else None
+
+    @property
+    def pages(self):
+        # like the REST iterator, pages start at the page-token and continue to the end of the results
+        for _offset in range(self._start_index, self.total_rows, self._page_size):
+            yield self._to_rows(self._arrow_table.slice(_offset, self._page_size))
+
+    def __iter__(self):
+        for page in self.pages:
+            yield from page
+
+    def to_arrow(self, **kwargs) -> pa.Table:
+        return self._arrow_table.slice(self._start_index)
+
+    def to_arrow_iterable(self, **kwargs):
+        return iter(self.to_arrow().to_batches(max_chunksize=self._page_size))
+
+    def to_dataframe(self, **kwargs) -> pd.DataFrame:
+        return self.to_arrow().to_pandas()
+
+    def _to_rows(self, arrow_table: pa.Table) -> list:
+        _columns = [arrow_table.column(_i).to_pylist() for _i in range(arrow_table.num_columns)]
+        return [bigquery.Row(_values, self._field_to_index) for _values in zip(*_columns)]
+
+
+class LocalJob:
+    """
+    finished query or load job, jobs run synchronously when they are created
+    """
+
+    def __init__(self, job_type: str, error: Exception = None, job_id: str = None):
+        self.job_id = job_id or f"local_{job_type}_{uuid.uuid4().hex}"
+        self.job_type = job_type
+        self.created = datetime.now(timezone.utc)
+        self.state = "DONE"
+        self._error = error
+        self.error_result = {"reason": "invalidQuery", "message": str(error)} if error else None
+        self.errors = [self.error_result] if error else None
+        self.destination = None
+        self.total_bytes_processed = 0
+        self.cache_hit = False
+        self.num_dml_affected_rows = None
+        self.output_rows = None
+        self._row_iterator_factory = None
+
+    def reload(self, **kwargs) -> None:
+        pass
+
+    def done(self, **kwargs) -> bool:
+        return True
+
+    def exception(self, **kwargs) -> Exception:
+        return self._error
+
+    def result(self, page_size: int = None, **kwargs):
+        if self._error is not None:
+            raise self._error
+        if self._row_iterator_factory is not None:
+            return self._row_iterator_factory(page_size)
+        return self
+
+
+class LocalBigQueryClient:
+    """
+    DuckDB-backed client implementing the calls of bigquery.Client used by this app: query, get/create/delete
+    table, list tables/rows/jobs and loads from dataframes and files; use it by setting env-var
+    BIGQUERY_BACKEND=local, see create_bigquery_client
+    MERGE statements (upserts) need duckdb>=1.4, older versions fail them with a BadRequest
+    """
+
+    # query-jobs whose results are kept for paging, the oldest are dropped beyond this
+    MAX_RETAINED_JOBS = 200
+
+    def __init__(self, project: str = None, database: str = ":memory:"):
+        try:
+            import duckdb
+        except ImportError as e:
+            raise Exception("The local BigQuery backend requires duckdb to be installed") from e
+        self.project = project or "local"
+        self._connection = duckdb.connect(database=database)
+        self._lock = threading.RLock()
+        self._jobs = OrderedDict()
+        self._tables_modified = {}
+        self._schemaless_tables = set()  # created without schema, columns are added by the first load
+        self._execute(f'CREATE SCHEMA IF NOT EXISTS "{_ANONYMOUS_DATASET}"')
+        # like BigQuery: NULLs sort first in ascending and last in descending order, timestamps are in UTC
+        self._execute("SET default_null_order = 'nulls_first_on_asc_last_on_desc'")
+        self._execute("SET TimeZone = 'UTC'")
+
+    def query(self, query: str, job_config: bigquery.QueryJobConfig = None, **kwargs) -> LocalJob:
+        job_config = job_config or bigquery.QueryJobConfig()
+        local_sql = to_local_sql(query)
+        parameters = {
+            _parameter.name: (
+                _parameter.values
+                if isinstance(_parameter, bigquery.ArrayQueryParameter)
+                else _parameter.value
+            )
+            for _parameter in job_config.query_parameters or []
+        }
+        if job_config.dry_run:
+            return self._dry_run(query=query, local_sql=local_sql, parameters=parameters)
+        try:
+            with self._lock:
+                if _RESULT_STATEMENT_PATTERN.match(local_sql):
+                    job = LocalJob(job_type="query")
+                    destination = f"{self.project}.{_ANONYMOUS_DATASET}.{job.job_id}"
+                    self._execute(
+                        f"CREATE TABLE {get_duckdb_table_name(destination)} AS {local_sql}",
+                        parameters,
+                    )
+                    job.destination = bigquery.TableReference.from_string(destination)
+                    job._row_iterator_factory = lambda page_size: self.list_rows(
+                        destination, page_size=page_size
+                    )
+                    self._retain_job(job)
+                else:
+                    _affected_rows = self._execute(local_sql, parameters).fetchall()
+                    job = LocalJob(job_type="query")
+                    if _DML_STATEMENT_PATTERN.match(local_sql):
+                        job.num_dml_affected_rows = _affected_rows[0][0] if _affected_rows else 0
+                        for _table_id in self._get_written_tables(query):
+                            self._touch(_table_id)
+                    self._retain_job(job)
+        except api_exceptions.GoogleAPICallError as e:
+            job = LocalJob(job_type="query", error=e)
+        except Exception as e:
+            job = LocalJob(job_type="query", error=api_exceptions.BadRequest(str(e)))
+        return job
+
+    def get_table(self, table) -> bigquery.Table:
+        table_id = self._get_table_id(table)
+        with self._lock:
+            if not self._table_exists(table_id):
+                raise api_exceptions.NotFound(f"Not found: Table {table_id}")
+            if table_id in self._schemaless_tables:
+                schema, num_rows = [], 0
+            else:
+                _duckdb_table_name = get_duckdb_table_name(table_id)
+                _arrow_schema = fetch_arrow_table(
+                    self._execute(f"SELECT * FROM {_duckdb_table_name} LIMIT 0")
+                ).schema
+                schema = [get_schema_field(_field.name, _field.type) for _field in _arrow_schema]
+                num_rows = self._execute(f"SELECT COUNT(*) FROM {_duckdb_table_name}").fetchone()[0]
+            _modified = self._tables_modified.setdefault(table_id, datetime.now(timezone.utc))
+        result = bigquery.Table(table_id, schema=schema)
+        result._properties.update(
+            {
+                "type": "TABLE",
+                "numRows": str(num_rows),
+                "lastModifiedTime": str(int(_modified.timestamp() * 1000)),
+                "etag": str(_modified.timestamp()),
+            }
+        )
+        return result
+
+    def create_table(self, table, exists_ok: bool = False, **kwargs) -> bigquery.Table:
+        if not isinstance(table, bigquery.Table):
+            table = bigquery.Table(self._get_table_id(table))
+        table_id = self._get_table_id(table)
+        with self._lock:
+            if self._table_exists(table_id):
+                if exists_ok:
+                    return self.get_table(table_id)
+                raise api_exceptions.Conflict(f"Already Exists: Table {table_id}")
+            self._execute(f'CREATE SCHEMA IF NOT EXISTS "{table.dataset_id}"')
+            if table.schema:
+                self._execute(
+                    f"CREATE TABLE {get_duckdb_table_name(table_id)} ({self._get_columns_ddl(table.schema)})"
+                )
+            else:
+                self._schemaless_tables.add(table_id)
+            self._touch(table_id)
+        return self.get_table(table_id)
+
+    def delete_table(self, table, not_found_ok: bool = False, **kwargs) -> None:
+        table_id = self._get_table_id(table)
+        with self._lock:
+            if not self._table_exists(table_id):
+                if not_found_ok:
+                    return
+                raise api_exceptions.NotFound(f"Not found: Table {table_id}")
+            if table_id in self._schemaless_tables:
+                self._schemaless_tables.discard(table_id)
+            else:
+                self._execute(f"DROP TABLE {get_duckdb_table_name(table_id)}")
+            self._tables_modified.pop(table_id, None)
+
+    def list_tables(self, dataset, **kwargs) -> list:
+        dataset_id = dataset if isinstance(dataset, str) else f"{dataset.project}.{dataset.dataset_id}"
+        dataset_name = dataset_id.split(".")[-1]
+        with self._lock:
+            table_names = [
+                _row[0]
+                for _row in self._execute(
+                    "SELECT table_name FROM duckdb_tables() WHERE schema_name = $dataset ORDER BY 1",
+                    {"dataset": dataset_name},
+                ).fetchall()
+            ]
+            table_names += sorted(
+                _table_id.split(".")[-1]
+                for _table_id in self._schemaless_tables
+                if _table_id.split(".")[-2] == dataset_name
+            )
+        return [
+            bigquery.table.TableListItem(
+                {
+                    "tableReference": {
+                        "projectId": self.project,
+                        "datasetId": dataset_name,
+                        "tableId": _table_name,
+                    }
+                }
+            )
+            for _table_name in table_names
+        ]
+
+    def list_rows(
+            self,
+            table,
+            selected_fields: list = None,
+            max_results: int = None,
+            page_size: int = None,
+            page_token: str = None,
+            start_index: int = None,
+            **kwargs,
+    ) -> LocalRowIterator:
+        table_id = self._get_table_id(table)
+        _columns = (
+            ", ".join(f'"{_field.name}"' for _field in selected_fields) if selected_fields else "*"
+        )
+        _limit = f" LIMIT {int(max_results)}" if max_results is not None else ""
+        with self._lock:
+            if table_id in self._schemaless_tables:
+                return LocalRowIterator(pa.table({}), page_size=page_size)
+            arrow_table = to_bigquery_types(
+                fetch_arrow_table(
+                    self._execute(f"SELECT {_columns} FROM {get_duckdb_table_name(table_id)}{_limit}")
+                )
+            )
+        return LocalRowIterator(
+            arrow_table,
+            page_size=page_size,
+            start_index=int(page_token) if page_token else start_index or 0,
+        )
+
+    def list_jobs(self, **kwargs) -> list:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def get_job(self, job_id: str, **kwargs) -> LocalJob:
+        with self._lock:
+            if (job := self._jobs.get(job_id)) is None:
+                raise api_exceptions.NotFound(f"Not found: Job {self.project}:{job_id}")
+            return job
+
+    def load_table_from_dataframe(
+            self, dataframe: pd.DataFrame, destination, job_config: bigquery.LoadJobConfig = None,
+            parquet_compression: str = "snappy", job_id: str = None, **kwargs,
+    ) -> LocalJob:
+        source_format = job_config.source_format if job_config else None
+        if dataframe.empty or source_format not in (bigquery.SourceFormat.CSV, bigquery.SourceFormat.PARQUET):
+            arrow_table = pa.Table.from_pandas(dataframe, preserve_index=False)
+        else:
+            # serialized like the BigQuery client does, so format-specific costs and failures show up locally
+            arrow_table = read_load_payload(
+                to_load_payload(dataframe, source_format, job_config.schema, parquet_compression),
+                source_format=source_format,
+                column_names=list(dataframe.columns),
+                schema=job_config.schema,
+            )
+        return self._load(arrow_table=arrow_table, destination=destination, job_config=job_config, job_id=job_id)
+
+    def load_table_from_arrow(
+            self, arrow_table: pa.Table, destination, job_config: bigquery.LoadJobConfig = None,
+            job_id: str = None, **kwargs,
+    ) -> LocalJob:
+        return self._load(arrow_table=arrow_table, destination=destination, job_config=job_config, job_id=job_id)
+
+    def load_table_from_file(
+            self, file_obj, destination, rewind: bool = False, job_config: bigquery.LoadJobConfig = None,
+            job_id: str = None, **kwargs,
+    ) -> LocalJob:
+        if rewind:
+            file_obj.seek(0)
+        source_format = job_config.source_format if job_config else None
+        if source_format == bigquery.SourceFormat.PARQUET:
+            import pyarrow.parquet as pq
+
+            arrow_table = pq.read_table(file_obj)
+        elif source_format == bigquery.SourceFormat.NEWLINE_DELIMITED_JSON:
+            import pyarrow.json as pa_json
+
+            arrow_table = pa_json.read_json(pa.BufferReader(file_obj.read()))
+        else:
+            import pyarrow.csv as pa_csv
+
+            arrow_table = pa_csv.read_csv(pa.BufferReader(file_obj.read()))
+        return self._load(arrow_table=arrow_table, destination=destination, job_config=job_config, job_id=job_id)
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+    def _load(
+            self, arrow_table: pa.Table, destination, job_config: bigquery.LoadJobConfig = None, job_id: str = None
+    ) -> LocalJob:
+        table_id = self._get_table_id(destination)
+        _duckdb_table_name = get_duckdb_table_name(table_id)
+        with self._lock:
+            if job_id in self._jobs:
+                # like the API, job-ids can't be reused
+                raise api_exceptions.Conflict(f"Already Exists: Job {self.project}:{job_id}")
+        job = LocalJob(job_type="load", job_id=job_id)
+        try:
+            with self._lock:
+                if job_config and job_config.write_disposition == bigquery.WriteDisposition.WRITE_TRUNCATE:
+                    self.delete_table(table_id, not_found_ok=True)
+                if not self._table_exists(table_id) or table_id in self._schemaless_tables:
+                    self._schemaless_tables.discard(table_id)
+                    self._execute(f'CREATE SCHEMA IF NOT EXISTS "{table_id.split(".")[-2]}"')
+                    schema = (job_config.schema if job_config else None) or [
+                        get_schema_field(_field.name, _field.type) for _field in arrow_table.schema
+                    ]
+                    self._execute(f"CREATE TABLE {_duckdb_table_name} ({self._get_columns_ddl(schema)})")
+                _table_columns = fetch_arrow_table(
+                    self._execute(f"SELECT * FROM {_duckdb_table_name} LIMIT 0")
+                ).column_names
+                _columns = ", ".join(
+                    f'"{_col}"' for _col in arrow_table.column_names if _col in _table_columns
+                )
+                self._connection.register("_local_load", arrow_table)
+                try:
+                    self._execute(
+                        f"INSERT INTO {_duckdb_table_name} ({_columns}) SELECT {_columns} FROM _local_load"
+                    )
+                finally:
+                    self._connection.unregister("_local_load")
+                self._touch(table_id)
+            job.output_rows = arrow_table.num_rows
+        except Exception as e:
+            job = LocalJob(job_type="load", error=api_exceptions.BadRequest(str(e)), job_id=job.job_id)
+        with self._lock:
+            self._retain_job(job)
+        return job
+
+    def _dry_run(self, query: str, local_sql: str, parameters: dict) -> LocalJob:
+        """
+        validate the query and estimate bytes processed from the size of the tables it reads
+        """
+        from app.gcp.big_query.query_cache import get_referenced_tables
+
+        try:
+            with self._lock:
+                self._execute(f"EXPLAIN {local_sql}", parameters)
+                job = LocalJob(job_type="dry_run")
+                for _table_id in get_referenced_tables(query):
+                    _size = self._execute(
+                        "SELECT estimated_size * column_count * 8 FROM duckdb_tables() "
+                        "WHERE schema_name = $dataset AND table_name = $table",
+                        {"dataset": _table_id.split(".")[-2], "table": _table_id.split(".")[-1]},
+                    ).fetchone()
+                    job.total_bytes_processed += _size[0] if _size else 0
+        except Exception as e:
+            # like the API, invalid queries fail the dry-run request itself
+            raise api_exceptions.BadRequest(str(e)) from e
+        return job
+
+    def _execute(self, sql_query: str, parameters: dict = None):
+        with self._lock:
+            if parameters:
+                return self._connection.execute(sql_query, parameters)
+            return self._connection.execute(sql_query)
+
+    def _table_exists(self, table_id: str) -> bool:
+        if table_id in self._schemaless_tables:
+            return True
+        _dataset_name, _table_name = table_id.split(".")[-2:]
+        return bool(
+            self._execute(
+                "SELECT COUNT(*) FROM duckdb_tables() WHERE schema_name = $dataset AND table_name = $table",
+                {"dataset": _dataset_name, "table": _table_name},
+            ).fetchone()[0]
+        )
+
+    def _get_table_id(self, table) -> str:
+        if isinstance(table, str):
+            table_id = table.replace("`", "")
+            return table_id if table_id.count(".") == 2 else f"{self.project}.{table_id}"
+        return f"{table.project}.{table.dataset_id}.{table.table_id}"
+
+    def _get_written_tables(self, query: str) -> list:
+        from app.gcp.big_query.query_cache import get_referenced_tables
+
+        return [self._get_table_id(_table_id) for _table_id in get_referenced_tables(query)]
+
+    def _touch(self, table_id: str) -> None:
+        self._tables_modified[table_id] = datetime.now(timezone.utc)
+
+    def _retain_job(self, job: LocalJob) -> None:
+        self._jobs[job.job_id] = job
+        while len(self._jobs) > self.MAX_RETAINED_JOBS:
+            _, _dropped_job = self._jobs.popitem(last=False)
+            if _dropped_job.destination is not None:
+                self._execute(
+                    "DROP TABLE IF EXISTS "
+                    + get_duckdb_table_name(
+                        f"{_dropped_job.destination.dataset_id}.{_dropped_job.destination.table_id}"
+                    )
+                )
+
+    @staticmethod
+    def _get_columns_ddl(schema: list) -> str:
+        return ", ".join(f'"{_field.name}" {get_duckdb_column_type(_field)}' for _field in schema)
+
+
+if __name__ == "__main__":
+    local_client = LocalBigQueryClient(project="local")
+    local_client.load_table_from_dataframe(
+        pd.DataFrame({"name": ["John", "Jane"], "age": [31, 27]}), "local.user_data.user_profiles"
+    )
+    print(
+        local_client.query(
+            "SELECT name FROM `local.user_data.user_profiles` WHERE age > @age",
+            job_config=bigquery.QueryJobConfig(
+                query_parameters=[bigquery.ScalarQueryParameter("age", "INT64", 30)]
+            ),
+        ).result().to_dataframe()
+    )
@@ -0,0 +1,137 @@
+"""
+budgets for bytes scanned by queries, checked against dry-run estimates before queries are run
+"""
+from collections import deque
+import os
+import threading
+import time
+
+from dotenv import load_dotenv
+
+from app.gcp.big_query.query_cache import QueryResultCache
+
+
+class QueryBudgetExceeded(Exception):
+    def __init__(self, message: str, estimated_bytes: int):
+        super().__init__(message)
+        self.estimated_bytes = estimated_bytes
+
+
+class QueryBudgetReservation:
+    """
+    estimate admitted by QueryBudget.reserve, charged to caller if it has a caller-budget
+    """
+
+    def __init__(self, estimated_bytes: int, caller: str = None):
+        self.estimated_bytes = estimated_bytes
+        self.caller = caller
+        self.reserved_at = time.monotonic()
+
+
+class QueryBudget:
+    """
+    limits for bytes processed by queries: per request, and per caller within a sliding time-window
+    a limit of None (default) disables it
+    """
+
+    def __init__(
+            self,
+            max_bytes_per_request: int = None,
+            max_bytes_per_caller: int = None,
+            caller_window_seconds: float = 3600,
+    ):
+        self.max_bytes_per_request = max_bytes_per_request
+        self.max_bytes_per_caller = max_bytes_per_caller
+        self.caller_window_seconds = caller_window_seconds
+        self._caller_usage = {}  # caller: deque of QueryBudgetReservations
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes_per_request is not None or self.max_bytes_per_caller is not None
+
+    def reserve(self, estimated_bytes: int, caller: str = None) -> QueryBudgetReservation:
+        """
+        admit a query if it fits the budgets, charging its estimate to the caller
+        :param estimated_bytes: int | dry-run estimate of bytes processed
+        :param caller: str | (optional) identifier of the caller, caller-budget is not applied without
+        :return: QueryBudgetReservation | to be passed to release for a refund,
+            raises QueryBudgetExceeded if a budget would be exceeded
+        """
+        if self.max_bytes_per_request is not None and estimated_bytes > self.max_bytes_per_request:
+            raise QueryBudgetExceeded(
+                f"Query would process {estimated_bytes} bytes, "
+                f"exceeding the limit of {self.max_bytes_per_request} bytes per request",
+                estimated_bytes=estimated_bytes,
+            )
+        reservation = QueryBudgetReservation(estimated_bytes=estimated_bytes, caller=caller)
+        if caller is None or self.max_bytes_per_caller is None:
+            return reservation
+        with self._lock:
+            used_bytes = self._get_used_bytes(caller)
+            if used_bytes + estimated_bytes > self.max_bytes_per_caller:
+                raise QueryBudgetExceeded(
+                    f"Query would process {estimated_bytes} bytes, exceeding the remaining budget of "
+                    f"{self.max_bytes_per_caller - used_bytes} bytes of caller {caller} "
+                    f"within {self.caller_window_seconds} seconds",
+                    estimated_bytes=estimated_bytes,
+                )
+            self._caller_usage.setdefault(caller, deque()).append(reservation)
+        return reservation
+
+    def release(self, reservation: QueryBudgetReservation) -> None:
+        """
+        refund a reservation, e.g. for a query that failed or was served from a cache without scanning bytes
+        releasing a reservation more than once, or after it left the window, has no effect
+        :param reservation: QueryBudgetReservation | returned by reserve
+        """
+        if reservation is None or reservation.caller is None:
+            return
+        with self._lock:
+            if (usage := self._caller_usage.get(reservation.caller)) is None:
+                return
+            for _i, _reservation in enumerate(usage):
+                if _reservation is reservation:
+                    del usage[_i]
+                    break
+            if not usage:
+                self._caller_usage.pop(reservation.caller)
+
+    def get_used_bytes(self, caller: str) -> int:
+        """
+        return bytes charged to a caller within the current window
+        :param caller: str | identifier of the caller
+        :return: int
+        """
+        with self._lock:
+            return self._get_used_bytes(caller)
+
+    def _get_used_bytes(self, caller: str) -> int:
+        if (usage := self._caller_usage.get(caller)) is None:
+            return 0
+        _window_start = time.monotonic() - self.caller_window_seconds
+        while usage and usage[0].reserved_at < _window_start:
+            usage.popleft()
+        if not usage:
+            self._caller_usage.pop(caller)
+            return 0
+        return sum(_reservation.estimated_bytes for _reservation in usage)
+
+
+def _get_int_env(name: str) -> int:
+    return int(_value) if (_value := os.getenv(name)) else None
+
+
+load_dotenv()
+# process-wide budget, configurable using env-vars QUERY_MAX_BYTES_PER_REQUEST, QUERY_MAX_BYTES_PER_CALLER
+# and QUERY_CALLER_BUDGET_WINDOW_SECONDS
+query_budget = QueryBudget(
+    max_bytes_per_request=_get_int_env("QUERY_MAX_BYTES_PER_REQUEST"),
+    max_bytes_per_caller=_get_int_env("QUERY_MAX_BYTES_PER_CALLER"),
+    caller_window_seconds=float(os.getenv("QUERY_CALLER_BUDGET_WINDOW_SECONDS") or 3600),
+)
+# dry-run estimates keyed by normalized query, configurable using env-var QUERY_ESTIMATE_TTL_SECONDS
+query_estimate_cache = QueryResultCache(
+    ttl_seconds=float(os.getenv("QUERY_ESTIMATE_TTL_SECONDS") or 600),
+    max_bytes=1024 * 1024,
+)
@@ -0,0 +1,207 @@
+"""
+builder for parameterized SELECT-queries on single tables, reading only the needed columns and partitions
+"""
+from datetime import date, datetime, time, timezone
+from decimal import Decimal
+import re
+
+from google.cloud import bigquery
+
+# column names, optionally with a path into RECORD columns, e.g. address.city
+_IDENTIFIER_PATTERN = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)*$")
+_TABLE_ID_PATTERN = re.compile(r"^[\w\-]+(\.[\w\-]+){1,2}$")
+COMPARISON_OPERATORS = ("=", "!=", "<>", "<", "<=", ">", ">=", "LIKE", "NOT LIKE")
+ARRAY_OPERATORS = ("IN", "NOT IN")
+NULL_OPERATORS = ("IS NULL", "IS NOT NULL")
+
+
+def quote_identifier(identifier: str) -> str:
+    """
+    validate a column name and quote it with backticks
+    :param identifier: str | column name, or path into a RECORD column
+    :return: str | quoted identifier
+    """
+    if identifier == "_PARTITIONTIME" or identifier == "_PARTITIONDATE":
+        return identifier
+    if not _IDENTIFIER_PATTERN.match(identifier):
+        raise ValueError(f"Invalid column name: {identifier}")
+    return ".".join(f"`{_part}`" for _part in identifier.split("."))
+
+
+def get_parameter_type(value) -> str:
+    """
+    return the GBQ data-type of a query parameter for a python value
+    :param value: any | parameter value
+    :return: str | GBQ data-type
+    """
+    if isinstance(value, bool):
+        return "BOOL"
+    if isinstance(value, int):
+        return "INT64"
+    if isinstance(value, float):
+        return "FLOAT64"
+    if isinstance(value, Decimal):
+        return "NUMERIC"
+    if isinstance(value, datetime):
+        return "TIMESTAMP" if value.tzinfo is not None else "DATETIME"
+    if isinstance(value, date):
+        return "DATE"
+    if isinstance(value, time):
+        return "TIME"
+    if isinstance(value, bytes):
+        return "BYTES"
+    return "STRING"
+
+
+class SelectQueryBuilder:
+    """
+    builds a SELECT-query on one table, with all values passed as query parameters:
+    * columns: projected columns, only these are scanned (GBQ bills by columns read, not by LIMIT)
+    * where(): predicates like ("age", ">=", 18), ("country", "IN", ["DE", "AT"]) or ("email", "IS NULL")
+    * partition_range(): restricts the scan to a range of partitions
+    * order_by(): columns, prefixed with "-" for descending order
+    get_condition() returns just the combined predicates, e.g. for the ON-condition of a MERGE
+    """
+
+    def __init__(self, table_id: str, columns: list = None, table_alias: str = None):
+        table_id = table_id.replace("`", "")
+        if not _TABLE_ID_PATTERN.match(table_id):
+            raise ValueError(f"Invalid table-id: {table_id}")
+        if table_alias is not None and ("." in table_alias or not _IDENTIFIER_PATTERN.match(table_alias)):
+            raise ValueError(f"Invalid table alias: {table_alias}")
+        self.table_id = table_id
+        self.table_alias = table_alias
+        self.columns = list(columns or [])
+        self._predicates = []
+        self._order_by = []
+        self._limit = None
+        self._query_parameters = []
+
+    def where(self, column: str, operator: str = "=", value=None) -> "SelectQueryBuilder":
+        """
+        add a predicate, all predicates are combined using AND
+        :param column: str | column name
+        :param operator: str | comparison (=, !=, <, <=, >, >=, LIKE, NOT LIKE), IN/NOT IN with a list
+            of values, or IS NULL/IS NOT NULL without a value
+        :param value: any | value compared with, passed as query parameter
+        :return: SelectQueryBuilder
+        """
+        operator = operator.strip().upper()
+        _column = self._quote_column(column)
+        if operator in NULL_OPERATORS:
+            self._predicates.append(f"{_column} {operator}")
+        elif operator in ARRAY_OPERATORS:
+            # a string would be taken for a list of its characters
+            if not isinstance(value, (list, tuple, set, frozenset)):
+                raise ValueError(f"{operator} needs a list of values for column {column}, got: {value!r}")
+            values = list(value)
+            if not values:
+                raise ValueError(f"{operator} needs at least one value for column {column}")
+            _operator = "" if operator == "IN" else "NOT "
+            self._predicates.append(
+                f"{_operator}{_column} IN UNNEST({self._add_parameter(values)})"
+            )
+        elif operator in COMPARISON_OPERATORS:
+            if value is None:
+                raise ValueError(f"Use IS NULL/IS NOT NULL to compare column {column} with NULL")
+            self._predicates.append(f"{_column} {operator} {self._add_parameter(value)}")
+        else:
+            raise ValueError(f"Unsupported operator: {operator}")
+        return self
+
+    def partition_range(
+            self, start=None, end=None, partition_field: str = None
+    ) -> "SelectQueryBuilder":
+        """
+        only scan partitions in [start, end), either bound can be left open
+        :param start: date/datetime | (optional) inclusive lower bound
+        :param end: date/datetime | (optional) exclusive upper bound
+        :param partition_field: str | partitioning column, None for ingestion-time partitioned tables
+        :return: SelectQueryBuilder
+        """
+        if not partition_field:
+            partition_field = "_PARTITIONTIME"
+            start, end = (
+                datetime.combine(_bound, time(), tzinfo=timezone.utc)
+                if isinstance(_bound, date) and not isinstance(_bound, datetime)
+                else _bound
+                for _bound in (start, end)
+            )
+        if start is not None:
+            self.where(partition_field, ">=", start)
+        if end is not None:
+            self.where(partition_field, "<", end)
+        return self
+
+    def order_by(self, *columns: str) -> "SelectQueryBuilder":
+        """
+        :param columns: str | column names, prefixed with "-" for descending order
+        :return: SelectQueryBuilder
+        """
+        for _column in columns:
+            if _column.startswith("-"):
+                self._order_by.append(f"{self._quote_column(_column[1:])} DESC")
+            else:
+                self._order_by.append(self._quote_column(_column))
+        return self
+
+    def limit(self, limit: int = None) -> "SelectQueryBuilder":
+        self._limit = int(limit) if limit is not None else None
+        return self
+
+    @property
+    def has_filters(self) -> bool:
+        return bool(self._predicates or self._order_by)
+
+    def get_condition(self) -> tuple:
+        """
+        :return: tuple | (predicates combined using AND, None without predicates; list of query parameters)
+        """
+        return " AND ".join(self._predicates) or None, list(self._query_parameters)
+
+    def build(self) -> tuple:
+        """
+        :return: tuple | (SQL query, list of query parameters)
+        """
+        if not self.columns:
+            print(f"No columns passed for {self.table_id}, all columns are scanned. Not recommended!")
+        _columns = ", ".join(self._quote_column(_col) for _col in self.columns) or "*"
+        select_query = f"SELECT {_columns} FROM `{self.table_id}`"
+        if self.table_alias:
+            select_query += f" {self.table_alias}"
+        if self._predicates:
+            select_query += " WHERE " + " AND ".join(self._predicates)
+        if self._order_by:
+            select_query += " ORDER BY " + ", ".join(self._order_by)
+        if self._limit is not None:
+            select_query += f" LIMIT {self._limit}"
+        return select_query, list(self._query_parameters)
+
+    def _quote_column(self, column: str) -> str:
+        _column = quote_identifier(column)
+        return f"{self.table_alias}.{_column}" if self.table_alias else _column
+
+    def _add_parameter(self, value) -> str:
+        _name = f"p{len(self._query_parameters)}"
+        if isinstance(value, list):
+            self._query_parameters.append(
+                bigquery.ArrayQueryParameter(_name, get_parameter_type(value[0]), value)
+            )
+        else:
+            self._query_parameters.append(
+                bigquery.ScalarQueryParameter(_name, get_parameter_type(value), value)
+            )
+        return f"@{_name}"
+
+
+if __name__ == "__main__":
+    query_builder = (
+        SelectQueryBuilder(
+            table_id="sandbox-381608.user_data.user_profiles", columns=["name", "email"]
+        )
+        .where("country", "IN", ["DE", "AT"])
+        .partition_range(start=date(2023, 1, 1), partition_field="created_date")
+        .order_by("-created_date")
+        .limit(10)
+    )
+    print(query_builder.build())
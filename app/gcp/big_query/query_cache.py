@@ -0,0 +1,188 @@
+"""
+in-memory cache for query results, with TTL and size-bounded LRU eviction
+"""
+from collections import OrderedDict
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+from dotenv import load_dotenv
+
+# string-literals and quoted identifiers are kept as-is, comments are dropped and whitespace is collapsed
+_SQL_TOKEN_PATTERN = re.compile(
+    r"""('(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|`[^`]*`)|(?:\s|--[^\n]*|#[^\n]*|/\*.*?\*/)+""",
+    re.DOTALL,
+)
+_TABLE_REFERENCE_PATTERN = re.compile(
+    r"`([\w\-]+\.[\w\-]+(?:\.[\w\-]+)?)`|\b(?:FROM|JOIN)\s+([\w\-]+\.[\w\-]+(?:\.[\w\-]+)?)\b",
+    re.IGNORECASE,
+)
+# a table reference (with optional alias) followed by a comma, i.e. a comma-join whose other tables are unquoted
+_COMMA_JOIN_PATTERN = re.compile(
+    r"\b(?:FROM|JOIN)\s+(?:`[^`]*`|[\w\-.]+)(?:\s+(?:AS\s+)?\w+)?\s*,",
+    re.IGNORECASE,
+)
+_CACHEABLE_STATEMENT_PATTERN = re.compile(r"^\(*\s*(SELECT|WITH)\b", re.IGNORECASE)
+_NON_DETERMINISTIC_PATTERN = re.compile(
+    r"\b(CURRENT_(DATE|DATETIME|TIME|TIMESTAMP)|RAND|GENERATE_UUID|SESSION_USER)\s*\(",
+    re.IGNORECASE,
+)
+
+
+def normalize_sql(sql_query: str) -> str:
+    """
+    normalize an SQL query for use as cache-key: comments are removed and whitespace is collapsed
+    :param sql_query: str | SQL query as plaintext
+    :return: str | normalized query
+    """
+
+    def _replace(match: re.Match) -> str:
+        return match.group(1) if match.group(1) is not None else " "
+
+    return _SQL_TOKEN_PATTERN.sub(_replace, sql_query).strip().rstrip(";").strip()
+
+
+def get_referenced_tables(sql_query: str) -> list:
+    """
+    return the table-ids referenced in an SQL query, e.g. `project.dataset.table` or dataset.table
+    :param sql_query: str | SQL query as plaintext
+    :return: list | sorted, unique table-ids
+    """
+    return sorted(
+        {
+            _quoted or _unquoted
+            for _quoted, _unquoted in _TABLE_REFERENCE_PATTERN.findall(sql_query)
+        }
+    )
+
+
+def is_cacheable_query(normalized_sql: str) -> bool:
+    """
+    only deterministic SELECT-statements can be served from the cache, whose tables are all found by
+    get_referenced_tables, which misses e.g. the unquoted tables of comma-joins like FROM d.a, d.b
+    :param normalized_sql: str | normalized query, see normalize_sql
+    :return: bool
+    """
+    return bool(
+        _CACHEABLE_STATEMENT_PATTERN.match(normalized_sql)
+        and not _NON_DETERMINISTIC_PATTERN.search(normalized_sql)
+        and not _COMMA_JOIN_PATTERN.search(normalized_sql)
+    )
+
+
+def get_query_cache_key(normalized_sql: str, tables_modified: dict, result_format: str = None) -> str:
+    """
+    build cache-key from normalized query and the modified-timestamps of the tables it reads
+    :param normalized_sql: str | normalized query, see normalize_sql
+    :param tables_modified: dict | {table_id: modified-timestamp}
+    :param result_format: str | (optional) format of the cached results, so callers get the format they cache
+    :return: str
+    """
+    _key_string = json.dumps(
+        [result_format, normalized_sql, sorted(tables_modified.items())], default=str
+    )
+    return hashlib.sha256(_key_string.encode()).hexdigest()
+
+
+class QueryResultCache:
+    def __init__(self, ttl_seconds: float = 300, max_bytes: int = 64 * 1024 * 1024):
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # key: (expires_at, size, value)
+        self._lock = threading.Lock()
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str):
+        """
+        return cached value for key, or None if it's missing or expired
+        :param key: str | cache-key
+        :return: cached value or None
+        """
+        with self._lock:
+            if (_entry := self._entries.get(key)) is None:
+                self.misses += 1
+                return None
+            expires_at, _size, value = _entry
+            if expires_at < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: str, value) -> bool:
+        """
+        cache a value, evicting least-recently-used entries to stay within the byte budget
+        :param key: str | cache-key
+        :param value: json-serializable value
+        :return: bool | whether the value was cached (values larger than the budget are not)
+        """
+        size = len(json.dumps(value, default=str))
+        if size > self.max_bytes:
+            return False
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            while self._entries and self.current_bytes + size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, size, value)
+            self.current_bytes += size
+        return True
+
+    def delete(self, key: str) -> None:
+        """
+        drop the cached value of key, if any
+        :param key: str | cache-key
+        :return:
+        """
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def get_stats(self) -> dict:
+        """
+        return hit/miss/eviction counters and current usage of the cache
+        :return: dict
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "current_bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl_seconds,
+            }
+
+    def _remove(self, key: str) -> None:
+        _expires_at, size, _value = self._entries.pop(key)
+        self.current_bytes -= size
+
+
+load_dotenv()
+# process-wide cache, configurable using env-vars QUERY_CACHE_TTL_SECONDS and QUERY_CACHE_MAX_BYTES
+query_result_cache = QueryResultCache(
+    ttl_seconds=float(os.getenv("QUERY_CACHE_TTL_SECONDS") or 300),
+    max_bytes=int(os.getenv("QUERY_CACHE_MAX_BYTES") or 64 * 1024 * 1024),
+)
+# (modified-timestamp, table-type) of tables keyed by full table-id, so cache hits don't need a get_table request
+# per table; configurable using env-var TABLE_MODIFIED_TTL_SECONDS, cached results can be that much behind a table
+# change by other processes (writes through BigQueryTable drop the entry right away)
+table_modified_cache = QueryResultCache(
+    ttl_seconds=float(os.getenv("TABLE_MODIFIED_TTL_SECONDS") or 5),
+    max_bytes=1024 * 1024,
+)
@@ -0,0 +1,223 @@
+"""
+local replicas of small, rarely changing BigQuery tables, to answer queries on them without BigQuery jobs
+"""
+import os
+import re
+import threading
+import time
+
+from google.cloud import bigquery
+
+from app.gcp.big_query.local_backend import LocalBigQueryClient
+from app.gcp.big_query.query_cache import get_referenced_tables, normalize_sql
+
+# functions answered from replicas, only those with the same results in DuckDB and BigQuery: e.g. CONCAT and
+# GREATEST skip NULL arguments in DuckDB but return NULL in BigQuery, so queries using them go to BigQuery
+REPLICA_FUNCTIONS = frozenset(
+    {"COUNT", "SUM", "MIN", "MAX", "AVG", "COALESCE", "IFNULL", "LOWER", "UPPER", "LENGTH", "TRIM", "ABS"}
+)
+# keywords that can be followed by a parenthesis, e.g. IN (...) or FROM (subquery)
+_REPLICA_KEYWORDS = frozenset(
+    {
+        "SELECT", "FROM", "WHERE", "AND", "OR", "NOT", "IN", "AS", "ON", "USING", "JOIN", "EXISTS", "UNNEST",
+        "ALL", "DISTINCT", "BY", "WHEN", "THEN", "ELSE", "CASE", "HAVING",
+    }
+)
+_LITERAL_PATTERN = re.compile(r"""'(?:[^'\\]|\\.)*'|"(?:[^"\\]|\\.)*"|`[^`]*`""")
+_FUNCTION_CALL_PATTERN = re.compile(r"\b(\w+)\s*\(")
+# no other operators, e.g. "/" returns NULL on division by zero in DuckDB but fails in BigQuery
+_REPLICA_CHARACTERS_PATTERN = re.compile(r"^[\w\s=<>!+\-*,.()@]*$")
+
+
+def is_replicable_query(normalized_sql: str) -> bool:
+    """
+    only SELECT-queries using a subset of SQL with the same semantics in DuckDB and BigQuery are answered
+    from replicas: the functions in REPLICA_FUNCTIONS, comparison and arithmetic operators except division,
+    and literals without escape sequences (backslashes aren't escapes in DuckDB)
+    :param normalized_sql: str | normalized query, see normalize_sql
+    :return: bool
+    """
+    if not normalized_sql.upper().startswith(("SELECT", "WITH", "(")):
+        return False
+    if any("\\" in _literal for _literal in _LITERAL_PATTERN.findall(normalized_sql)):
+        return False
+    unquoted_sql = _LITERAL_PATTERN.sub(" ", normalized_sql)
+    return bool(_REPLICA_CHARACTERS_PATTERN.match(unquoted_sql)) and all(
+        _name.upper() in REPLICA_FUNCTIONS or _name.upper() in _REPLICA_KEYWORDS
+        for _name in _FUNCTION_CALL_PATTERN.findall(unquoted_sql)
+    )
+
+
+def create_table_replicas(project_id: str = None):
+    """
+    create the replicas of the tables listed in the replica config file (replica_tables.json, next to
+    json_key_mapping.json), e.g.
+        {"tables": ["project.dataset.table", "dataset.other_table"], "check_interval_seconds": 60}
+    :param project_id: str | project of table-ids listed without one
+    :return: TableReplicas, None if no tables are configured or the local DuckDB engine can't be started
+    """
+    from app.utils.file_utils import get_config_filepath, get_data_from_json_file
+
+    # replicas are served by DuckDB, which the local backend already is
+    if (os.getenv("BIGQUERY_BACKEND") or "bigquery").lower() != "bigquery":
+        return None
+    try:
+        replica_config = get_data_from_json_file(get_config_filepath("REPLICA_CONFIG_FILE"))
+    except FileNotFoundError:
+        return None
+    if not replica_config.get("tables"):
+        return None
+    try:
+        local_client = LocalBigQueryClient(
+            project=project_id, database=os.getenv("REPLICA_DATABASE") or ":memory:"
+        )
+    except Exception as e:
+        print(f"Exception caught while creating table replicas, queries go to BigQuery: {e}")
+        return None
+    return TableReplicas(
+        project_id=project_id,
+        table_ids=replica_config["tables"],
+        local_client=local_client,
+        check_interval_seconds=replica_config.get("check_interval_seconds", 60),
+        max_table_bytes=replica_config.get("max_table_bytes", 256 * 1024 * 1024),
+    )
+
+
+class TableReplicas:
+    """
+    mirrors configured tables into a local DuckDB engine and answers read-only queries that only touch them
+    * a replica is (re-)downloaded when Table.modified of its table changed, which is checked at most once
+      per check_interval_seconds, so answers can be that much behind the table
+    * queries reading any other table, using SQL outside the subset of is_replicable_query, or failing
+      locally go to BigQuery
+    """
+
+    def __init__(
+            self,
+            project_id: str,
+            table_ids: list,
+            local_client: LocalBigQueryClient,
+            check_interval_seconds: float = 60,
+            max_table_bytes: int = 256 * 1024 * 1024,
+    ):
+        self.project_id = project_id
+        self.table_ids = {self.get_full_table_id(_table_id) for _table_id in table_ids}
+        self.local_client = local_client
+        self.check_interval_seconds = check_interval_seconds
+        self.max_table_bytes = max_table_bytes
+        self._replica_modified = {}  # table_id: Table.modified of the replicated version
+        self._checked_at = {}  # table_id: time of last check
+        self._table_locks = {_table_id: threading.Lock() for _table_id in self.table_ids}
+        self.hits = 0
+        self.misses = 0
+
+    def get_full_table_id(self, table_id: str) -> str:
+        table_id = table_id.replace("`", "")
+        return table_id if table_id.count(".") == 2 else f"{self.project_id}.{table_id}"
+
+    def get_replicated_tables(self, sql_query: str) -> list:
+        """
+        return the tables a query reads, if it can be answered locally and all of them are replicated
+        :param sql_query: str | SQL query as plaintext
+        :return: list | full table-ids, empty if the query can't be answered locally
+        """
+        normalized_sql = normalize_sql(sql_query)
+        if not is_replicable_query(normalized_sql):
+            return []
+        table_ids = [self.get_full_table_id(_table_id) for _table_id in get_referenced_tables(normalized_sql)]
+        if not table_ids or not set(table_ids) <= self.table_ids:
+            return []
+        return table_ids
+
+    def query(self, client, sql_query: str, query_parameters: list = None):
+        """
+        answer a query from the replicas, refreshing outdated ones first
+        :param client: BigQueryClient | client to check and download the replicated tables with
+        :param sql_query: str | SQL query as plaintext
+        :param query_parameters: list | (optional) query parameters referenced in the query
+        :return: RowIterator-like results, None if the query has to go to BigQuery
+        """
+        if not (table_ids := self.get_replicated_tables(sql_query)):
+            return None
+        try:
+            for _table_id in table_ids:
+                if not self.refresh(client=client, table_id=_table_id):
+                    self.misses += 1
+                    return None
+            query_job = self.local_client.query(
+                sql_query, job_config=bigquery.QueryJobConfig(query_parameters=query_parameters or [])
+            )
+            row_iterator = query_job.result()
+        except Exception as e:
+            print(f"Query can't be answered from replicas, falling back to BigQuery: {e}")
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row_iterator
+
+    def refresh(self, client, table_id: str, force: bool = False) -> bool:
+        """
+        download the table into its replica, if its Table.modified changed since the last download
+        :param client: BigQueryClient | client to check and download the table with
+        :param table_id: str | full table-id of a replicated table
+        :param force: bool | check the table even if it was checked within check_interval_seconds
+        :return: bool | whether an up-to-date replica is available
+        """
+        with self._table_locks[table_id]:
+            if (
+                    not force
+                    and table_id in self._checked_at
+                    and time.monotonic() - self._checked_at[table_id] < self.check_interval_seconds
+            ):
+                return table_id in self._replica_modified
+            table = client.bq_client.get_table(table_id)
+            self._checked_at[table_id] = time.monotonic()
+            if self._replica_modified.get(table_id) == table.modified:
+                return True
+            if (table.num_bytes or 0) > self.max_table_bytes:
+                print(
+                    f"Table {table_id} has {table.num_bytes} bytes, exceeding max_table_bytes of replicas"
+                )
+                return False
+            _start_time = time.monotonic()
+            arrow_table = client.convert_row_iterator(
+                client.bq_client.list_rows(table), result_format="arrow"
+            )
+            job = self.local_client.load_table_from_arrow(
+                arrow_table,
+                table_id,
+                job_config=bigquery.LoadJobConfig(
+                    schema=table.schema,
+                    write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+                ),
+            )
+            job.result()
+            self._replica_modified[table_id] = table.modified
+            print(
+                f"INFO: Replicated {arrow_table.num_rows} rows of {table_id} "
+                f"in {time.monotonic() - _start_time:.2f}s"
+            )
+            return True
+
+    def refresh_all(self, client) -> None:
+        """
+        check and download all replicated tables, e.g. on startup
+        :param client: BigQueryClient | client to check and download the tables with
+        :return:
+        """
+        for _table_id in sorted(self.table_ids):
+            try:
+                self.refresh(client=client, table_id=_table_id, force=True)
+            except Exception as e:
+                print(f"Exception caught while replicating {_table_id}: {e}")
+
+    def get_stats(self) -> dict:
+        return {
+            "tables": sorted(self.table_ids),
+            "replicated": sorted(self._replica_modified),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+    def close(self) -> None:
+        self.local_client.close()
@@ -0,0 +1,213 @@
+"""
+local store for high-watermarks of primary keys of BigQuery tables
+"""
+from contextlib import contextmanager
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+import json
+import numbers
+import os
+import re
+import tempfile
+import threading
+
+import pandas as pd
+
+from app.utils.file_utils import get_project_path
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows, updates are then only serialized within a process
+    fcntl = None
+
+_ISO_DATE_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}([ tT]\d{2}:\d{2}.*)?$")
+
+
+def to_watermark_value(value) -> any:
+    """
+    convert a p_key value to a json-compatible watermark value, keeping numbers (incl. NUMERIC) comparable
+    non-integral Decimals are stored as strings, as floats can't hold NUMERIC/BIGNUMERIC values exactly
+    :param value: any | p_key value, e.g. from a query-result or dataframe
+    :return: int, float or str, None for missing values
+    """
+    if value is None or (pd.api.types.is_scalar(value) and pd.isna(value)):
+        return None
+    if hasattr(value, "item") and not isinstance(value, (str, bytes)):  # numpy scalars
+        value = value.item()
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (int, float)):
+        return value
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else str(value)
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def to_comparable_watermark(value) -> any:
+    """
+    parse ISO-formatted dates and timestamps, so they are compared as points in time (naive ones as UTC)
+    rather than as strings, which breaks for lower-cased values or different UTC-offsets
+    :param value: watermark value, see to_watermark_value
+    :return: pd.Timestamp for ISO-formatted strings, value as-is otherwise
+    """
+    if not isinstance(value, str) or not _ISO_DATE_PATTERN.match(value):
+        return value
+    try:
+        timestamp = pd.Timestamp(value)
+    except ValueError:
+        return value
+    return timestamp.tz_localize("UTC") if timestamp.tzinfo is None else timestamp
+
+
+def is_number(value) -> bool:
+    """
+    check if a p_key value is a number (incl. Decimals and numpy scalars), but not a bool
+    :param value: any | p_key value
+    :return: bool
+    """
+    return isinstance(value, numbers.Number) and not isinstance(value, bool)
+
+
+def _to_decimal(value) -> Decimal:
+    try:
+        return Decimal(str(value))
+    except InvalidOperation:
+        return None
+
+
+def is_higher_watermark(new_value, current_value, numeric: bool = False) -> bool:
+    """
+    check if new_value is above current_value, comparing as strings if types differ
+    :param new_value: watermark value, see to_watermark_value
+    :param current_value: watermark value, see to_watermark_value
+    :param numeric: bool | (optional, default=False) compare as Decimals, e.g. for NUMERIC values stored as
+        strings; falls back to the comparisons of other values if either isn't a number
+    :return: bool
+    """
+    if new_value is None:
+        return False
+    if current_value is None:
+        return True
+    if numeric and None not in (
+            new_decimal := _to_decimal(new_value), current_decimal := _to_decimal(current_value)
+    ):
+        return new_decimal > current_decimal
+    try:
+        return to_comparable_watermark(new_value) > to_comparable_watermark(current_value)
+    except TypeError:
+        return str(new_value) > str(current_value)
+
+
+class WatermarkStore:
+    """
+    json-file backed store of {table_id: {p_key: watermark}}, shared by all tables and worker processes
+    the file is reloaded whenever it changed, and re-read before every update under a lock-file, so
+    workers never overwrite each others' watermarks with stale copies
+    """
+
+    def __init__(self, file_path: str = None):
+        self.file_path = file_path or os.path.join(
+            get_project_path(path_id="data"), "watermarks.json"
+        )
+        self._lock = threading.Lock()
+        self._watermarks = None
+        self._file_signature = None
+
+    def get(self, table_id: str, p_key: str) -> any:
+        """
+        return stored watermark for p_key of table, None if not known
+        :param table_id: str | full table-id
+        :param p_key: str | primary-key column
+        :return: watermark value
+        """
+        with self._lock:
+            return self._load().get(table_id, {}).get(p_key)
+
+    def advance(self, table_id: str, p_key: str, value) -> any:
+        """
+        store value as watermark for p_key of table, if it's above the stored one
+        :param table_id: str | full table-id
+        :param p_key: str | primary-key column
+        :param value: any | candidate watermark value
+        :return: watermark value stored after the update
+        """
+        numeric = is_number(value)
+        value = to_watermark_value(value)
+        with self._lock, self._file_lock():
+            _table_watermarks = self._load(reload=True).setdefault(table_id, {})
+            if is_higher_watermark(value, _table_watermarks.get(p_key), numeric=numeric):
+                _table_watermarks[p_key] = value
+                self._save()
+            return _table_watermarks.get(p_key)
+
+    def set(self, table_id: str, p_key: str, value) -> None:
+        """
+        store value as watermark for p_key of table, overwriting the stored one
+        :param table_id: str | full table-id
+        :param p_key: str | primary-key column
+        :param value: any | watermark value
+        :return:
+        """
+        with self._lock, self._file_lock():
+            self._load(reload=True).setdefault(table_id, {})[p_key] = to_watermark_value(value)
+            self._save()
+
+    def delete(self, table_id: str) -> None:
+        """
+        drop all stored watermarks of table, e.g. after it's deleted or truncated
+        :param table_id: str | full table-id
+        :return:
+        """
+        with self._lock, self._file_lock():
+            if self._load(reload=True).pop(table_id, None) is not None:
+                self._save()
+
+    @contextmanager
+    def _file_lock(self):
+        """
+        exclusive lock of the store across processes, held for read-modify-write updates
+        """
+        if fcntl is None:
+            yield
+            return
+        os.makedirs(os.path.dirname(self.file_path), exist_ok=True)
+        with open(f"{self.file_path}.lock", "a") as fp:
+            fcntl.flock(fp, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fp, fcntl.LOCK_UN)
+
+    def _get_file_signature(self):
+        # the file is replaced on every save, so its inode changes even if the mtime doesn't
+        try:
+            _stat = os.stat(self.file_path)
+        except FileNotFoundError:
+            return None
+        return _stat.st_ino, _stat.st_mtime_ns, _stat.st_size
+
+    def _load(self, reload: bool = False) -> dict:
+        _file_signature = self._get_file_signature()
+        if reload or self._watermarks is None or _file_signature != self._file_signature:
+            try:
+                with open(self.file_path, "r") as fp:
+                    self._watermarks = json.load(fp)
+            except FileNotFoundError:
+                self._watermarks = {}
+            self._file_signature = _file_signature
+        return self._watermarks
+
+    def _save(self) -> None:
+        _dir = os.path.dirname(self.file_path)
+        os.makedirs(_dir, exist_ok=True)
+        # write to a temp-file first, so a crash never leaves a partially written store
+        with tempfile.NamedTemporaryFile("w", dir=_dir, delete=False, suffix=".tmp") as fp:
+            json.dump(self._watermarks, fp, indent=4)
+        os.replace(fp.name, self.file_path)
+        self._file_signature = self._get_file_signature()
+
+
+# process-wide store, location can be set using env-var WATERMARK_STORE_PATH
+watermark_store = WatermarkStore(file_path=os.getenv("WATERMARK_STORE_PATH"))
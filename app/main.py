@@ -1,10 +1,19 @@
 """
 main code for FastAPI setup
 """
+import os
+import threading
+
 import uvicorn
-from fastapi import FastAPI, HTTPException
+from anyio import to_thread
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from app.api.api import Api
-from app.models.models import AppDetails
+from app.gcp.base_client import close_shared_clients, get_threadpool_size
+from app.gcp.big_query.big_query_client import BigQueryClient, get_page_token_secret
+from app.gcp.big_query.query_budget import QueryBudgetExceeded
+from app.utils.cloud_project_utils import get_cached_project_id_and_secrets_env
+from app.models.models import AppDetails, QueryCacheStats
 from app.models.models import GetBigQueryRequest, GetBigQueryResponse
 
 description = """
@@ -33,6 +42,77 @@ app = FastAPI(
 )
 
 
+@app.on_event("startup")
+def configure_threadpool():
+    # the HTTP-pool of the shared clients is sized on the same value, see get_http_pool_size
+    to_thread.current_default_thread_limiter().total_tokens = get_threadpool_size()
+
+
+@app.on_event("startup")
+def resolve_project_id():
+    # resolve eagerly, so no request has to wait for the metadata-server
+    get_cached_project_id_and_secrets_env()
+
+
+@app.on_event("startup")
+def check_page_token_secret():
+    # page-tokens issued by one worker or instance must be valid on all others
+    try:
+        get_page_token_secret()
+    except ValueError as e:
+        raise RuntimeError(f"{e}, with the same value for all workers and instances") from e
+
+
+@app.on_event("startup")
+def create_bigquery_client():
+    # shared by all requests, so async handlers don't build clients on the event loop, see get_bigquery_client
+    app.state.bq_client = BigQueryClient()
+
+
+@app.on_event("startup")
+def warm_up_table_replicas():
+    # download the configured table replicas in the background, queries go to BigQuery until they're ready
+    def _refresh():
+        try:
+            app.state.bq_client.refresh_table_replicas()
+        except Exception as e:
+            print(f"Exception caught while warming up table replicas: {e}")
+
+    threading.Thread(target=_refresh, name="table-replicas-warm-up", daemon=True).start()
+
+
+@app.on_event("shutdown")
+def close_clients():
+    app.state.bq_client = None
+    close_shared_clients()
+
+
+def get_bigquery_client(http_request: Request) -> BigQueryClient:
+    """
+    client created at startup, None if the startup hooks didn't run: it's then built in a worker thread,
+    see api.get_client_async
+    :param http_request: Request
+    :return: BigQueryClient
+    """
+    return getattr(http_request.app.state, "bq_client", None)
+
+
+def get_caller(http_request: Request) -> str:
+    """
+    identifier of the caller charged with query-budgets, not taken from the payload as clients could choose it
+    freely: the value of the header named by env-var CALLER_ID_HEADER, which has to be set by an authenticating
+    proxy in front of the API (e.g. X-Goog-Authenticated-User-Email of IAP), otherwise the client address,
+    which uvicorn takes from X-Forwarded-For of the proxies trusted by --forwarded-allow-ips
+    :param http_request: Request
+    :return: str, None if the caller is unknown
+    """
+    if (caller_id_header := os.getenv("CALLER_ID_HEADER")) and (
+            caller_id := http_request.headers.get(caller_id_header)
+    ):
+        return caller_id
+    return http_request.client.host if http_request.client else None
+
+
 @app.get(
     "/",
 )
@@ -48,19 +128,81 @@ def get_app_info() -> AppDetails:
     return AppDetails(**Api().get_app_details())
 
 
+@app.get("/query_cache_stats/", tags=["bigquery-results"])
+def get_query_cache_stats() -> QueryCacheStats:
+    return QueryCacheStats(**Api().get_query_cache_stats())
+
+
 @app.post(
     "/bigquery_operation_results",
     status_code=200,
     tags=["bigquery-results"],
 )
-def get_bigquery_operation_results(payload: GetBigQueryRequest) -> GetBigQueryResponse:
-    if bigquery_response := Api().get_bigquery_operation_results(
+async def get_bigquery_operation_results(
+        payload: GetBigQueryRequest, http_request: Request
+) -> GetBigQueryResponse:
+    bq_client = get_bigquery_client(http_request)
+    budget_reservation = None
+    # later pages are read from the query's destination table, i.e. were already admitted
+    if not payload.page_token:
+        try:
+            budget_reservation = await Api().check_query_budget(
+                _query=payload.query, caller=get_caller(http_request), bq_client=bq_client
+            )
+        except QueryBudgetExceeded as e:
+            raise HTTPException(
+                status_code=400,
+                detail={"error": str(e), "estimated_bytes_processed": e.estimated_bytes},
+            ) from e
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Error: {e}") from e
+    estimated_bytes = budget_reservation.estimated_bytes if budget_reservation else None
+    if payload.stream:
+        try:
+            ndjson_stream = await Api().get_bigquery_operation_results_stream(
+                _query=payload.query,
+                gbq_table_id=payload.gbq_table_id,
+                budget_reservation=budget_reservation,
+                bq_client=bq_client,
+            )
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Error: {e}") from e
+        return StreamingResponse(
+            ndjson_stream,
+            media_type="application/x-ndjson",
+            headers=(
+                {"X-Estimated-Bytes-Processed": str(estimated_bytes)}
+                if estimated_bytes is not None
+                else None
+            ),
+        )
+    if payload.page_size or payload.page_token:
+        try:
+            bigquery_response = await Api().get_bigquery_operation_results_page(
+                _query=payload.query,
+                page_size=payload.page_size,
+                page_token=payload.page_token,
+                gbq_table_id=payload.gbq_table_id,
+                budget_reservation=budget_reservation,
+                bq_client=bq_client,
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Error: {e}") from e
+    else:
+        bigquery_response = await Api().get_bigquery_operation_results_async(
             _query=payload.query,
             gbq_table_id=payload.gbq_table_id,
-    ):
+            budget_reservation=budget_reservation,
+            bq_client=bq_client,
+        )
+    if bigquery_response:
         return GetBigQueryResponse(
             request=payload,
-            query_results=bigquery_response.get("response")
+            query_results=bigquery_response.get("response"),
+            next_page_token=bigquery_response.get("next_page_token"),
+            page_tokens=bigquery_response.get("page_tokens"),
+            total_rows=bigquery_response.get("total_rows"),
+            estimated_bytes_processed=estimated_bytes,
         )
     else:
         raise HTTPException(status_code=400, detail="Error")
@@ -12,11 +12,29 @@ class AppDetails(BaseModel):
 class GetBigQueryRequest(BaseModel):
     query: str
     gbq_table_id: Union[str, None] = None
+    stream: bool = False
+    page_size: Union[int, None] = None
+    page_token: Union[str, None] = None
 
 
 class GetBigQueryResponse(BaseModel):
     request: GetBigQueryRequest
     query_results: Union[dict, None] = None
+    next_page_token: Union[str, None] = None
+    # with the first page: tokens of the following pages, e.g. to fetch them in parallel
+    page_tokens: Union[List[str], None] = None
+    total_rows: Union[int, None] = None
+    estimated_bytes_processed: Union[int, None] = None
+
+
+class QueryCacheStats(BaseModel):
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    entries: int = 0
+    current_bytes: int = 0
+    max_bytes: int = 0
+    ttl_seconds: float = 0
 
 
 class GbqTableDetails:
@@ -2,9 +2,48 @@
 utils for working with GCP APIs
 """
 import os
+import threading
+import time
 
 from dotenv import load_dotenv
 
+# timeout (in seconds) for calls to the GCP metadata-server, can be set using env-var METADATA_SERVER_TIMEOUT
+METADATA_SERVER_TIMEOUT = 1.0
+# env-vars checked for the project-id before asking the metadata-server
+PROJECT_ID_ENV_VARS = ("GCP_PROJECT_NAME", "GOOGLE_CLOUD_PROJECT", "GCP_PROJECT")
+
+# seconds a failed resolution is cached before it's tried again, can be set using env-var PROJECT_ID_RETRY_SECONDS
+PROJECT_ID_RETRY_SECONDS = 60.0
+
+# project-id and secrets-env are resolved once per process, failures are cached for PROJECT_ID_RETRY_SECONDS
+_resolved_project_id_and_secrets_env: dict = {}
+_resolution_error: dict = {}  # {"error": exception, "failed_at": monotonic time}
+_resolve_lock = threading.Lock()
+
+
+def get_cached_project_id_and_secrets_env() -> dict:
+    """
+    return project-id and secrets_env for GCP, resolving them only on the first call of the process;
+    if that fails, calls within PROJECT_ID_RETRY_SECONDS raise the same error without trying again,
+    so requests don't each wait for the timeout of the metadata-server
+    :return: dict
+    """
+    if not _resolved_project_id_and_secrets_env:
+        with _resolve_lock:
+            if not _resolved_project_id_and_secrets_env:
+                _retry_seconds = float(os.getenv("PROJECT_ID_RETRY_SECONDS") or PROJECT_ID_RETRY_SECONDS)
+                if _resolution_error and time.monotonic() - _resolution_error["failed_at"] < _retry_seconds:
+                    raise _resolution_error["error"].with_traceback(None)
+                try:
+                    _resolved_project_id_and_secrets_env.update(
+                        CloudProjectUtils().get_project_id_and_secrets_env()
+                    )
+                except Exception as e:
+                    _resolution_error.update(error=e, failed_at=time.monotonic())
+                    raise
+                _resolution_error.clear()
+    return dict(_resolved_project_id_and_secrets_env)
+
 
 class CloudProjectUtils:
     def __init__(self):
@@ -27,7 +66,9 @@ class CloudProjectUtils:
         if self.run_env == "LOCAL":
             self.project_id = self._get_project_id_locally()
         else:  # > python37
-            self.project_id = self.get_project_id_from_gcp()
+            self.project_id = (
+                self._get_project_id_from_env() or self.get_project_id_from_gcp()
+            )
 
             if not self.project_id:
                 raise ValueError("Could not get a value for PROJECT_ID")
@@ -36,6 +77,13 @@ class CloudProjectUtils:
             "secrets_env": self.secrets_env,
         }
 
+    @staticmethod
+    def _get_project_id_from_env():
+        return next(
+            (os.getenv(_env_var) for _env_var in PROJECT_ID_ENV_VARS if os.getenv(_env_var)),
+            None,
+        )
+
     @staticmethod
     def _get_project_id_locally():
         _project_id = os.getenv("GCP_PROJECT_NAME")
@@ -52,15 +100,21 @@ class CloudProjectUtils:
     @staticmethod
     def get_project_id_from_gcp():
         # Only works on Cloud App Run
+        import urllib.error
         import urllib.request
 
         url = "http://metadata.google.internal/computeMetadata/v1/project/project-id"
         req = urllib.request.Request(url)
         req.add_header("Metadata-Flavor", "Google")
-        _project_id = urllib.request.urlopen(req).read().decode()
+        _timeout = float(os.getenv("METADATA_SERVER_TIMEOUT") or METADATA_SERVER_TIMEOUT)
+        try:
+            _project_id = urllib.request.urlopen(req, timeout=_timeout).read().decode()
+        except (urllib.error.URLError, OSError) as e:
+            print(f"Could not reach metadata server: {e}")
+            _project_id = None
 
         if not _project_id:  # Running from Cloud Shell
-            _project_id = os.environ["DEVSHELL_PROJECT_ID"]
+            _project_id = os.getenv("DEVSHELL_PROJECT_ID")
 
         # If this is running in a cloud function, then GCP_PROJECT should be defined
         if not _project_id and "GCP_PROJECT" in os.environ:
@@ -69,5 +123,5 @@ class CloudProjectUtils:
 
 
 if __name__ == "__main__":
-    _pid = CloudProjectUtils().get_project_id_and_secrets_env()
+    _pid = get_cached_project_id_and_secrets_env()
     print(_pid)
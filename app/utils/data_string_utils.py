@@ -1,6 +1,7 @@
-import json
+import re
 from tabulate import tabulate
 import pandas as pd
+import pyarrow as pa
 
 
 def add_missing_dummy_columns(d, columns):
@@ -16,31 +17,147 @@ def flatten_list(unflattened_list):
         return unflattened_list
 
 
+# problematic character sequences in text values and their replacements, e.g. escaped umlauts
+_CLEAN_TEXT_REPLACEMENTS = {
+    "\\–": "–",
+    "\\â": "â",
+    "\\’": "’",
+    "\\xf6": "ö",
+    "\\xfc": "ü",
+    "\\…": "…",
+    "\\xe4": "ä",
+    "\\ ": " ",
+    "\\xe9": "é",
+    "\\xf4": "ô",
+    "\\xe8": "è",
+    "\\‘": "‘",
+    "GB_VOEC": "",
+}
+# single pass over a text for all replacements
+_CLEAN_TEXT_PATTERN = re.compile(
+    "|".join(
+        re.escape(_key)
+        for _key in sorted(_CLEAN_TEXT_REPLACEMENTS, key=len, reverse=True)
+    )
+)
+
+
+def _replace_match(match: re.Match) -> str:
+    return _CLEAN_TEXT_REPLACEMENTS[match.group(0)]
+
+
+def clean_text(text: str) -> str:
+    """
+    replace problematic characters in a string
+    :param text: str with problematic characters
+    :return: str with replaced char
+    """
+    return _CLEAN_TEXT_PATTERN.sub(_replace_match, text)
+
+
 def clean_dict_text(dict_to_clean: dict) -> dict:
     """
-    replace problematic characters in dict
+    replace problematic characters in keys and (nested) text values of dict
     :param dict_to_clean: dict with problematic characters
     :return: dict with replaced char
     """
-    # convert to string
-    string_to_clean = json.dumps(dict_to_clean)
-
-    return json.loads(
-        string_to_clean.replace("\\–", "–")
-        .replace("\\â", "â")
-        .replace("\\’", "’")
-        .replace("\\\\xf6", "ö")
-        .replace("\\\\xfc", "ü")
-        .replace("\\…", "…")
-        .replace("\\\\xe4", "ä")
-        .replace("\\ ", " ")
-        .replace("\\\\xe9", "é")
-        .replace("\\\\xf4", "ô")
-        .replace("\\\\xe8", "è")
-        .replace("\\‘", "‘")
-        .replace('"GB_VOEC"', '""')
-        .replace("GB_VOEC", '""')
-    )
+    return _clean_value(dict_to_clean)
+
+
+def _clean_value(value):
+    if isinstance(value, str):
+        return clean_text(value)
+    if isinstance(value, dict):
+        return {_clean_value(_key): _clean_value(_val) for _key, _val in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_clean_value(_item) for _item in value]
+    return value
+
+
+def clean_records_text(records: list) -> list:
+    """
+    replace problematic characters in a batch of records (dicts), record by record
+    :param records: list of dicts with problematic characters
+    :return: list of dicts with replaced char
+    """
+    return [clean_dict_text(_record) for _record in records]
+
+
+def clean_dataframe_text(data_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    replace problematic characters in the column names and text columns of a dataframe, text columns are
+    cleaned using arrow compute kernels, columns mixing text with other values are cleaned value by value
+    :param data_df: pd.DataFrame with problematic characters
+    :return: pd.DataFrame with replaced char (a new frame, columns without replacements are shared)
+    """
+    cleaned_columns = {}
+    for _col in data_df.columns[
+        [pd.api.types.is_object_dtype(_dtype) or pd.api.types.is_string_dtype(_dtype)
+         for _dtype in data_df.dtypes]
+    ]:
+        _series = data_df[_col]
+        if pd.api.types.infer_dtype(_series, skipna=True) == "string":
+            _cleaned_array = _clean_arrow_strings(pa.array(_series, type=pa.string(), from_pandas=True))
+            if _cleaned_array is not None:
+                # missing values come back as None, keep them as they were (e.g. NaN)
+                cleaned_columns[_col] = pd.Series(
+                    _cleaned_array.to_pandas(), index=_series.index, dtype=_series.dtype
+                ).where(_series.notna(), _series)
+        else:
+            cleaned_columns[_col] = _series.map(_clean_value)
+    if cleaned_columns:
+        data_df = data_df.assign(**cleaned_columns)
+    if any(isinstance(_col, str) and _CLEAN_TEXT_PATTERN.search(_col) for _col in data_df.columns):
+        data_df = data_df.rename(columns=_clean_value, copy=False)
+    return data_df
+
+
+def clean_arrow_text(data_table: pa.Table) -> pa.Table:
+    """
+    replace problematic characters in the column names and string columns of an arrow table, using arrow
+    compute kernels; columns are only rewritten if they contain any problematic character
+    :param data_table: pa.Table with problematic characters
+    :return: pa.Table with replaced char
+    """
+    for _index, _field in enumerate(data_table.schema):
+        if not (pa.types.is_string(_field.type) or pa.types.is_large_string(_field.type)):
+            continue
+        if (_column := _clean_arrow_strings(data_table.column(_index))) is not None:
+            data_table = data_table.set_column(_index, _field, _column)
+    column_names = [clean_text(_name) for _name in data_table.column_names]
+    if column_names != data_table.column_names:
+        data_table = data_table.rename_columns(column_names)
+    return data_table
+
+
+def _clean_arrow_strings(array):
+    """
+    replace problematic characters in an arrow string array
+    :param array: pa.Array or pa.ChunkedArray of strings
+    :return: cleaned array, None if it contains no problematic character
+    """
+    import pyarrow.compute as pc
+
+    if not pc.any(pc.match_substring_regex(array, _CLEAN_TEXT_PATTERN.pattern)).as_py():
+        return None
+    for _key, _val in _CLEAN_TEXT_REPLACEMENTS.items():
+        array = pc.replace_substring(array, pattern=_key, replacement=_val)
+    return array
+
+
+def clean_text_batch(data_to_clean):
+    """
+    replace problematic characters in a batch of data, using the fastest path for its type
+    :param data_to_clean: dict, list of dicts, pd.DataFrame or pa.Table
+    :return: cleaned data of the same type
+    """
+    if isinstance(data_to_clean, pd.DataFrame):
+        return clean_dataframe_text(data_df=data_to_clean)
+    if isinstance(data_to_clean, pa.Table):
+        return clean_arrow_text(data_table=data_to_clean)
+    if isinstance(data_to_clean, list):
+        return clean_records_text(records=data_to_clean)
+    return clean_dict_text(dict_to_clean=data_to_clean)
 
 
 def clean_invalid_fields_from_list_of_dicts(
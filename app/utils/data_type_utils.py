@@ -4,9 +4,11 @@ utils to work with/on different data-types including interconversions
 from __future__ import annotations
 from tabulate import tabulate
 import pandas as pd
+import pyarrow as pa
 # from app.models.fin_attribute import FinAttribute
 import re
 from typing import Iterable, Generator
+from app.utils.gbq_utils import get_column_name_mapping, normalize_column_name, normalize_column_names
 
 
 def flatten(items: Iterable) -> Generator:
@@ -141,31 +143,44 @@ def pretty_print_df(dataframe: pd.DataFrame) -> dict:
 
 
 def fix_special_characters_in_json_keys(
-    data_to_update: dict | list[dict] | pd.DataFrame,
-) -> list[dict]:
-    if isinstance(data_to_update, (dict, list)):
-        if isinstance(data_to_update, dict):
-            data_to_update = [data_to_update]
-        _df = pd.DataFrame(data_to_update)
-    else:
-        _df = data_to_update
-    _df.rename(columns=lambda x: replace_special_characters_in_string(x), inplace=True)
-    return _df.to_dict(orient="records")
+    data_to_update: dict | list[dict] | pd.DataFrame | pa.Table,
+) -> dict | list[dict] | pd.DataFrame | pa.Table:
+    """
+    replace special characters in keys/column-names, without converting or copying the data:
+    * dict / list of dicts: only the keys are rewritten
+    * pd.DataFrame: columns are renamed on a shallow copy sharing the data, the input is not modified
+    * pyarrow.Table: columns are renamed on a new table sharing the data (zero-copy)
+    :param data_to_update: data whose keys/column-names are fixed
+    :return: data of the same type with fixed keys/column-names
+    """
+    if isinstance(data_to_update, dict):
+        return dict(
+            zip(normalize_column_names(tuple(data_to_update)), data_to_update.values())
+        )
+    if isinstance(data_to_update, list):
+        _mapping = get_column_name_mapping(data_to_update)
+        return [
+            {_mapping[_key]: _val for _key, _val in _record.items()}
+            for _record in data_to_update
+        ]
+    if isinstance(data_to_update, pd.DataFrame):
+        _df = data_to_update.copy(deep=False)
+        _df.columns = normalize_column_names(tuple(map(str, data_to_update.columns)))
+        return _df
+    if isinstance(data_to_update, pa.Table):
+        return data_to_update.rename_columns(
+            list(normalize_column_names(tuple(data_to_update.column_names)))
+        )
+    return data_to_update
 
 
 def replace_special_characters_in_string(str_with_char: str) -> str:
-    return (
-        str_with_char.replace("ü", "ue")
-        .replace("ö", "oe")
-        .replace("ä", "ae")
-        .replace("Ü", "Ue")
-        .replace("Ö", "Oe")
-        .replace("Ä", "Ae")
-        .replace("ß", "ss")
-        .replace(" ", "_")
-        .replace(",", "_")
-        .replace(".", "_")
-    )
+    """
+    replace special characters not accepted in GBQ table col names, see gbq_utils.normalize_column_name
+    :param str_with_char: str | string with unaccepted characters
+    :return: str
+    """
+    return normalize_column_name(str_with_char)
 
 
 def string_to_list_of_strings(string: str) -> list:
@@ -5,12 +5,18 @@ import configparser
 import csv
 import io
 import json
+import math
 from pathlib import Path
 import os
 from datetime import datetime
 import pandas as pd
 
-from typing import Union
+from typing import Union, Iterable, IO
+
+try:  # optional, faster json encoder
+    import orjson
+except ImportError:
+    orjson = None
 
 
 def import_file(full_path_to_module: str) -> object:
@@ -136,6 +142,39 @@ def string_to_json_content(content: str, key: str = "data") -> str:
     )
 
 
+def write_ndjson(records: Iterable[dict], fp: IO[bytes]) -> int:
+    """
+    write records as newline-delimited json to a binary file-object, one record at a time
+    uses orjson if it's installed; NaN/infinite values are written as null, other non-json values as strings
+    :param records: Iterable[dict] | records to write
+    :param fp: IO[bytes] | binary file-object, e.g. a (temp) file or io.BytesIO
+    :return: int | number of records written
+    """
+    num_records = 0
+    for record in records:
+        fp.write(_encode_json_line(record))
+        num_records += 1
+    return num_records
+
+
+def _encode_json_line(record: dict) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(
+            record, default=str, option=orjson.OPT_APPEND_NEWLINE | orjson.OPT_NON_STR_KEYS
+        )
+    try:
+        _line = json.dumps(record, default=str, allow_nan=False)
+    except ValueError:  # NaN/inf are not valid json, orjson writes them as null
+        _line = json.dumps(
+            {
+                _key: None if isinstance(_val, float) and not math.isfinite(_val) else _val
+                for _key, _val in record.items()
+            },
+            default=str,
+        )
+    return f"{_line}\n".encode()
+
+
 def get_raw_data_json_file_paths(raw_data_file_paths: list[str]) -> list:
     """
     return list of file-paths of json files from given list
@@ -204,6 +243,7 @@ def get_config_filename(file_id: str) -> str:
     """
     get the name of a config file for given file-id:
     * "MAPPING_CONFIG_FILE": json_key_mapping.json
+    * "REPLICA_CONFIG_FILE": replica_tables.json
     * "COUNTRY_CURRENCY_CODES": country_currency_codes.json
     :param file_id:  str | identifier for config-file, options listed above
     :return: str
@@ -214,12 +254,15 @@ def get_config_filename(file_id: str) -> str:
             return "country_currency_codes.json"
         elif file_id == "MAPPING_CONFIG_FILE":
             return "json_key_mapping.json"
+        elif file_id == "REPLICA_CONFIG_FILE":
+            return "replica_tables.json"
 
 
 def get_config_filepath(file_id: str) -> str:
     """
     get the path of a config file for given file-id:
     * "MAPPING_CONFIG_FILE": json_key_mapping.json
+    * "REPLICA_CONFIG_FILE": replica_tables.json
     * "COUNTRY_CURRENCY_CODES": country_currency_codes.json
     :param file_id:  str | identifier for config-file, options listed above
     :return: str
@@ -234,6 +277,7 @@ def get_data_from_config_file(file_id: str) -> dict:
     """
     get the data from a config file for given file-id:
     * "MAPPING_CONFIG_FILE": json_key_mapping.json
+    * "REPLICA_CONFIG_FILE": replica_tables.json
     * "COUNTRY_CURRENCY_CODES": country_currency_codes.json
     :param file_id:  str | identifier for config-file, options listed above
     :return: str
@@ -1,8 +1,11 @@
 """
 utils for GBQQ-usage
 """
+import os
 import re
 import json
+import threading
+from functools import lru_cache
 from google.cloud import bigquery
 
 
@@ -42,27 +45,94 @@ def get_mapping_json_string_from_mssql_string(
     return json.dumps(_mapping, ensure_ascii=False, indent=4)
 
 
+# characters not accepted in GBQ table col names and their replacements, applied in a single translate pass
+_COLUMN_NAME_TRANSLATION = str.maketrans(
+    {
+        "ü": "ue",
+        "ö": "oe",
+        "ä": "ae",
+        "Ü": "Ue",
+        "Ö": "Oe",
+        "Ä": "Ae",
+        "ß": "ss",
+        " ": "_",
+        ",": "_",
+        ".": "_",
+        "/": "or",
+    }
+)
+_INVALID_COLUMN_NAME_CHARACTERS = re.compile(r"[^A-Za-z0-9_]")
+_RESERVED_COLUMN_NAME_PREFIXES = (
+    "_TABLE_",
+    "_FILE_",
+    "_PARTITION",
+    "_ROW_TIMESTAMP",
+    "__ROOT__",
+    "_COLIDENTIFIER",
+)
+GBQ_MAX_COLUMN_NAME_LENGTH = 300
+
+
+@lru_cache(maxsize=16384)
+def normalize_column_name(column_name: str) -> str:
+    """
+    normalize a column name to a valid GBQ column name:
+    umlauts etc. are transliterated, separators replaced by "_", any other invalid character is replaced
+    by "_", names starting with a digit or a reserved prefix are prefixed by "_", and it's truncated to
+    the max length; results are cached per distinct name
+    :param column_name: str | column name with unaccepted characters
+    :return: str
+    """
+    _name = column_name.translate(_COLUMN_NAME_TRANSLATION)
+    if not (_name.isascii() and _name.replace("_", "").isalnum()):
+        _name = _INVALID_COLUMN_NAME_CHARACTERS.sub("_", _name)
+    if not _name or _name[0].isdigit() or _name.upper().startswith(_RESERVED_COLUMN_NAME_PREFIXES):
+        _name = f"_{_name}"
+    return _name[:GBQ_MAX_COLUMN_NAME_LENGTH]
+
+
+@lru_cache(maxsize=1024)
+def normalize_column_names(column_names: tuple) -> tuple:
+    """
+    normalize a set of column names, see normalize_column_name; names colliding after normalization
+    (GBQ column names are case-insensitive) get a numeric suffix, e.g. "a b", "a_b" -> "a_b", "a_b_2"
+    :param column_names: tuple | column names, e.g. the keys of a record or columns of a dataframe
+    :return: tuple | normalized column names, in the same order
+    """
+    normalized_names, seen = [], set()
+    for _column_name in column_names:
+        _name = _base_name = normalize_column_name(_column_name)
+        _suffix = 2
+        while _name.upper() in seen:
+            _name = f"{_base_name[:GBQ_MAX_COLUMN_NAME_LENGTH - len(str(_suffix)) - 1]}_{_suffix}"
+            _suffix += 1
+        seen.add(_name.upper())
+        normalized_names.append(_name)
+    return tuple(normalized_names)
+
+
+def get_column_name_mapping(records: list) -> dict:
+    """
+    map all keys of a list of records to normalized column names, see normalize_column_names;
+    names are deduped once over the union of keys (in order of appearance), so a key gets the same name
+    in every record, even if records have different keys
+    :param records: list | list of dicts
+    :return: dict | {key: normalized column name}
+    """
+    _keys = tuple({_key: None for _record in records for _key in _record})
+    return dict(zip(_keys, normalize_column_names(_keys)))
+
+
 def replace_special_characters_in_string(str_with_char: str) -> str:
     """
     replace special characters not accepted in GBQ table col names
     :param str_with_char: str | string with unaccepted characters
     :return: str
     """
-    return (
-        str_with_char.replace("ü", "ue")
-        .replace("ö", "oe")
-        .replace("ä", "ae")
-        .replace("Ü", "Ue")
-        .replace("Ö", "Oe")
-        .replace("Ä", "Ae")
-        .replace("ß", "ss")
-        .replace(" ", "_")
-        .replace(",", "_")
-        .replace(".", "_")
-        .replace("/", "or")
-    )
+    return normalize_column_name(str_with_char)
 
 
+@lru_cache(maxsize=16384)
 def camel_case(string: str) -> str:
     """
     convert given string to camel case
@@ -96,6 +166,94 @@ def convert_to_gbq_data_type(data_type: str) -> str:
     }.get(data_type, data_type)
 
 
+class GbqSchemaRegistry:
+    """
+    registry of GBQ schemas for all table/schema keys of the mapping config file
+    the file is parsed and compiled to lists of SchemaFields once, and only reloaded if its mtime changes
+    """
+
+    def __init__(self, file_path: str = None):
+        self.file_path = file_path
+        self._mtime = None
+        self._compiled = ({}, {})  # (schemas, table-configs)
+        self._lock = threading.Lock()
+
+    def get_schema(
+        self, table_name_key: str = None, schema_name_key: str = None
+    ) -> list:
+        """
+        get schema for GBQ table based on table-name or schema-name as key
+        :param table_name_key: str | table-name to be used as key
+        :param schema_name_key: str | schema-name to be used as key
+        :return: list | GBQ table schema as list of Schema-fields
+        """
+        _schema = self._lookup(
+            self._get_compiled()[0], table_name_key=table_name_key, schema_name_key=schema_name_key
+        )
+        return list(_schema or [])
+
+    def get_table_config(
+        self, table_name_key: str = None, schema_name_key: str = None
+    ) -> dict:
+        """
+        get the raw mapping-config entry for a GBQ table based on table-name or schema-name as key,
+        e.g. to read per-table options like "load_format"
+        :param table_name_key: str | table-name to be used as key
+        :param schema_name_key: str | schema-name to be used as key
+        :return: dict | config entry, empty if not found
+        """
+        return dict(
+            self._lookup(
+                self._get_compiled()[1], table_name_key=table_name_key, schema_name_key=schema_name_key
+            )
+            or {}
+        )
+
+    @staticmethod
+    def _lookup(mapping: dict, table_name_key: str = None, schema_name_key: str = None):
+        try:
+            return mapping.get(table_name_key.upper()) or (
+                mapping.get(schema_name_key.upper()) if schema_name_key else None
+            )
+        except AttributeError as e:
+            print(f"{e}, returning empty schema")
+            return None
+
+    def _get_compiled(self) -> tuple:
+        if self.file_path is None:
+            from app.utils.file_utils import get_config_filepath
+
+            self.file_path = get_config_filepath("MAPPING_CONFIG_FILE")
+        _mtime = os.stat(self.file_path).st_mtime_ns
+        if _mtime != self._mtime:
+            with self._lock:
+                if _mtime != self._mtime:
+                    self._compiled = self._compile()
+                    self._mtime = _mtime
+        return self._compiled
+
+    def _compile(self) -> tuple:
+        from app.utils.file_utils import get_data_from_json_file
+
+        if not (json_data := get_data_from_json_file(file_path=self.file_path)):
+            raise ValueError("mapping config file is empty!")
+        table_configs = {
+            _key: _key_map for _key, _key_map in json_data.items() if isinstance(_key_map, dict)
+        }
+        schemas = {
+            _key: [
+                bigquery.SchemaField(_col, _val.split(":")[-1])
+                for _col, _val in _key_map["db_col_to_json_mapping"].items()
+            ]
+            for _key, _key_map in table_configs.items()
+            if _key_map.get("db_col_to_json_mapping")
+        }
+        return schemas, table_configs
+
+
+gbq_schema_registry = GbqSchemaRegistry()
+
+
 def get_gbq_schema_from_json(
     table_name_key: str = None, schema_name_key: str = None
 ) -> list:
@@ -105,36 +263,10 @@ def get_gbq_schema_from_json(
     :param schema_name_key: str | schema-name to be used as key
     :return: list | GBQ table schema as list of Schema-fields
     """
-    bigquery_schema_list = []
-    from app.utils.file_utils import (
-        get_data_from_json_file,
-        get_config_filepath,
+    return gbq_schema_registry.get_schema(
+        table_name_key=table_name_key, schema_name_key=schema_name_key
     )
 
-    _mapping_config_file = get_config_filepath("MAPPING_CONFIG_FILE")
-
-    if not (
-        json_data := get_data_from_json_file(
-            file_path=get_config_filepath("MAPPING_CONFIG_FILE")
-        )
-    ):
-        raise "mapping config file not found!"
-    try:
-        _key_map = (
-            json_data.get(table_name_key.upper())
-            or (json_data.get(schema_name_key.upper()) if schema_name_key else None)
-        )
-
-        if _key_map:
-            if _db_col_mapping := _key_map.get("db_col_to_json_mapping"):
-                bigquery_schema_list.extend(
-                    bigquery.SchemaField(_key, _val.split(":")[-1])
-                    for _key, _val in _db_col_mapping.items()
-                )
-    except AttributeError as e:
-        print(f"{e}, returning empty schema")
-    return bigquery_schema_list
-
 
 def update_write_disposition(
     job_config: bigquery.LoadJobConfig, write_disposition: str = None
@@ -0,0 +1,126 @@
+"""
+shared fixtures: tests run on the in-process DuckDB backend (BIGQUERY_BACKEND=local), without GCP access
+"""
+import json
+import os
+
+import pandas as pd
+import pytest
+
+# set before the app is imported, clients and project-id are resolved from these
+os.environ["BIGQUERY_BACKEND"] = "local"
+os.environ["GCP_PROJECT_NAME"] = "local"
+os.environ["PAGE_TOKEN_SECRET"] = "test-secret"
+
+from app.gcp.base_client import close_shared_clients  # noqa: E402
+from app.gcp.big_query.big_query_client import BigQueryClient  # noqa: E402
+from app.gcp.big_query.query_budget import query_estimate_cache  # noqa: E402
+from app.gcp.big_query.query_cache import query_result_cache, table_modified_cache  # noqa: E402
+from app.gcp.big_query.watermark_store import watermark_store  # noqa: E402
+from app.utils.gbq_utils import gbq_schema_registry  # noqa: E402
+
+PROJECT_ID = "local"
+DATASET_NAME = "test_data"
+# schemas of the test tables, as in json_key_mapping.json: {table: {column: "json_key:GBQ_TYPE"}}
+TABLE_SCHEMAS = {
+    "USER_PROFILES": {
+        "id": "id:INT64",
+        "name": "name:STRING",
+        "country": "country:STRING",
+        "score": "score:FLOAT",
+    },
+}
+
+
+@pytest.fixture(autouse=True)
+def local_backend(tmp_path, monkeypatch):
+    """
+    fresh local backend, caches and stores for every test
+    """
+    close_shared_clients()
+    query_result_cache.clear()
+    for _counter in ("hits", "misses", "evictions"):
+        monkeypatch.setattr(query_result_cache, _counter, 0)
+    query_estimate_cache.clear()
+    table_modified_cache.clear()
+    monkeypatch.setattr(watermark_store, "file_path", str(tmp_path / "watermarks.json"))
+    monkeypatch.setattr(watermark_store, "_watermarks", None)
+    monkeypatch.setattr(gbq_schema_registry, "file_path", str(tmp_path / "json_key_mapping.json"))
+    set_table_schemas(TABLE_SCHEMAS)
+    yield
+    close_shared_clients()
+
+
+def set_table_schemas(table_schemas: dict, table_options: dict = None) -> None:
+    """
+    write the schema mapping config of the test tables
+    :param table_schemas: dict | {table_name: {column: "json_key:GBQ_TYPE"}}, table-names upper-cased
+    :param table_options: dict | (optional) {table_name: {option: value}}, e.g. load_format
+    :return:
+    """
+    mapping = {
+        _table_name: {"db_col_to_json_mapping": _columns, **(table_options or {}).get(_table_name, {})}
+        for _table_name, _columns in table_schemas.items()
+    }
+    with open(gbq_schema_registry.file_path, "w") as fp:
+        json.dump(mapping, fp)
+    # mtime-resolution of the file system may hide quick rewrites from the registry
+    gbq_schema_registry._mtime = None
+
+
+@pytest.fixture
+def bq_client() -> BigQueryClient:
+    return BigQueryClient(project_id=PROJECT_ID)
+
+
+@pytest.fixture
+def user_profiles(bq_client) -> str:
+    """
+    table USER_PROFILES with 4 rows
+    :return: str | full table-id
+    """
+    table_id = f"{PROJECT_ID}.{DATASET_NAME}.user_profiles"
+    load_dataframe(
+        bq_client,
+        table_id,
+        pd.DataFrame(
+            {
+                "id": [1, 2, 3, 4],
+                "name": ["Jane", "John", "Max", "Erika"],
+                "country": ["DE", "AT", "DE", None],
+                "score": [1.5, None, 3.0, 0.5],
+            }
+        ),
+    )
+    return table_id
+
+
+def load_dataframe(bq_client: BigQueryClient, table_id: str, data_df: pd.DataFrame) -> None:
+    bq_client.bq_client.load_table_from_dataframe(data_df, table_id).result()
+
+
+def make_rows(num_rows: int, num_columns: int = 4) -> pd.DataFrame:
+    """
+    dataframe with an INT64 id column and num_columns - 1 alternating STRING/FLOAT columns
+    """
+    columns = {"id": range(num_rows)}
+    for _i in range(1, num_columns):
+        if _i % 2:
+            columns[f"col_{_i}"] = [f"value {_j % 1000}" for _j in range(num_rows)]
+        else:
+            columns[f"col_{_i}"] = [_j * 0.5 for _j in range(num_rows)]
+    return pd.DataFrame(columns)
+
+
+def get_schema_mapping(data_df: pd.DataFrame) -> dict:
+    """
+    schema mapping for the columns of a dataframe, e.g. created by make_rows
+    """
+    return {
+        _col: f"{_col}:INT64"
+        if pd.api.types.is_integer_dtype(_dtype)
+        else f"{_col}:FLOAT"
+        if pd.api.types.is_float_dtype(_dtype)
+        else f"{_col}:STRING"
+        for _col, _dtype in data_df.dtypes.items()
+    }
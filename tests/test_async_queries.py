@@ -0,0 +1,151 @@
+"""
+load test of the async query path against a fake backend whose jobs take a configurable time,
+and construction of the clients of async handlers
+"""
+import asyncio
+import threading
+import time
+
+import pytest
+from anyio import to_thread
+from fastapi.testclient import TestClient
+from google.cloud import bigquery
+
+from app.gcp.base_client import get_shared_client
+from app.gcp.big_query.big_query_client import BigQueryClient
+from app.main import app
+from conftest import PROJECT_ID
+
+THREADPOOL_SIZE = 4
+NUM_QUERIES = 40
+
+
+class FakeQueryJob:
+    def __init__(self, client: "FakeBigQueryClient", sql_query: str):
+        self._client = client
+        self._done_at = time.monotonic() + client.latency
+        self.sql_query = sql_query
+        self.error_result = None
+
+    @property
+    def state(self) -> str:
+        return "DONE" if time.monotonic() >= self._done_at else "RUNNING"
+
+    def reload(self, **kwargs) -> None:
+        self._client.request()
+
+    def result(self, page_size: int = None, **kwargs):
+        self._client.request()
+        return FakeRowIterator([bigquery.Row((self.sql_query,), {"sql_query": 0})])
+
+
+class FakeRowIterator:
+    def __init__(self, rows: list):
+        self.pages = iter([rows])
+        self.next_page_token = None
+
+
+class FakeBigQueryClient:
+    """
+    jobs finish latency seconds after they were submitted, every API request blocks its thread briefly;
+    keeps track of the peak number of running jobs and of concurrent API requests
+    """
+
+    def __init__(self, latency: float, request_seconds: float = 0.005):
+        self.latency = latency
+        self.request_seconds = request_seconds
+        self.jobs = []
+        self.max_running_jobs = 0
+        self.max_concurrent_requests = 0
+        self._concurrent_requests = 0
+        self._lock = threading.Lock()
+
+    def query(self, sql_query: str, job_config: bigquery.QueryJobConfig = None, **kwargs) -> FakeQueryJob:
+        self.request()
+        job = FakeQueryJob(self, sql_query)
+        with self._lock:
+            self.jobs.append(job)
+            self.max_running_jobs = max(
+                self.max_running_jobs, sum(_job.state == "RUNNING" for _job in self.jobs)
+            )
+        return job
+
+    def request(self) -> None:
+        with self._lock:
+            self._concurrent_requests += 1
+            self.max_concurrent_requests = max(self.max_concurrent_requests, self._concurrent_requests)
+        time.sleep(self.request_seconds)
+        with self._lock:
+            self._concurrent_requests -= 1
+
+
+async def run_concurrent_queries(num_queries: int) -> list:
+    to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    bq_client = BigQueryClient(project_id=PROJECT_ID)
+    return await asyncio.gather(
+        *(
+            bq_client.execute_query_async(
+                sql_query=f"SELECT {_i}", as_json=True, poll_interval=0.05, use_cache=False
+            )
+            for _i in range(num_queries)
+        )
+    )
+
+
+@pytest.mark.parametrize("latency", [0.2, 0.5])
+def test_concurrency_is_not_capped_by_the_threadpool(latency):
+    fake_client = FakeBigQueryClient(latency=latency)
+    get_shared_client(client_type="bigquery", project_id=PROJECT_ID, client_factory=lambda _: fake_client)
+    started_at = time.monotonic()
+    query_results = asyncio.run(run_concurrent_queries(NUM_QUERIES))
+    duration = time.monotonic() - started_at
+    assert [_results["results"] for _results in query_results] == [
+        [{"sql_query": f"SELECT {_i}"}] for _i in range(NUM_QUERIES)
+    ]
+    # all jobs ran at once, with at most THREADPOOL_SIZE threads making API requests
+    assert fake_client.max_running_jobs == NUM_QUERIES
+    assert fake_client.max_concurrent_requests <= THREADPOOL_SIZE
+    # waiting with blocked threads would take NUM_QUERIES / THREADPOOL_SIZE * latency
+    print(f"{NUM_QUERIES} queries of {latency}s with {THREADPOOL_SIZE} threads took {duration:.2f}s")
+    assert duration < NUM_QUERIES / THREADPOOL_SIZE * latency / 2
+
+
+@pytest.fixture
+def client_constructions(monkeypatch) -> list:
+    """
+    for each BigQueryClient constructed during the test, whether it was constructed on the event loop
+    """
+    constructions = []
+    _init = BigQueryClient.__init__
+
+    def _recording_init(self, *args, **kwargs):
+        try:
+            asyncio.get_running_loop()
+            constructions.append(True)
+        except RuntimeError:
+            constructions.append(False)
+        _init(self, *args, **kwargs)
+
+    monkeypatch.setattr(BigQueryClient, "__init__", _recording_init)
+    return constructions
+
+
+def post_query(test_client: TestClient, **payload):
+    return test_client.post("/bigquery_operation_results", json={"query": "SELECT 1 AS id", **payload})
+
+
+def test_requests_use_the_client_created_at_startup(client_constructions):
+    with TestClient(app) as test_client:
+        # before any request is served
+        assert len(client_constructions) == 1
+        for _payload in ({}, {"page_size": 1}, {"stream": True}):
+            assert post_query(test_client, **_payload).status_code == 200
+    assert len(client_constructions) == 1
+
+
+def test_clients_are_not_constructed_on_the_event_loop(client_constructions, monkeypatch):
+    # e.g. without startup hooks
+    monkeypatch.delattr(app.state, "bq_client", raising=False)
+    for _payload in ({}, {"page_size": 1}, {"stream": True}):
+        assert post_query(TestClient(app), **_payload).status_code == 200
+    assert client_constructions and not any(client_constructions)
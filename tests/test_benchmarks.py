@@ -0,0 +1,60 @@
+"""
+latency and throughput of the query, preview and upload paths on the local backend, see pytest-benchmark
+"""
+import pytest
+
+from app.gcp.big_query.big_query_table import BigQueryTable
+from conftest import DATASET_NAME, PROJECT_ID, get_schema_mapping, load_dataframe, make_rows, set_table_schemas
+
+NUM_ROWS = 100_000
+
+
+@pytest.fixture
+def benchmark_table(bq_client) -> BigQueryTable:
+    data_df = make_rows(NUM_ROWS, num_columns=8)
+    set_table_schemas({"BENCHMARK_ROWS": get_schema_mapping(data_df)})
+    table = BigQueryTable(project_id=PROJECT_ID, dataset_name=DATASET_NAME, table_name="benchmark_rows")
+    load_dataframe(bq_client, table.table_id, data_df)
+    return table
+
+
+@pytest.mark.benchmark(group="query")
+def test_query_latency(benchmark, bq_client, benchmark_table):
+    sql_query = f"SELECT col_1, COUNT(*) AS n FROM `{benchmark_table.table_id}` GROUP BY col_1"
+    query_results = benchmark(bq_client.execute_query, sql_query=sql_query, as_json=True, use_cache=False)
+    assert len(query_results["results"]) == 1000
+
+
+@pytest.mark.benchmark(group="query")
+def test_query_throughput(benchmark, bq_client, benchmark_table):
+    sql_query = f"SELECT * FROM `{benchmark_table.table_id}`"
+    query_results = benchmark(bq_client.execute_query, sql_query=sql_query, as_json=True, use_cache=False)
+    assert len(query_results["results"]) == NUM_ROWS
+    if benchmark.stats:  # None if run with --benchmark-disable
+        benchmark.extra_info["rows_per_second"] = NUM_ROWS / benchmark.stats.stats.mean
+
+
+@pytest.mark.benchmark(group="preview")
+def test_preview_latency(benchmark, benchmark_table):
+    records = benchmark(benchmark_table.get_records_in_table, limit=10)
+    assert len(records) == 10
+
+
+@pytest.mark.benchmark(group="preview")
+def test_select_columns_latency(benchmark, bq_client, benchmark_table):
+    records = benchmark(
+        bq_client.get_select_query_results,
+        table_id=benchmark_table.table_id,
+        columns=["id", "col_1"],
+        limit=100,
+    )
+    assert len(records) == 100
+
+
+@pytest.mark.benchmark(group="upload")
+def test_upload_throughput(benchmark, benchmark_table):
+    data_df = make_rows(NUM_ROWS, num_columns=8)
+    upload_results = benchmark(benchmark_table.update_from_dataframe, data_df=data_df)
+    assert upload_results.num_rows == NUM_ROWS
+    if benchmark.stats:  # None if run with --benchmark-disable
+        benchmark.extra_info["rows_per_second"] = NUM_ROWS / benchmark.stats.stats.mean
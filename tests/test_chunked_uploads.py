@@ -0,0 +1,158 @@
+"""
+chunked uploads on the local backend, and a benchmark of their throughput, see pytest-benchmark
+"""
+import time
+
+import pytest
+
+from app.gcp.big_query.big_query_uploader import BigQueryUploader
+from conftest import DATASET_NAME, PROJECT_ID, get_schema_mapping, make_rows, set_table_schemas
+
+NUM_ROWS = 100_000
+CHUNK_ROWS = 10_000
+LOAD_JOB_SECONDS = 0.05
+LOAD_ROW_SECONDS = 5e-6
+
+
+@pytest.fixture
+def data_df():
+    data_df = make_rows(NUM_ROWS, num_columns=8)
+    set_table_schemas({"CHUNKED_UPLOADS": get_schema_mapping(data_df)})
+    return data_df
+
+
+def get_uploader(data_df, p_key: str = None) -> BigQueryUploader:
+    return BigQueryUploader(
+        project_id=PROJECT_ID, dataset_name=DATASET_NAME, table_name="chunked_uploads", data_to_upload=data_df,
+        p_key=p_key,
+    )
+
+
+def get_num_rows(bq_client, uploader: BigQueryUploader) -> int:
+    return bq_client.execute_query(
+        sql_query=f"SELECT COUNT(*) AS n FROM `{uploader.table_id}`", as_json=True, use_cache=False
+    )["results"][0]["n"]
+
+
+def test_only_failed_chunks_are_retried(bq_client, data_df, monkeypatch):
+    uploader = get_uploader(data_df)
+    load_dataframe, failed_chunks = uploader.load_dataframe, []
+
+    def _fail_first_attempt_of_second_chunk(data_df, **kwargs):
+        if data_df.index[0] == CHUNK_ROWS and not failed_chunks:
+            failed_chunks.append(data_df.index[0])
+            raise Exception("Load job failed")
+        return load_dataframe(data_df, **kwargs)
+
+    monkeypatch.setattr(uploader, "load_dataframe", _fail_first_attempt_of_second_chunk)
+    upload_results = uploader.do_upload(chunk_rows=CHUNK_ROWS)
+    assert upload_results["errors"] is None
+    assert failed_chunks == [CHUNK_ROWS]
+    assert sum(_job["num_rows"] for _job in upload_results["jobs"]) == NUM_ROWS
+    assert get_num_rows(bq_client, uploader) == NUM_ROWS
+
+
+def test_chunks_failing_after_retries_are_reported(data_df, monkeypatch):
+    uploader = get_uploader(data_df.head(2 * CHUNK_ROWS))
+    load_dataframe = uploader.load_dataframe
+
+    def _fail_second_chunk(data_df, **kwargs):
+        if data_df.index[0] == CHUNK_ROWS:
+            raise Exception("Load job failed")
+        return load_dataframe(data_df, **kwargs)
+
+    monkeypatch.setattr(uploader, "load_dataframe", _fail_second_chunk)
+    upload_results = uploader.do_upload(chunk_rows=CHUNK_ROWS, max_retries=1)
+    assert len(upload_results["jobs"]) == 1
+    assert upload_results["errors"] == [{"rows": [CHUNK_ROWS, 2 * CHUNK_ROWS], "error": "Load job failed"}]
+
+
+def test_succeeded_loads_are_not_retried(bq_client, data_df, monkeypatch):
+    uploader = get_uploader(data_df)
+    load_dataframe, failed_results = uploader.load_dataframe, []
+
+    def _fail_result(**kwargs):
+        raise Exception("Timeout")
+
+    def _fail_waiting_for_second_chunk(data_df, **kwargs):
+        job = load_dataframe(data_df, **kwargs)
+        if data_df.index[0] == CHUNK_ROWS and not failed_results:
+            failed_results.append(job.job_id)
+            # the load is committed, but waiting for its result fails, e.g. on a dropped connection
+            monkeypatch.setattr(job, "result", _fail_result)
+        return job
+
+    monkeypatch.setattr(uploader, "load_dataframe", _fail_waiting_for_second_chunk)
+    upload_results = uploader.do_upload(chunk_rows=CHUNK_ROWS)
+    assert upload_results["errors"] is None
+    assert len(failed_results) == 1
+    assert failed_results[0] in {_job["job_id"] for _job in upload_results["jobs"]}
+    assert get_num_rows(bq_client, uploader) == NUM_ROWS
+
+
+def test_failing_follow_ups_dont_reload_chunks(bq_client, data_df, monkeypatch):
+    uploader = get_uploader(data_df, p_key="id")
+
+    def _fail_advancing_watermark(data_df):
+        raise Exception("Watermark store unavailable")
+
+    monkeypatch.setattr(uploader, "advance_highest_pkey_value", _fail_advancing_watermark)
+    upload_results = uploader.do_upload(chunk_rows=CHUNK_ROWS)
+    assert sum(_job["num_rows"] for _job in upload_results["jobs"]) == NUM_ROWS
+    assert upload_results["errors"] == [
+        {"rows": None, "error": "Advancing the watermark failed: Watermark store unavailable"}
+    ]
+    assert get_num_rows(bq_client, uploader) == NUM_ROWS
+
+
+def test_watermark_is_advanced_once_after_all_chunks(bq_client, data_df, monkeypatch):
+    uploader = get_uploader(data_df, p_key="id")
+    advance_highest_pkey_value, advanced_rows = uploader.advance_highest_pkey_value, []
+
+    def _counting_advance_highest_pkey_value(data_df):
+        advanced_rows.append(data_df.shape[0])
+        return advance_highest_pkey_value(data_df)
+
+    monkeypatch.setattr(uploader, "advance_highest_pkey_value", _counting_advance_highest_pkey_value)
+    assert uploader.do_upload(chunk_rows=CHUNK_ROWS)["errors"] is None
+    assert advanced_rows == [NUM_ROWS]
+    assert uploader.highest_pkey_value == NUM_ROWS - 1
+
+
+@pytest.fixture(params=[False, True], ids=["local", "load_job_latency"])
+def load_latency(request, bq_client, data_df, monkeypatch) -> bool:
+    """
+    optionally let load-jobs take LOAD_JOB_SECONDS plus LOAD_ROW_SECONDS per row on top of the local load,
+    like load-jobs on BigQuery; chunks are sized for TARGET_CHUNK_SECONDS scaled down to the benchmark's data
+    """
+    monkeypatch.setattr(BigQueryUploader, "TARGET_CHUNK_SECONDS", 0.1)
+    set_table_schemas({"CHUNKED_UPLOADS": get_schema_mapping(data_df)}, {"CHUNKED_UPLOADS": {"load_format": "parquet"}})
+    if request.param:
+        load_table_from_dataframe = bq_client.bq_client.load_table_from_dataframe
+
+        def _load_table_from_dataframe(dataframe, *args, **kwargs):
+            time.sleep(LOAD_JOB_SECONDS + LOAD_ROW_SECONDS * dataframe.shape[0])
+            return load_table_from_dataframe(dataframe, *args, **kwargs)
+
+        monkeypatch.setattr(bq_client.bq_client, "load_table_from_dataframe", _load_table_from_dataframe)
+    return request.param
+
+
+@pytest.mark.benchmark(group="chunked_upload")
+@pytest.mark.parametrize("max_concurrent_jobs", [1, 4])
+def test_chunked_upload_throughput(benchmark, data_df, load_latency, max_concurrent_jobs):
+    upload_results = benchmark(
+        get_uploader(data_df).do_upload, chunk_rows=CHUNK_ROWS, max_concurrent_jobs=max_concurrent_jobs
+    )
+    assert upload_results["errors"] is None
+    assert sum(_job["num_rows"] for _job in upload_results["jobs"]) == NUM_ROWS
+    if benchmark.stats:  # None if run with --benchmark-disable
+        benchmark.extra_info["rows_per_second"] = NUM_ROWS / benchmark.stats.stats.mean
+
+
+@pytest.mark.benchmark(group="chunked_upload")
+def test_single_job_upload_throughput(benchmark, data_df, load_latency):
+    upload_results = benchmark(get_uploader(data_df).do_upload)
+    assert upload_results["jobs"]["num_rows"] == NUM_ROWS
+    if benchmark.stats:  # None if run with --benchmark-disable
+        benchmark.extra_info["rows_per_second"] = NUM_ROWS / benchmark.stats.stats.mean
@@ -0,0 +1,49 @@
+"""
+shared clients, and a benchmark of the per-request client overhead with and without them, see pytest-benchmark
+"""
+import google.auth
+import pytest
+from google.auth.credentials import AnonymousCredentials
+
+from app.gcp.base_client import close_shared_clients, get_http_pool_size
+from app.gcp.big_query.big_query_client import BigQueryClient
+from conftest import PROJECT_ID
+
+
+@pytest.fixture
+def google_backend(monkeypatch):
+    """
+    build real bigquery.Clients with pooled transports, but with anonymous credentials and no API requests
+    """
+    monkeypatch.setenv("BIGQUERY_BACKEND", "bigquery")
+    monkeypatch.setattr(google.auth, "default", lambda *args, **kwargs: (AnonymousCredentials(), PROJECT_ID))
+    close_shared_clients()
+
+
+def get_client_for_request() -> BigQueryClient:
+    return BigQueryClient(project_id=PROJECT_ID)
+
+
+def get_new_client_for_request() -> BigQueryClient:
+    # as before the registry: every request built its own client and HTTP session
+    close_shared_clients()
+    return BigQueryClient(project_id=PROJECT_ID)
+
+
+def test_clients_are_shared_per_project(google_backend):
+    assert get_client_for_request().bq_client is get_client_for_request().bq_client
+    assert BigQueryClient(project_id="other").bq_client is not get_client_for_request().bq_client
+    assert get_client_for_request().bq_client._http.adapters["https://"]._pool_maxsize == get_http_pool_size()
+
+
+@pytest.mark.benchmark(group="client_per_request")
+def test_shared_client_overhead(benchmark, google_backend):
+    get_client_for_request()
+    bq_client = benchmark(get_client_for_request)
+    assert bq_client.bq_client.project == PROJECT_ID
+
+
+@pytest.mark.benchmark(group="client_per_request")
+def test_new_client_overhead(benchmark, google_backend):
+    bq_client = benchmark(get_new_client_for_request)
+    assert bq_client.bq_client.project == PROJECT_ID
@@ -0,0 +1,49 @@
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from app.utils.data_type_utils import fix_special_characters_in_json_keys, replace_special_characters_in_string
+from app.utils.gbq_utils import GBQ_MAX_COLUMN_NAME_LENGTH, normalize_column_names
+
+
+@pytest.mark.parametrize(
+    "column_name, normalized_name",
+    [
+        ("Größe", "Groesse"),
+        ("Karton Typ", "Karton_Typ"),
+        ("a,b.c", "a_b_c"),
+        ("in/out", "inorout"),
+        ("price (€)", "price____"),
+        ("e-mail", "e_mail"),
+        ("1st_name", "_1st_name"),
+        ("", "_"),
+        ("_TABLE_name", "__TABLE_name"),
+        ("_partitiontime", "__partitiontime"),
+        ("x" * 400, "x" * GBQ_MAX_COLUMN_NAME_LENGTH),
+    ],
+)
+def test_column_names_are_normalized(column_name, normalized_name):
+    assert replace_special_characters_in_string(column_name) == normalized_name
+
+
+def test_colliding_column_names_are_deduped():
+    assert normalize_column_names(("a b", "a_b", "A.B", "a_b_2")) == ("a_b", "a_b_2", "A_B_3", "a_b_2_2")
+    # suffixes are added within the max length
+    assert normalize_column_names(("x" * 400, "x" * 300)) == (
+        "x" * GBQ_MAX_COLUMN_NAME_LENGTH, f"{'x' * (GBQ_MAX_COLUMN_NAME_LENGTH - 2)}_2"
+    )
+
+
+def test_colliding_keys_are_named_alike_in_all_records():
+    records = fix_special_characters_in_json_keys(
+        [{"a_b": 1}, {"a b": 2, "a_b": 3}, {"a b": 4}, {"id": 5, "a b": 6}]
+    )
+    assert records == [{"a_b": 1}, {"a_b_2": 2, "a_b": 3}, {"a_b_2": 4}, {"id": 5, "a_b_2": 6}]
+
+
+def test_colliding_columns_are_deduped():
+    data_df = pd.DataFrame([[1, 2]], columns=["a b", "a_b"])
+    assert list(fix_special_characters_in_json_keys(data_df).columns) == ["a_b", "a_b_2"]
+    assert list(data_df.columns) == ["a b", "a_b"]
+    assert fix_special_characters_in_json_keys(pa.Table.from_pandas(data_df)).column_names == ["a_b", "a_b_2"]
+    assert fix_special_characters_in_json_keys({"a b": 1, "a_b": 2}) == {"a_b": 1, "a_b_2": 2}
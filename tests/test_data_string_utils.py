@@ -0,0 +1,69 @@
+"""
+text cleaning of record batches, and a benchmark of the batch cleaners on 1M records, see pytest-benchmark
+"""
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from app.utils.data_string_utils import clean_dict_text, clean_text_batch
+
+NUM_RECORDS = 1_000_000
+
+
+def make_records(num_records: int) -> list:
+    """
+    records with a text column needing replacements in every row, a clean text column and a number column
+    """
+    return [
+        {"name": f"M\\xfcller\\ {_i} GB_VOEC", "city": f"city {_i % 100}", "amount": _i * 0.5}
+        for _i in range(num_records)
+    ]
+
+
+@pytest.fixture(scope="module")
+def records() -> list:
+    return make_records(NUM_RECORDS)
+
+
+def test_clean_dict_text():
+    assert clean_dict_text(
+        {"na\\xefve": "caf\\xe9 \\– GB_VOEC", "nested": [{"city": "K\\xf6ln"}], "amount": 1}
+    ) == {"na\\xefve": "café – ", "nested": [{"city": "Köln"}], "amount": 1}
+
+
+@pytest.mark.parametrize("to_batch", [list, pd.DataFrame, pa.Table.from_pylist], ids=["records", "pandas", "arrow"])
+def test_batch_cleaners_clean_like_clean_dict_text(to_batch):
+    records = [
+        {**_record, "caf\\xe9 GB_VOEC": _record["city"]}
+        for _record in make_records(10) + [{"name": None, "city": "", "amount": None}]
+    ]
+    cleaned_batch = clean_text_batch(to_batch(records))
+    if isinstance(cleaned_batch, pd.DataFrame):
+        cleaned_batch = cleaned_batch.to_dict(orient="records")
+    elif isinstance(cleaned_batch, pa.Table):
+        cleaned_batch = cleaned_batch.to_pylist()
+    assert [_record["name"] for _record in cleaned_batch][:2] == ["Müller 0 ", "Müller 1 "]
+    assert [_record["name"] for _record in cleaned_batch] == [
+        clean_dict_text(_record)["name"] for _record in records
+    ]
+    # column names are cleaned like keys
+    assert list(cleaned_batch[0]) == list(clean_dict_text(records[0])) == ["name", "city", "amount", "café "]
+
+
+def test_clean_dataframe_text_keeps_missing_values():
+    data_df = pd.DataFrame({"name": ["K\\xf6ln", None, float("nan")], "city": ["a", "b", None]})
+    cleaned_df = clean_text_batch(data_df)
+    assert cleaned_df["name"].iloc[0] == "Köln"
+    assert cleaned_df["name"].iloc[1] is None and pd.isna(cleaned_df["name"].iloc[2])
+    assert cleaned_df["city"].equals(data_df["city"])
+
+
+@pytest.mark.slow
+@pytest.mark.benchmark(group="clean_text_batch")
+@pytest.mark.parametrize("to_batch", [list, pd.DataFrame, pa.Table.from_pylist], ids=["records", "pandas", "arrow"])
+def test_clean_text_batch_throughput(benchmark, records, to_batch):
+    batch = to_batch(records)
+    cleaned_batch = benchmark.pedantic(clean_text_batch, args=(batch,), rounds=3, iterations=1)
+    assert len(cleaned_batch) == NUM_RECORDS
+    if benchmark.stats:  # None if run with --benchmark-disable
+        benchmark.extra_info["records_per_second"] = NUM_RECORDS / benchmark.stats.stats.mean
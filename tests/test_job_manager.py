@@ -0,0 +1,216 @@
+"""
+job manager against a fake client whose jobs run until they're finished by the test or a deadline passed
+"""
+import threading
+import time
+
+import pytest
+from google.api_core import exceptions as api_exceptions
+from google.cloud import bigquery
+
+from app.gcp.base_client import get_shared_client
+from app.gcp.big_query.big_query_job_manager import BigQueryJobManager, ProjectJobLimiter
+from app.gcp.big_query.big_query_uploader import BigQueryUploader, upload_tables
+from conftest import DATASET_NAME, PROJECT_ID, get_schema_mapping, make_rows, set_table_schemas
+
+POLL_INTERVAL = 0.01
+TIMEOUT = 10
+
+
+class FakeJob:
+    def __init__(self, client: "FakeBigQueryClient", sql_query: str, error_result: dict = None):
+        self._client = client
+        self.job_id = f"job_{sql_query}"
+        self.sql_query = sql_query
+        self.state = "RUNNING"
+        self.error_result = None
+        self._final_error_result = error_result
+        self._done_at = time.monotonic() + client.latency if client.latency is not None else None
+
+    def reload(self, **kwargs) -> None:
+        self._client.reload_job(self)
+
+    def finish(self) -> None:
+        self.state = "DONE"
+        self.error_result = self._final_error_result
+
+
+class FakeBigQueryClient:
+    """
+    jobs finish latency seconds after they were started, or when finished by the test if latency is None;
+    start_errors are raised by the next query calls, job_errors become error_results of the next jobs
+    """
+
+    def __init__(self, latency: float = None, start_errors: list = None, job_errors: list = None):
+        self.latency = latency
+        self.start_errors = list(start_errors or [])
+        self.job_errors = list(job_errors or [])
+        self.reload_errors = []
+        self.started_queries = []
+        self.jobs = []
+        self.max_running_jobs = 0
+        self._lock = threading.Lock()
+
+    def query(self, sql_query: str, job_config: bigquery.QueryJobConfig = None, **kwargs) -> FakeJob:
+        with self._lock:
+            if self.start_errors:
+                raise self.start_errors.pop(0)
+            job = FakeJob(self, sql_query, error_result=self.job_errors.pop(0) if self.job_errors else None)
+            self.started_queries.append(sql_query)
+            self.jobs.append(job)
+            self.max_running_jobs = max(self.max_running_jobs, self.get_num_running_jobs())
+        return job
+
+    def reload_job(self, job: FakeJob) -> None:
+        with self._lock:
+            if self.reload_errors:
+                raise self.reload_errors.pop(0)
+        if job._done_at is not None and time.monotonic() >= job._done_at:
+            job.finish()
+
+    def get_num_running_jobs(self) -> int:
+        return sum(_job.state == "RUNNING" for _job in self.jobs)
+
+    def wait_for_jobs(self, num_jobs: int) -> None:
+        _deadline = time.monotonic() + TIMEOUT
+        while len(self.jobs) < num_jobs:
+            assert time.monotonic() < _deadline, f"{len(self.jobs)} of {num_jobs} jobs were started"
+            time.sleep(POLL_INTERVAL)
+
+
+@pytest.fixture
+def limiter() -> ProjectJobLimiter:
+    return get_shared_client(
+        client_type="bigquery_job_limiter",
+        project_id=PROJECT_ID,
+        client_factory=lambda _: ProjectJobLimiter(max_concurrent_jobs=4, min_backoff_seconds=0.05),
+    )
+
+
+def get_job_manager(fake_client: FakeBigQueryClient, project_id: str = PROJECT_ID) -> BigQueryJobManager:
+    get_shared_client(client_type="bigquery", project_id=project_id, client_factory=lambda _: fake_client)
+    return BigQueryJobManager(project_id=project_id, poll_interval=POLL_INTERVAL)
+
+
+def test_interactive_jobs_start_before_batch_jobs(limiter):
+    limiter.max_concurrent_jobs = limiter.concurrency = 1
+    fake_client = FakeBigQueryClient()
+    job_manager = get_job_manager(fake_client)
+    blocking_future = job_manager.submit_query("blocking")
+    fake_client.wait_for_jobs(1)
+    futures = [
+        job_manager.submit_query(_name, priority=_priority)
+        for _name, _priority in [
+            ("batch_1", bigquery.QueryPriority.BATCH),
+            ("interactive_1", bigquery.QueryPriority.INTERACTIVE),
+            ("batch_2", bigquery.QueryPriority.BATCH),
+            ("interactive_2", bigquery.QueryPriority.INTERACTIVE),
+        ]
+    ]
+    for _num_jobs in range(1, 6):
+        fake_client.wait_for_jobs(_num_jobs)
+        fake_client.jobs[-1].finish()
+    assert blocking_future.result(timeout=TIMEOUT).sql_query == "blocking"
+    assert [_future.result(timeout=TIMEOUT).sql_query for _future in futures] == [
+        "batch_1", "interactive_1", "batch_2", "interactive_2"
+    ]
+    assert fake_client.started_queries == ["blocking", "interactive_1", "interactive_2", "batch_1", "batch_2"]
+    job_manager.shutdown()
+
+
+def test_concurrency_is_capped_per_project(limiter):
+    fake_client = FakeBigQueryClient(latency=0.05)
+    job_managers = [get_job_manager(fake_client), get_job_manager(fake_client)]
+    futures = [_job_manager.submit_query(f"{_i}_{_j}") for _i, _job_manager in enumerate(job_managers)
+               for _j in range(10)]
+    assert all(_future.result(timeout=TIMEOUT).state == "DONE" for _future in futures)
+    # both managers of the project share its limit
+    assert fake_client.max_running_jobs == limiter.max_concurrent_jobs
+    assert limiter.get_stats()["running"] == 0
+    for _job_manager in job_managers:
+        _job_manager.shutdown()
+
+
+def test_quota_errors_apply_backpressure(limiter):
+    fake_client = FakeBigQueryClient(
+        latency=0.02,
+        start_errors=[api_exceptions.TooManyRequests("Rate limit exceeded")],
+        job_errors=[{"reason": "quotaExceeded", "message": "Quota exceeded"}],
+    )
+    job_manager = get_job_manager(fake_client)
+    quota_error_concurrencies = []
+    release = limiter.release
+
+    def _recording_release(succeeded: bool = False, quota_error: bool = False):
+        release(succeeded=succeeded, quota_error=quota_error)
+        if quota_error:
+            quota_error_concurrencies.append(limiter.concurrency)
+
+    limiter.release = _recording_release
+    futures = [job_manager.submit_query(str(_i)) for _i in range(8)]
+    assert sorted(_future.result(timeout=TIMEOUT).sql_query for _future in futures) == [str(_i) for _i in range(8)]
+    # both quota errors were retried, each halving the concurrency, which grows back with finished jobs
+    assert len(fake_client.started_queries) == 9
+    assert len(quota_error_concurrencies) == 2 and min(quota_error_concurrencies) <= 2
+    assert limiter.concurrency > min(quota_error_concurrencies)
+    job_manager.shutdown()
+
+
+def test_failed_jobs_fail_their_futures(limiter):
+    fake_client = FakeBigQueryClient(latency=0.0, job_errors=[{"reason": "invalidQuery", "message": "Syntax error"}])
+    job_manager = get_job_manager(fake_client)
+    with pytest.raises(Exception, match="Syntax error"):
+        job_manager.submit_query("invalid").result(timeout=TIMEOUT)
+    assert limiter.get_stats()["running"] == 0
+    job_manager.shutdown()
+
+
+def test_polling_errors_dont_stop_the_poller(limiter, monkeypatch):
+    fake_client = FakeBigQueryClient(latency=0.0)
+    fake_client.reload_errors = [Exception("Connection reset")] * 3
+    try_acquire, acquire_errors = limiter.try_acquire, [Exception("Unexpected error")]
+
+    def _failing_try_acquire():
+        if acquire_errors:
+            raise acquire_errors.pop()
+        return try_acquire()
+
+    monkeypatch.setattr(limiter, "try_acquire", _failing_try_acquire)
+    job_manager = get_job_manager(fake_client)
+    assert job_manager.submit_query("1").result(timeout=TIMEOUT).state == "DONE"
+    assert not acquire_errors and not fake_client.reload_errors
+    job_manager.shutdown()
+
+
+def test_shutdown_without_waiting_resolves_all_futures(limiter):
+    limiter.max_concurrent_jobs = limiter.concurrency = 1
+    fake_client = FakeBigQueryClient()
+    job_manager = get_job_manager(fake_client)
+    running_future = job_manager.submit_query("running")
+    fake_client.wait_for_jobs(1)
+    queued_future = job_manager.submit_query("queued")
+    job_manager.shutdown(wait_for_jobs=False)
+    assert queued_future.cancelled()
+    with pytest.raises(RuntimeError, match="shut down before job job_running finished"):
+        running_future.result(timeout=TIMEOUT)
+    assert limiter.get_stats()["running"] == 0
+    with pytest.raises(RuntimeError):
+        job_manager.submit_query("too late")
+
+
+def test_upload_tables_loads_tables_in_parallel():
+    data_df = make_rows(1000)
+    set_table_schemas({f"TABLE_{_i}": get_schema_mapping(data_df) for _i in range(3)})
+    uploaders = [
+        BigQueryUploader(
+            project_id=PROJECT_ID, dataset_name=DATASET_NAME, table_name=f"table_{_i}", data_to_upload=data_df,
+            p_key="id",
+        )
+        for _i in range(3)
+    ]
+    all_upload_results = upload_tables(uploaders)
+    assert [_upload_results.get("errors") for _upload_results in all_upload_results] == [None] * 3
+    assert [_upload_results["jobs"]["num_rows"] for _upload_results in all_upload_results] == [1000] * 3
+    assert [_uploader.highest_pkey_value for _uploader in uploaders] == [999] * 3
+    # incremental uploads of the same data skip all rows
+    assert [_results["skipped_rows"] for _results in upload_tables(uploaders, incremental=True)] == [1000] * 3
@@ -0,0 +1,130 @@
+"""
+loading dataframes as csv (default) or parquet, json records as ndjson, and a benchmark of the dataframe formats,
+see pytest-benchmark
+"""
+import io
+import json
+from datetime import date
+from decimal import Decimal
+
+import pandas as pd
+import pytest
+
+from app.gcp.big_query.big_query_table import BigQueryTable
+from app.gcp.big_query.local_backend import to_load_payload
+from app.utils import file_utils
+from conftest import DATASET_NAME, PROJECT_ID, TABLE_SCHEMAS, get_schema_mapping, make_rows, set_table_schemas
+
+# (rows, columns) of the benchmarked frames, both ~1M values
+FRAME_SHAPES = {"narrow": (250_000, 4), "wide": (10_000, 100)}
+
+
+def get_user_profiles_table(**kwargs) -> BigQueryTable:
+    return BigQueryTable(project_id=PROJECT_ID, dataset_name=DATASET_NAME, table_name="user_profiles", **kwargs)
+
+
+def test_csv_is_the_default_load_format(monkeypatch):
+    assert get_user_profiles_table().load_format == "csv"
+    assert get_user_profiles_table(load_format="PARQUET").load_format == "parquet"
+    monkeypatch.setenv("DEFAULT_LOAD_FORMAT", "parquet")
+    assert get_user_profiles_table().load_format == "parquet"
+    set_table_schemas(TABLE_SCHEMAS, table_options={"USER_PROFILES": {"load_format": "csv"}})
+    assert get_user_profiles_table().load_format == "csv"
+
+
+def test_string_values_of_integer_columns(bq_client, user_profiles):
+    data_df = pd.DataFrame({"id": ["5"], "name": ["Otto"], "country": ["DE"], "score": [1.0]})
+    assert get_user_profiles_table().update_from_dataframe(data_df).num_rows == 1
+    assert bq_client.execute_query(
+        sql_query=f"SELECT id FROM `{user_profiles}` WHERE name = 'Otto'", as_json=True
+    )["results"] == [{"id": 5}]
+    # parquet needs dtypes matching the schema, so it's only enabled for tables whose uploads are typed
+    with pytest.raises(Exception):
+        get_user_profiles_table().update_from_dataframe(data_df, load_format="parquet")
+
+
+@pytest.fixture(params=["orjson", "json"])
+def json_encoder(request, monkeypatch) -> str:
+    """
+    encode ndjson with orjson, if it's installed, and with the json fallback
+    """
+    if request.param == "orjson":
+        pytest.importorskip("orjson")
+    else:
+        monkeypatch.setattr(file_utils, "orjson", None)
+    return request.param
+
+
+def test_write_ndjson_round_trip(json_encoder):
+    records = [
+        {"id": 1, "name": "Müller", "score": 1.5, "tags": ["a", "b"], "address": {"city": "Köln"}},
+        {"id": 2, "name": None, "score": float("nan"), "amount": Decimal("1.10"), "created": date(2024, 1, 31)},
+        {"id": 3, "score": float("inf"), 4: "non-string key"},
+    ]
+    ndjson_file = io.BytesIO()
+    assert file_utils.write_ndjson(records=iter(records), fp=ndjson_file) == 3
+    lines = ndjson_file.getvalue().decode().splitlines()
+    assert [json.loads(_line) for _line in lines] == [
+        {"id": 1, "name": "Müller", "score": 1.5, "tags": ["a", "b"], "address": {"city": "Köln"}},
+        {"id": 2, "name": None, "score": None, "amount": "1.10", "created": "2024-01-31"},
+        {"id": 3, "score": None, "4": "non-string key"},
+    ]
+
+
+@pytest.mark.parametrize("spool_max_bytes", [BigQueryTable.NDJSON_SPOOL_MAX_BYTES, 64])
+def test_json_records_are_loaded_from_a_spooled_file(bq_client, json_encoder, spool_max_bytes, monkeypatch):
+    # beyond spool_max_bytes, the records are spooled to disk
+    monkeypatch.setattr(BigQueryTable, "NDJSON_SPOOL_MAX_BYTES", spool_max_bytes)
+    records = [
+        {"id": _i, "name": f"Jürgen {_i}", "country": "DE" if _i % 2 else None, "score": _i % 3 or float("nan")}
+        for _i in range(1, 101)
+    ]
+    upload_results = get_user_profiles_table(p_key="id").update_from_json_data(records)
+    assert upload_results.num_rows == 100
+    query_results = bq_client.execute_query(
+        sql_query=f"SELECT id, name, country, score IS NULL AS no_score "
+        f"FROM `{PROJECT_ID}.{DATASET_NAME}.user_profiles` WHERE id IN (1, 3) ORDER BY id",
+        as_json=True,
+    )
+    assert query_results["results"] == [
+        {"id": 1, "name": "Jürgen 1", "country": "DE", "no_score": False},
+        {"id": 3, "name": "Jürgen 3", "country": "DE", "no_score": True},
+    ]
+
+
+@pytest.fixture(params=list(FRAME_SHAPES))
+def frame(request, bq_client) -> tuple:
+    """
+    benchmark frame, and its table created with the frame's schema
+    :return: tuple | (BigQueryTable, pd.DataFrame)
+    """
+    num_rows, num_columns = FRAME_SHAPES[request.param]
+    data_df = make_rows(num_rows, num_columns=num_columns)
+    set_table_schemas({"LOAD_FORMATS": get_schema_mapping(data_df)})
+    table = BigQueryTable(project_id=PROJECT_ID, dataset_name=DATASET_NAME, table_name="load_formats")
+    table.create()
+    return table, data_df
+
+
+@pytest.mark.benchmark(group="load_format_serialization")
+@pytest.mark.parametrize("load_format", list(BigQueryTable.LOAD_FORMATS))
+def test_serialization(benchmark, frame, load_format):
+    table, data_df = frame
+    payload = benchmark(
+        to_load_payload,
+        data_df,
+        source_format=BigQueryTable.LOAD_FORMATS[load_format],
+        schema=table.schema,
+    )
+    assert payload
+    benchmark.extra_info["payload_bytes"] = len(payload)
+
+
+@pytest.mark.benchmark(group="load_format_end_to_end")
+@pytest.mark.parametrize("load_format", list(BigQueryTable.LOAD_FORMATS))
+def test_end_to_end_load(benchmark, frame, load_format):
+    table, data_df = frame
+    upload_results = benchmark(table.update_from_dataframe, data_df=data_df, load_format=load_format)
+    assert upload_results.num_rows == data_df.shape[0]
+    if benchmark.stats:  # None if run with --benchmark-disable
+        benchmark.extra_info["rows_per_second"] = data_df.shape[0] / benchmark.stats.stats.mean
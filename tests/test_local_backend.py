@@ -0,0 +1,145 @@
+import re
+
+import duckdb
+import pandas as pd
+import pyarrow as pa
+import pytest
+from google.api_core import exceptions as api_exceptions
+from google.cloud import bigquery
+
+from app.gcp.big_query.big_query_table import BigQueryTable
+from app.gcp.big_query.big_query_uploader import BigQueryUploader
+from app.gcp.big_query.local_backend import to_local_sql
+from conftest import DATASET_NAME, PROJECT_ID
+
+DUCKDB_VERSION = tuple(int(_part) for _part in duckdb.__version__.split(".")[:2])
+
+
+def test_to_local_sql_rewrites_table_ids_and_parameters():
+    assert to_local_sql(
+        'SELECT name FROM `local.user_data.users` WHERE country = "DE" AND age > @age;'
+    ) == """SELECT name FROM "user_data"."users" WHERE country = 'DE' AND age > $age"""
+
+
+def test_to_local_sql_adds_into_to_merge():
+    assert to_local_sql("MERGE `local.d.t` T USING `local.d.s` S ON T.id = S.id").startswith(
+        'MERGE INTO "d"."t" T USING "d"."s" S'
+    )
+    assert to_local_sql("merge into `local.d.t` T USING `local.d.s` S ON T.id = S.id").startswith(
+        'merge into "d"."t" T'
+    )
+
+
+def test_get_table_and_list_rows(bq_client, user_profiles):
+    table = bq_client.bq_client.get_table(user_profiles)
+    assert [_field.name for _field in table.schema] == ["id", "name", "country", "score"]
+    assert table.num_rows == 4
+    arrow_table = bq_client.bq_client.list_rows(table, max_results=2).to_arrow()
+    assert isinstance(arrow_table, pa.Table)
+    assert arrow_table.num_rows == 2
+
+
+def test_query_with_parameters(bq_client, user_profiles):
+    query_results = bq_client.execute_query(
+        sql_query=f"SELECT name FROM `{user_profiles}` WHERE country IN UNNEST(@countries) ORDER BY id",
+        query_parameters=[bigquery.ArrayQueryParameter("countries", "STRING", ["DE"])],
+        as_json=True,
+    )
+    assert query_results["results"] == [{"name": "Jane"}, {"name": "Max"}]
+
+
+def test_dry_run(bq_client, user_profiles):
+    assert bq_client.estimate_query_bytes(f"SELECT * FROM `{user_profiles}`") > 0
+    with pytest.raises(api_exceptions.BadRequest):
+        bq_client.estimate_query_bytes(f"SELECT missing_column FROM `{user_profiles}`")
+
+
+def test_upload(bq_client):
+    upload_results = BigQueryUploader(
+        project_id=PROJECT_ID,
+        dataset_name=DATASET_NAME,
+        table_name="user_profiles",
+        data_to_upload=[{"id": 1, "name": "Jane", "country": "DE", "score": 1.5}],
+    ).do_upload()
+    assert upload_results.get("errors") is None
+    assert upload_results["jobs"]["num_rows"] == 1
+    assert bq_client.bq_client.get_table(upload_results["table_id"]).num_rows == 1
+
+
+@pytest.mark.skipif(DUCKDB_VERSION < (1, 4), reason="MERGE needs duckdb>=1.4")
+def test_upsert(bq_client, user_profiles):
+    upload_results = BigQueryUploader(
+        project_id=PROJECT_ID,
+        dataset_name=DATASET_NAME,
+        table_name="user_profiles",
+        data_to_upload=pd.DataFrame(
+            {"id": [4, 5], "name": ["Erika M.", "Otto"], "country": ["DE", "DE"], "score": [1.0, 2.0]}
+        ),
+        p_key="id",
+    ).do_upload(upsert=True)
+    assert upload_results.get("errors") is None
+    assert upload_results["jobs"]["num_rows"] == 2
+    query_results = bq_client.execute_query(
+        sql_query=f"SELECT id, name FROM `{user_profiles}` WHERE id >= 4 ORDER BY id", as_json=True
+    )
+    assert query_results["results"] == [{"id": 4, "name": "Erika M."}, {"id": 5, "name": "Otto"}]
+
+
+@pytest.fixture
+def merge_queries(bq_client, monkeypatch) -> list:
+    """
+    (SQL query, query parameters) of the MERGE statements sent during the test, which aren't executed
+    """
+    merge_queries = []
+    _query = bq_client.bq_client.query
+
+    def _recording_query(query: str, job_config: bigquery.QueryJobConfig = None, **kwargs):
+        if not query.strip().upper().startswith("MERGE"):
+            return _query(query, job_config=job_config, **kwargs)
+        merge_queries.append((" ".join(query.split()), list(job_config.query_parameters)))
+        return _query("SELECT 1", **kwargs)
+
+    monkeypatch.setattr(bq_client.bq_client, "query", _recording_query)
+    return merge_queries
+
+
+def test_upsert_merge_query(bq_client, user_profiles, merge_queries):
+    table = BigQueryTable(project_id=PROJECT_ID, dataset_name=DATASET_NAME, table_name="user_profiles", p_key="id")
+    table.upsert_from_dataframe(
+        data_df=pd.DataFrame({"name": ["Otto", "Otto M."], "id": [5, 5], "other": [1, 2]}),
+        partition_predicates=[("country", "IN", ["DE", "AT"]), ("score", ">=", 1.0)],
+    )
+    [(merge_query, query_parameters)] = merge_queries
+    staging_table_id = re.search(r"USING `([^`]+)` S", merge_query).group(1)
+    assert staging_table_id.startswith(f"{user_profiles}__staging_")
+    assert merge_query == (
+        f"MERGE `{user_profiles}` T USING `{staging_table_id}` S "
+        "ON T.`id` = S.`id` AND T.`country` IN UNNEST(@p0) AND T.`score` >= @p1 "
+        "WHEN MATCHED THEN UPDATE SET `name` = S.`name` "
+        "WHEN NOT MATCHED THEN INSERT (`id`, `name`) VALUES (S.`id`, S.`name`)"
+    )
+    assert query_parameters == [
+        bigquery.ArrayQueryParameter("p0", "STRING", ["DE", "AT"]),
+        bigquery.ScalarQueryParameter("p1", "FLOAT64", 1.0),
+    ]
+    with pytest.raises(api_exceptions.NotFound):
+        bq_client.bq_client.get_table(staging_table_id)
+
+
+@pytest.mark.parametrize(
+    "partition_predicate, message",
+    [
+        (("country = 'DE') OR (TRUE", "=", "DE"), "Invalid column name"),
+        (("country", "= 'DE' OR TRUE --", "DE"), "Unsupported operator"),
+        (("country", "IN", "DE"), "needs a list of values"),
+    ],
+)
+def test_upsert_rejects_invalid_partition_predicates(bq_client, user_profiles, merge_queries, partition_predicate,
+                                                     message):
+    table = BigQueryTable(project_id=PROJECT_ID, dataset_name=DATASET_NAME, table_name="user_profiles", p_key="id")
+    with pytest.raises(ValueError, match=message):
+        table.upsert_from_dataframe(
+            data_df=pd.DataFrame({"id": [5], "name": ["Otto"]}), partition_predicates=[partition_predicate]
+        )
+    assert merge_queries == []
+    assert [_table.table_id for _table in bq_client.bq_client.list_tables(DATASET_NAME)] == ["user_profiles"]
@@ -0,0 +1,149 @@
+"""
+memory benchmark of streaming a million-row result as NDJSON vs materializing it, against a fake backend
+"""
+import asyncio
+import json
+import multiprocessing
+import resource
+import threading
+
+import pytest
+from google.cloud import bigquery
+
+from app.gcp.base_client import get_shared_client
+from app.gcp.big_query.big_query_client import BigQueryClient
+from conftest import PROJECT_ID
+
+NUM_ROWS = 1_000_000
+PAGE_SIZE = 10_000
+_FIELD_INDEX = {"id": 0, "name": 1, "score": 2}
+
+
+class FakeRowIterator:
+    """
+    pages of rows are only created when they're fetched, like pages of a RowIterator
+    """
+
+    def __init__(self, num_rows: int, page_size: int):
+        self.num_rows = num_rows
+        self.page_size = page_size
+        self.next_page_token = None
+
+    @property
+    def pages(self):
+        for _start in range(0, self.num_rows, self.page_size):
+            yield [
+                bigquery.Row((_i, f"name {_i}", _i * 0.5), _FIELD_INDEX)
+                for _i in range(_start, min(_start + self.page_size, self.num_rows))
+            ]
+
+
+class FakeQueryJob:
+    state = "DONE"
+    error_result = None
+
+    def __init__(self, num_rows: int = NUM_ROWS):
+        self.num_rows = num_rows
+
+    def reload(self, **kwargs) -> None:
+        pass
+
+    def result(self, page_size: int = None, **kwargs) -> FakeRowIterator:
+        return FakeRowIterator(num_rows=self.num_rows, page_size=page_size or PAGE_SIZE)
+
+
+class FakeBigQueryClient:
+    def __init__(self, num_rows: int = NUM_ROWS):
+        self.num_rows = num_rows
+
+    def query(self, sql_query: str, **kwargs) -> FakeQueryJob:
+        return FakeQueryJob(num_rows=self.num_rows)
+
+
+@pytest.fixture
+def bq_client() -> BigQueryClient:
+    get_shared_client(client_type="bigquery", project_id=PROJECT_ID, client_factory=lambda _: FakeBigQueryClient())
+    return BigQueryClient(project_id=PROJECT_ID)
+
+
+def measure_peak_memory(func) -> tuple:
+    """
+    run func in a forked process, so its peak memory is neither hidden by nor added to that of other tests
+    :return: tuple | (result of func, growth of the peak resident memory while running it in bytes)
+    """
+    context = multiprocessing.get_context("fork")
+    queue = context.Queue()
+
+    def _run():
+        max_rss_at_start = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        result = func()
+        queue.put((result, (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - max_rss_at_start) * 1024))
+
+    process = context.Process(target=_run)
+    process.start()
+    try:
+        return queue.get(timeout=600)
+    finally:
+        process.join()
+
+
+def stream_ndjson(bq_client: BigQueryClient) -> tuple:
+    async def _consume() -> tuple:
+        num_lines, num_bytes = 0, 0
+        async for _chunk in await bq_client.execute_query_ndjson_stream(sql_query="SELECT *", page_size=PAGE_SIZE):
+            num_lines += _chunk.count(b"\n")
+            num_bytes += len(_chunk)
+        return num_lines, num_bytes
+
+    return asyncio.run(_consume())
+
+
+def materialize_json(bq_client: BigQueryClient) -> tuple:
+    # the non-streaming path: all records are collected, then serialized as one response
+    query_results = asyncio.run(bq_client.execute_query_async(sql_query="SELECT *", as_json=True, use_cache=False))
+    return len(query_results["results"]), len(json.dumps(query_results, default=str).encode())
+
+
+@pytest.mark.slow
+@pytest.mark.benchmark(group="ndjson_memory")
+def test_streaming_memory(benchmark, bq_client):
+    (num_rows, num_bytes), peak_bytes = benchmark.pedantic(
+        measure_peak_memory, args=(lambda: stream_ndjson(bq_client),), rounds=1, iterations=1
+    )
+    assert num_rows == NUM_ROWS
+    (num_materialized_rows, _), materialized_peak_bytes = measure_peak_memory(lambda: materialize_json(bq_client))
+    assert num_materialized_rows == NUM_ROWS
+    benchmark.extra_info.update(
+        {"peak_bytes": peak_bytes, "materialized_peak_bytes": materialized_peak_bytes, "payload_bytes": num_bytes}
+    )
+    print(
+        f"Peak memory for {num_bytes / 2 ** 20:.0f}MB of NDJSON: {peak_bytes / 2 ** 20:.0f}MB streamed, "
+        f"{materialized_peak_bytes / 2 ** 20:.0f}MB materialized"
+    )
+    # memory is bounded by a page of rows, not by the size of the result
+    assert peak_bytes < materialized_peak_bytes / 10
+
+
+def test_pages_are_encoded_in_worker_threads(monkeypatch):
+    get_shared_client(client_type="bigquery", project_id=PROJECT_ID, client_factory=lambda _: FakeBigQueryClient(25))
+    bq_client = BigQueryClient(project_id=PROJECT_ID)
+    encoding_threads = []
+    encode_ndjson_page = BigQueryClient.encode_ndjson_page
+
+    def _recording_encode_ndjson_page(page) -> bytes:
+        encoding_threads.append(threading.current_thread())
+        return encode_ndjson_page(page)
+
+    monkeypatch.setattr(BigQueryClient, "encode_ndjson_page", staticmethod(_recording_encode_ndjson_page))
+
+    async def _consume() -> bytes:
+        return b"".join(
+            [_chunk async for _chunk in await bq_client.execute_query_ndjson_stream(sql_query="SELECT *", page_size=10)]
+        )
+
+    lines = asyncio.run(_consume()).decode().splitlines()
+    assert [json.loads(_line) for _line in lines[:2]] == [
+        {"id": 0, "name": "name 0", "score": 0.0}, {"id": 1, "name": "name 1", "score": 0.5}
+    ]
+    assert len(lines) == 25
+    assert len(encoding_threads) == 3 and threading.main_thread() not in encoding_threads
@@ -0,0 +1,103 @@
+import base64
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.gcp.big_query.big_query_client import decode_page_token, encode_page_token
+from app.main import app, check_page_token_secret
+
+SQL_QUERY = "SELECT id, name FROM `local.test_data.user_profiles` ORDER BY id"
+
+
+@pytest.fixture
+def list_rows_calls(bq_client, monkeypatch) -> list:
+    """
+    tables rows were listed from during the test
+    """
+    calls = []
+    _list_rows = bq_client.bq_client.list_rows
+
+    def _counting_list_rows(table, *args, **kwargs):
+        calls.append(str(table))
+        return _list_rows(table, *args, **kwargs)
+
+    monkeypatch.setattr(bq_client.bq_client, "list_rows", _counting_list_rows)
+    return calls
+
+
+def get_page(page_size: int = 3, page_token: str = None, sql_query: str = SQL_QUERY):
+    return TestClient(app).post(
+        "/bigquery_operation_results",
+        json={"query": sql_query, "page_size": page_size, "page_token": page_token},
+    )
+
+
+def test_pages_are_read_from_the_destination_table(user_profiles, list_rows_calls):
+    first_page = get_page()
+    assert first_page.status_code == 200
+    assert [_row["id"] for _row in first_page.json()["query_results"]["results"]] == [1, 2, 3]
+    second_page = get_page(page_token=first_page.json()["next_page_token"])
+    assert second_page.status_code == 200
+    assert second_page.json()["query_results"]["results"] == [{"id": 4, "name": "Erika"}]
+    assert second_page.json()["next_page_token"] is None
+    assert second_page.json()["total_rows"] == 4
+    # both pages are listed from the query's destination table
+    assert len(list_rows_calls) == 2 and list_rows_calls[0] == list_rows_calls[1]
+    assert list_rows_calls[0] != user_profiles
+
+
+def test_tampered_page_tokens_are_rejected(user_profiles):
+    next_page_token = get_page().json()["next_page_token"]
+    cursor, signature = next_page_token.split(".")
+    tampered_cursor = base64.urlsafe_b64encode(
+        json.dumps({**json.loads(base64.urlsafe_b64decode(cursor)), "destination": user_profiles}).encode()
+    ).decode()
+    response = get_page(page_token=f"{tampered_cursor}.{signature}")
+    assert response.status_code == 400
+    assert "signature" in response.json()["detail"]
+
+
+@pytest.mark.parametrize("page_token", ["not-a-token", "", "e30.0000"])
+def test_invalid_page_tokens_are_rejected(user_profiles, page_token):
+    response = get_page(page_token=page_token or ".")
+    assert response.status_code == 400
+
+
+def test_page_tokens_of_other_queries_are_rejected(user_profiles):
+    page_token = encode_page_token(
+        sql_query="SELECT 1", destination="local._anon.other", start_index=3
+    )
+    response = get_page(page_token=page_token)
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Error: page_token does not belong to this query"
+
+
+def test_pages_can_be_fetched_in_parallel(user_profiles):
+    first_page = get_page(page_size=1).json()
+    assert first_page["total_rows"] == 4
+    assert first_page["page_tokens"][0] == first_page["next_page_token"]
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        pages = list(
+            executor.map(lambda _page_token: get_page(page_size=1, page_token=_page_token), first_page["page_tokens"])
+        )
+    assert [_page.json()["query_results"]["results"][0]["id"] for _page in pages] == [2, 3, 4]
+    assert pages[-1].json()["next_page_token"] is None
+
+
+def test_page_tokens_need_the_same_secret(monkeypatch):
+    page_token = encode_page_token(sql_query=SQL_QUERY, destination="local._anon.job", start_index=2)
+    # e.g. another worker or instance with a different secret
+    monkeypatch.setenv("PAGE_TOKEN_SECRET", "other-secret")
+    with pytest.raises(ValueError, match="signature"):
+        decode_page_token(sql_query=SQL_QUERY, page_token=page_token)
+    monkeypatch.setenv("PAGE_TOKEN_SECRET", "test-secret")
+    assert decode_page_token(sql_query=SQL_QUERY, page_token=page_token)["start_index"] == 2
+
+
+def test_startup_requires_a_page_token_secret(monkeypatch):
+    monkeypatch.delenv("PAGE_TOKEN_SECRET")
+    with pytest.raises(RuntimeError, match="PAGE_TOKEN_SECRET"):
+        check_page_token_secret()
@@ -0,0 +1,47 @@
+import pytest
+
+from app.gcp.big_query.big_query_client import BigQueryClient
+from app.utils import cloud_project_utils
+from app.utils.cloud_project_utils import CloudProjectUtils, get_cached_project_id_and_secrets_env
+
+
+@pytest.fixture
+def metadata_server_calls(monkeypatch) -> list:
+    """
+    unresolved project-id, without env-vars set and a metadata-server that's not reachable;
+    records the calls of the metadata-server
+    """
+    monkeypatch.setattr(cloud_project_utils, "_resolved_project_id_and_secrets_env", {})
+    monkeypatch.setattr(cloud_project_utils, "_resolution_error", {})
+    monkeypatch.setattr(cloud_project_utils, "load_dotenv", lambda: None)
+    monkeypatch.delenv("RUN_ENV", raising=False)
+    for _env_var in cloud_project_utils.PROJECT_ID_ENV_VARS:
+        monkeypatch.delenv(_env_var, raising=False)
+    calls = []
+
+    def _get_project_id_from_gcp():
+        calls.append(1)
+        return None
+
+    monkeypatch.setattr(CloudProjectUtils, "get_project_id_from_gcp", staticmethod(_get_project_id_from_gcp))
+    return calls
+
+
+def test_passed_project_ids_are_not_resolved(metadata_server_calls):
+    assert BigQueryClient(project_id="other").project_id == "other"
+    assert metadata_server_calls == []
+
+
+def test_failed_lookups_are_cached(metadata_server_calls, monkeypatch):
+    for _ in range(3):
+        with pytest.raises(ValueError, match="PROJECT_ID"):
+            BigQueryClient()
+    assert len(metadata_server_calls) == 1
+
+    # tried again after PROJECT_ID_RETRY_SECONDS
+    monkeypatch.setenv("PROJECT_ID_RETRY_SECONDS", "0")
+    monkeypatch.setenv("GOOGLE_CLOUD_PROJECT", "resolved")
+    assert BigQueryClient().project_id == "resolved"
+    monkeypatch.delenv("GOOGLE_CLOUD_PROJECT")
+    assert get_cached_project_id_and_secrets_env() == {"project_id": "resolved", "secrets_env": "CLOUD"}
+    assert len(metadata_server_calls) == 1
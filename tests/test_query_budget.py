@@ -0,0 +1,152 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from app.gcp.base_client import get_shared_client
+from app.gcp.big_query.local_backend import LocalBigQueryClient
+from app.gcp.big_query.query_budget import QueryBudget, QueryBudgetExceeded, query_budget
+from app.gcp.big_query.table_replicas import TableReplicas
+from app.main import app
+from conftest import PROJECT_ID
+
+SQL_QUERY = "SELECT id, name FROM `local.test_data.user_profiles` ORDER BY id"
+# the client address of requests made with TestClient
+CALLER = "testclient"
+
+
+@pytest.fixture
+def caller_budget(bq_client, user_profiles, monkeypatch) -> int:
+    """
+    per-caller budget of the app fitting the estimate of SQL_QUERY twice
+    :return: int | estimated bytes of SQL_QUERY
+    """
+    estimated_bytes = bq_client.estimate_query_bytes(sql_query=SQL_QUERY)
+    monkeypatch.setattr(query_budget, "max_bytes_per_caller", 2 * estimated_bytes)
+    monkeypatch.setattr(query_budget, "_caller_usage", {})
+    return estimated_bytes
+
+
+@pytest.fixture
+def failing_queries(bq_client, monkeypatch):
+    """
+    queries of the app fail after their dry-run
+    """
+    query = bq_client.bq_client.query
+
+    def _failing_query(sql_query, job_config=None, **kwargs):
+        if not (job_config and job_config.dry_run):
+            raise Exception("Resources exceeded during query execution")
+        return query(sql_query, job_config=job_config, **kwargs)
+
+    monkeypatch.setattr(bq_client.bq_client, "query", _failing_query)
+
+
+def get_results(headers: dict = None, **payload):
+    return TestClient(app).post(
+        "/bigquery_operation_results", json={"query": SQL_QUERY, **payload}, headers=headers
+    )
+
+
+def test_release_refunds_exactly_the_reservation():
+    budget = QueryBudget(max_bytes_per_caller=100)
+    first_reservation = budget.reserve(estimated_bytes=30, caller="a")
+    second_reservation = budget.reserve(estimated_bytes=30, caller="a")
+    with pytest.raises(QueryBudgetExceeded):
+        budget.reserve(estimated_bytes=60, caller="a")
+    budget.release(first_reservation)
+    # releasing twice doesn't refund another reservation of the same estimate
+    budget.release(first_reservation)
+    assert budget.get_used_bytes("a") == 30
+    assert list(budget._caller_usage["a"]) == [second_reservation]
+    budget.release(budget.reserve(estimated_bytes=70, caller="a"))
+    budget.release(second_reservation)
+    assert budget.get_used_bytes("a") == 0
+
+
+def test_no_dry_run_without_budgets(bq_client, user_profiles, monkeypatch):
+    dry_runs = []
+    query = bq_client.bq_client.query
+
+    def _counting_query(sql_query, job_config=None, **kwargs):
+        if job_config and job_config.dry_run:
+            dry_runs.append(sql_query)
+        return query(sql_query, job_config=job_config, **kwargs)
+
+    monkeypatch.setattr(bq_client.bq_client, "query", _counting_query)
+    monkeypatch.setattr(query_budget, "max_bytes_per_request", None)
+    monkeypatch.setattr(query_budget, "max_bytes_per_caller", None)
+    response = get_results()
+    assert response.status_code == 200
+    assert response.json()["estimated_bytes_processed"] is None
+    assert dry_runs == []
+
+
+def test_callers_are_identified_by_client_address(caller_budget):
+    assert get_results(page_size=1, caller_id="a").status_code == 200
+    assert get_results(page_size=1, caller_id="b").status_code == 200
+    # a new caller_id doesn't reset the budget
+    response = get_results(page_size=1, caller_id="c")
+    assert response.status_code == 400
+    assert response.json()["detail"]["estimated_bytes_processed"] == caller_budget
+    assert query_budget.get_used_bytes(CALLER) == 2 * caller_budget
+
+
+def test_callers_are_identified_by_a_trusted_header(caller_budget, monkeypatch):
+    monkeypatch.setenv("CALLER_ID_HEADER", "X-Goog-Authenticated-User-Email")
+    for _caller in ["a@example.com", "b@example.com"]:
+        for _ in range(2):
+            assert get_results(
+                page_size=1, headers={"X-Goog-Authenticated-User-Email": _caller}
+            ).status_code == 200
+        assert query_budget.get_used_bytes(_caller) == 2 * caller_budget
+    assert query_budget.get_used_bytes(CALLER) == 0
+
+
+@pytest.mark.parametrize("payload", [{}, {"page_size": 1}, {"stream": True}])
+def test_failed_queries_are_not_charged(caller_budget, failing_queries, payload):
+    for _ in range(3):
+        response = get_results(**payload)
+        assert response.status_code in (200, 400)
+        assert not response.json().get("query_results", {}).get("results")
+    assert query_budget.get_used_bytes(CALLER) == 0
+
+
+def test_cached_results_are_not_charged(caller_budget):
+    first_response = get_results()
+    assert first_response.status_code == 200
+    assert first_response.json()["estimated_bytes_processed"] == caller_budget
+    for _ in range(3):
+        response = get_results()
+        assert response.status_code == 200
+        assert response.json()["query_results"] == first_response.json()["query_results"]
+    assert query_budget.get_used_bytes(CALLER) == caller_budget
+
+
+def test_replica_results_are_not_charged(bq_client, user_profiles, caller_budget):
+    get_shared_client(
+        client_type="table_replicas",
+        project_id=PROJECT_ID,
+        client_factory=lambda project_id: TableReplicas(
+            project_id=project_id,
+            table_ids=[user_profiles],
+            local_client=LocalBigQueryClient(project=project_id),
+        ),
+    )
+    for _ in range(3):
+        response = get_results(query=f"{SQL_QUERY} LIMIT 1")
+        assert response.status_code == 200
+        assert response.json()["query_results"]["results"] == [{"id": 1, "name": "Jane"}]
+    assert query_budget.get_used_bytes(CALLER) == 0
+
+
+def test_bigquery_cache_hits_are_not_charged(bq_client, caller_budget, monkeypatch):
+    query = bq_client.bq_client.query
+
+    def _cached_query(sql_query, job_config=None, **kwargs):
+        query_job = query(sql_query, job_config=job_config, **kwargs)
+        query_job.cache_hit = not (job_config and job_config.dry_run)
+        return query_job
+
+    monkeypatch.setattr(bq_client.bq_client, "query", _cached_query)
+    for _ in range(3):
+        assert get_results(page_size=2).status_code == 200
+    assert query_budget.get_used_bytes(CALLER) == 0
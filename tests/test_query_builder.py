@@ -0,0 +1,123 @@
+from datetime import date, datetime, timezone
+
+import pytest
+from google.cloud import bigquery
+
+from app.gcp.big_query.query_builder import SelectQueryBuilder, quote_identifier
+
+
+@pytest.fixture
+def list_rows_calls(bq_client, monkeypatch) -> list:
+    """
+    (table-id, selected_fields) of the list_rows requests made during the test
+    """
+    calls = []
+    _list_rows = bq_client.bq_client.list_rows
+
+    def _recording_list_rows(table, *args, selected_fields=None, **kwargs):
+        _table_id = table if isinstance(table, str) else f"{table.project}.{table.dataset_id}.{table.table_id}"
+        calls.append((_table_id, [_field.name for _field in selected_fields or []]))
+        return _list_rows(table, *args, selected_fields=selected_fields, **kwargs)
+
+    monkeypatch.setattr(bq_client.bq_client, "list_rows", _recording_list_rows)
+    return calls
+
+
+def test_build_query_and_parameters():
+    select_query, query_parameters = (
+        SelectQueryBuilder(table_id="`p.d.user_profiles`", columns=["name", "address.city"])
+        .where("country", "in", ("DE", "AT"))
+        .where("score", ">=", 1.5)
+        .where("email", "IS NOT NULL")
+        .where("name", "NOT LIKE", "test%")
+        .partition_range(start=date(2024, 1, 1), end=date(2024, 2, 1), partition_field="created_date")
+        .order_by("-created_date", "name")
+        .limit(10)
+        .build()
+    )
+    assert select_query == (
+        "SELECT `name`, `address`.`city` FROM `p.d.user_profiles` "
+        "WHERE `country` IN UNNEST(@p0) AND `score` >= @p1 AND `email` IS NOT NULL AND `name` NOT LIKE @p2 "
+        "AND `created_date` >= @p3 AND `created_date` < @p4 "
+        "ORDER BY `created_date` DESC, `name` LIMIT 10"
+    )
+    assert query_parameters == [
+        bigquery.ArrayQueryParameter("p0", "STRING", ["DE", "AT"]),
+        bigquery.ScalarQueryParameter("p1", "FLOAT64", 1.5),
+        bigquery.ScalarQueryParameter("p2", "STRING", "test%"),
+        bigquery.ScalarQueryParameter("p3", "DATE", date(2024, 1, 1)),
+        bigquery.ScalarQueryParameter("p4", "DATE", date(2024, 2, 1)),
+    ]
+
+
+def test_ingestion_time_partitions_are_compared_as_timestamps():
+    select_query, query_parameters = (
+        SelectQueryBuilder(table_id="p.d.events", columns=["id"]).partition_range(start=date(2024, 1, 1)).build()
+    )
+    assert select_query == "SELECT `id` FROM `p.d.events` WHERE _PARTITIONTIME >= @p0"
+    assert query_parameters == [
+        bigquery.ScalarQueryParameter("p0", "TIMESTAMP", datetime(2024, 1, 1, tzinfo=timezone.utc))
+    ]
+
+
+@pytest.mark.parametrize("identifier", ["name; DROP TABLE x", "`name`", "1name", "a..b", "name-1", ""])
+def test_invalid_identifiers_are_rejected(identifier):
+    with pytest.raises(ValueError, match="Invalid column name"):
+        quote_identifier(identifier)
+    with pytest.raises(ValueError, match="Invalid column name"):
+        SelectQueryBuilder(table_id="p.d.t", columns=[identifier]).build()
+    with pytest.raises(ValueError, match="Invalid column name"):
+        SelectQueryBuilder(table_id="p.d.t").where(identifier, "=", 1)
+
+
+@pytest.mark.parametrize("table_id", ["t", "p.d.t; DROP TABLE x", "p.d.t.x.y", "p.d.t` WHERE TRUE --"])
+def test_invalid_table_ids_are_rejected(table_id):
+    with pytest.raises(ValueError, match="Invalid table-id"):
+        SelectQueryBuilder(table_id=table_id)
+
+
+@pytest.mark.parametrize(
+    "operator, value, message",
+    [
+        ("IN", "abc", "needs a list of values"),
+        ("NOT IN", 1, "needs a list of values"),
+        ("IN", [], "needs at least one value"),
+        ("=", None, "Use IS NULL"),
+        ("BETWEEN", 1, "Unsupported operator"),
+    ],
+)
+def test_invalid_predicates_are_rejected(operator, value, message):
+    with pytest.raises(ValueError, match=message):
+        SelectQueryBuilder(table_id="p.d.t").where("name", operator, value)
+
+
+def test_unfiltered_reads_list_rows_in_requested_order(bq_client, user_profiles, list_rows_calls):
+    records = bq_client.get_select_query_results(table_id=user_profiles, columns=["NAME", "id"], limit=2)
+    assert records == [{"NAME": "Jane", "id": 1}, {"NAME": "John", "id": 2}]
+    assert [list(_record) for _record in records] == [["NAME", "id"]] * 2
+    assert list_rows_calls == [(user_profiles, ["name", "id"])]
+
+
+def test_unfiltered_reads_of_unknown_columns_raise(bq_client, user_profiles, list_rows_calls):
+    with pytest.raises(ValueError, match=r"Unknown columns of .*user_profiles: \['email'\]"):
+        bq_client.get_select_query_results(table_id=user_profiles, columns=["name", "email"])
+    assert list_rows_calls == []
+
+
+def test_filtered_reads_are_queried(bq_client, user_profiles, list_rows_calls):
+    records = bq_client.get_select_query_results(
+        table_id=user_profiles, columns=["id", "name"], predicates=[("country", "IN", ["DE"])], order_by=["-id"]
+    )
+    assert records == [{"id": 3, "name": "Max"}, {"id": 1, "name": "Jane"}]
+    # only the query's destination table is listed
+    assert user_profiles not in [_table_id for _table_id, _ in list_rows_calls]
+
+
+def test_conditions_are_qualified_with_the_table_alias():
+    query_builder = SelectQueryBuilder(table_id="p.d.t", table_alias="T").where("id", "=", 1).where("email", "IS NULL")
+    assert query_builder.get_condition() == (
+        "T.`id` = @p0 AND T.`email` IS NULL", [bigquery.ScalarQueryParameter("p0", "INT64", 1)]
+    )
+    assert SelectQueryBuilder(table_id="p.d.t").get_condition() == (None, [])
+    with pytest.raises(ValueError, match="Invalid table alias"):
+        SelectQueryBuilder(table_id="p.d.t", table_alias="T WHERE TRUE")
@@ -0,0 +1,121 @@
+import asyncio
+import math
+
+import pandas as pd
+import pytest
+
+from app.gcp.big_query.big_query_table import BigQueryTable
+from app.gcp.big_query.query_cache import (
+    QueryResultCache,
+    get_referenced_tables,
+    is_cacheable_query,
+    normalize_sql,
+    query_result_cache,
+)
+from conftest import DATASET_NAME, PROJECT_ID
+
+
+@pytest.fixture
+def get_table_calls(bq_client, monkeypatch) -> list:
+    """
+    table-ids of get_table requests made during the test
+    """
+    calls = []
+    _get_table = bq_client.bq_client.get_table
+
+    def _counting_get_table(table, *args, **kwargs):
+        calls.append(table)
+        return _get_table(table, *args, **kwargs)
+
+    monkeypatch.setattr(bq_client.bq_client, "get_table", _counting_get_table)
+    return calls
+
+
+def test_normalize_sql():
+    assert normalize_sql(
+        """
+        SELECT name  -- the name
+        FROM `local.test_data.user_profiles` /* all */ WHERE country = 'D  E';
+        """
+    ) == "SELECT name FROM `local.test_data.user_profiles` WHERE country = 'D  E'"
+
+
+def test_get_referenced_tables():
+    assert get_referenced_tables(
+        "SELECT * FROM `p.d.a` JOIN d.b USING (id) WHERE id IN (SELECT id FROM `p.d.a`)"
+    ) == ["d.b", "p.d.a"]
+
+
+def test_is_cacheable_query():
+    assert is_cacheable_query("SELECT * FROM `p.d.a`")
+    assert not is_cacheable_query("SELECT CURRENT_TIMESTAMP() FROM `p.d.a`")
+    assert not is_cacheable_query("DELETE FROM `p.d.a` WHERE TRUE")
+    # the tables of comma-joins after the first one aren't found
+    assert not is_cacheable_query("SELECT * FROM d.a, d.b WHERE a.id = b.id")
+    assert not is_cacheable_query("SELECT * FROM `p.d.a` AS a, d.b")
+    assert is_cacheable_query("SELECT * FROM `p.d.a` AS a JOIN d.b USING (id) WHERE a.id IN (1, 2)")
+
+
+def test_lru_eviction():
+    cache = QueryResultCache(ttl_seconds=60, max_bytes=20)
+    cache.put("a", [1, 2, 3])
+    cache.put("b", [4, 5, 6])
+    assert cache.get("a") == [1, 2, 3]
+    cache.put("c", [7, 8, 9])
+    assert cache.get("b") is None
+    assert cache.get("a") == [1, 2, 3]
+    assert cache.get_stats()["evictions"] == 1
+
+
+def test_cache_hits_need_no_table_lookups(bq_client, user_profiles, get_table_calls):
+    sql_query = f"SELECT name FROM `{user_profiles}` WHERE country = 'DE' ORDER BY id"
+    query_results = bq_client.execute_query(sql_query=sql_query, as_json=True)
+    assert len(get_table_calls) == 1
+    assert bq_client.execute_query(sql_query=sql_query, as_json=True) == query_results
+    assert len(get_table_calls) == 1
+    assert query_result_cache.get_stats()["hits"] == 1
+
+
+def test_cache_key_lookup_failures_dont_fail_queries(bq_client, user_profiles):
+    # p.created is a column, but matches the pattern of a table reference
+    query_results = bq_client.execute_query(
+        sql_query="SELECT EXTRACT(YEAR FROM p.created) AS y FROM (SELECT DATE '2024-05-01' AS created) p",
+        as_json=True,
+    )
+    assert query_results == {"errors": None, "results": [{"y": 2024}]}
+
+
+def test_writes_invalidate_cached_results(bq_client, user_profiles):
+    sql_query = f"SELECT COUNT(*) AS n FROM `{user_profiles}`"
+    assert bq_client.execute_query(sql_query=sql_query, as_json=True)["results"] == [{"n": 4}]
+    BigQueryTable(
+        project_id=PROJECT_ID, dataset_name=DATASET_NAME, table_name="user_profiles"
+    ).update_from_dataframe(
+        pd.DataFrame({"id": [5], "name": ["Otto"], "country": ["DE"], "score": [1.0]}), load_format="csv"
+    )
+    assert bq_client.execute_query(sql_query=sql_query, as_json=True)["results"] == [{"n": 5}]
+
+
+def test_views_are_not_cached(bq_client, user_profiles, monkeypatch):
+    _get_table = bq_client.bq_client.get_table
+
+    def _get_view(table, *args, **kwargs):
+        view = _get_table(table, *args, **kwargs)
+        view._properties["type"] = "VIEW"
+        return view
+
+    monkeypatch.setattr(bq_client.bq_client, "get_table", _get_view)
+    sql_query = f"SELECT COUNT(*) AS n FROM `{user_profiles}`"
+    for _ in range(2):
+        assert bq_client.execute_query(sql_query=sql_query, as_json=True)["results"] == [{"n": 4}]
+    assert query_result_cache.get_stats()["entries"] == 0
+
+
+def test_result_formats_are_cached_separately(bq_client, user_profiles):
+    sql_query = f"SELECT id, score FROM `{user_profiles}` ORDER BY id"
+    records = bq_client.execute_query(sql_query=sql_query, as_json=True)["results"]
+    assert math.isnan(records[1]["score"])
+    rows = asyncio.run(bq_client.execute_query_async(sql_query=sql_query, as_json=True))["results"]
+    assert rows[1] == {"id": 2, "score": None}
+    assert query_result_cache.get_stats()["entries"] == 2
+    assert asyncio.run(bq_client.execute_query_async(sql_query=sql_query, as_json=True))["results"] == rows
@@ -0,0 +1,114 @@
+"""
+downloads of query results in the formats of BigQueryClient.convert_row_iterator, on the local backend
+"""
+import sys
+
+import google.cloud
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from app.gcp.base_client import get_shared_client
+from app.gcp.big_query.big_query_client import create_bigquery_read_client
+from conftest import PROJECT_ID
+
+EXPECTED_RECORDS = [
+    {"id": 1, "name": "Jane", "score": 1.5},
+    {"id": 2, "name": "John", "score": None},
+    {"id": 3, "name": "Max", "score": 3.0},
+    {"id": 4, "name": "Erika", "score": 0.5},
+]
+
+
+class RecordingRowIterator:
+    """
+    row iterator recording the keyword-arguments of its downloads
+    """
+
+    def __init__(self, row_iterator):
+        self._row_iterator = row_iterator
+        self.download_kwargs = []
+
+    def to_arrow(self, **kwargs):
+        self.download_kwargs.append(kwargs)
+        return self._row_iterator.to_arrow(**kwargs)
+
+    def to_arrow_iterable(self, **kwargs):
+        self.download_kwargs.append(kwargs)
+        return self._row_iterator.to_arrow_iterable(**kwargs)
+
+    def to_dataframe(self, **kwargs):
+        self.download_kwargs.append(kwargs)
+        return self._row_iterator.to_dataframe(**kwargs)
+
+    def __iter__(self):
+        return iter(self._row_iterator)
+
+
+def get_sql_query(table_id: str) -> str:
+    return f"SELECT id, name, score FROM `{table_id}` ORDER BY id"
+
+
+def get_row_iterator(bq_client, table_id: str) -> RecordingRowIterator:
+    return RecordingRowIterator(bq_client.bq_client.query(get_sql_query(table_id)).result())
+
+
+def test_arrow_results(bq_client, user_profiles):
+    arrow_table = bq_client.get_query_results(get_sql_query(user_profiles), result_format="arrow")
+    assert isinstance(arrow_table, pa.Table)
+    assert arrow_table.column_names == ["id", "name", "score"]
+    assert arrow_table.to_pylist() == EXPECTED_RECORDS
+
+
+def test_arrow_batch_results(bq_client, user_profiles):
+    record_batches = list(bq_client.get_query_results(get_sql_query(user_profiles), result_format="arrow_batches"))
+    assert all(isinstance(_batch, pa.RecordBatch) for _batch in record_batches)
+    assert pa.Table.from_batches(record_batches).to_pylist() == EXPECTED_RECORDS
+
+
+def test_dataframe_results(bq_client, user_profiles):
+    data_df = bq_client.get_query_results(get_sql_query(user_profiles), result_format="pandas")
+    assert isinstance(data_df, pd.DataFrame)
+    assert list(data_df.columns) == ["id", "name", "score"]
+    assert data_df["name"].tolist() == ["Jane", "John", "Max", "Erika"]
+    assert data_df["score"].isna().tolist() == [False, True, False, False]
+
+
+@pytest.mark.parametrize("result_format", ["rows", "json"])
+def test_record_results(bq_client, user_profiles, result_format):
+    records = bq_client.get_query_results(get_sql_query(user_profiles), result_format=result_format)
+    assert [{**_record, "score": None if pd.isna(_record["score"]) else _record["score"]} for _record in records] == (
+        EXPECTED_RECORDS
+    )
+
+
+def test_unknown_result_format_raises(bq_client, user_profiles):
+    with pytest.raises(ValueError, match="Unknown result_format: csv"):
+        bq_client.convert_row_iterator(get_row_iterator(bq_client, user_profiles), result_format="csv")
+
+
+@pytest.mark.parametrize("result_format", ["pandas", "arrow", "arrow_batches", "json"])
+def test_downloads_use_the_shared_read_client(bq_client, user_profiles, result_format):
+    read_client = object()
+    get_shared_client(client_type="bigquery_storage", project_id=PROJECT_ID, client_factory=lambda _: read_client)
+    row_iterator = get_row_iterator(bq_client, user_profiles)
+    bq_client.convert_row_iterator(row_iterator, result_format=result_format)
+    assert row_iterator.download_kwargs[0]["bqstorage_client"] is read_client
+    # a read client is never created per download
+    assert all(not _kwargs.get("create_bqstorage_client", False) for _kwargs in row_iterator.download_kwargs)
+
+
+def test_downloads_fall_back_to_rest_without_storage_api(bq_client, user_profiles, monkeypatch, capsys):
+    monkeypatch.setenv("BIGQUERY_BACKEND", "bigquery")
+    # google-cloud-bigquery-storage is not installed
+    monkeypatch.delattr(google.cloud, "bigquery_storage", raising=False)
+    monkeypatch.setitem(sys.modules, "google.cloud.bigquery_storage", None)
+    assert create_bigquery_read_client(PROJECT_ID) is None
+    assert "falling back to REST" in capsys.readouterr().out
+
+    for _ in range(2):
+        row_iterator = get_row_iterator(bq_client, user_profiles)
+        assert bq_client.convert_row_iterator(row_iterator, result_format="arrow").to_pylist() == EXPECTED_RECORDS
+        assert row_iterator.download_kwargs == [{"bqstorage_client": None, "create_bqstorage_client": False}]
+    # the fallback is decided once per process
+    assert capsys.readouterr().out.count("falling back to REST") == 1
@@ -0,0 +1,232 @@
+"""
+streaming ingest against an in-process fake of the Storage Write API
+"""
+from concurrent.futures import Future
+from datetime import date, datetime, timezone
+import threading
+import time
+
+import pandas as pd
+import pytest
+from google.cloud import bigquery
+from google.cloud.bigquery_storage_v1 import types, writer
+
+from app.gcp.base_client import get_shared_client
+from app.gcp.big_query.big_query_stream_writer import BigQueryStreamWriter, get_proto_message_class
+from app.gcp.big_query.big_query_table import BigQueryTable
+from conftest import DATASET_NAME, PROJECT_ID, set_table_schemas
+
+# AppendRows requests are rejected above this size
+MAX_APPEND_REQUEST_BYTES = 10 * 1024 * 1024
+SCHEMA = [
+    bigquery.SchemaField("id", "INTEGER"),
+    bigquery.SchemaField("name", "STRING"),
+    bigquery.SchemaField("score", "FLOAT"),
+    bigquery.SchemaField("created", "TIMESTAMP"),
+    bigquery.SchemaField("day", "DATE"),
+    bigquery.SchemaField("tags", "STRING", mode="REPEATED"),
+    bigquery.SchemaField("address", "RECORD", fields=[bigquery.SchemaField("city", "STRING")]),
+]
+
+
+class FakeWriteService:
+    """
+    fake BigQueryWriteClient: keeps the decoded rows of every stream, checks request sizes and the offsets
+    of committed streams; appends are acknowledged right away, or by ack() if auto_ack is False
+    """
+
+    def __init__(self, auto_ack: bool = True):
+        self.auto_ack = auto_ack
+        self.rows = {}  # {stream_name: [decoded rows]}
+        self.requests = []
+        self.finalized = []
+        self.max_pending = 0
+        self._pending = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def table_path(project_id: str, dataset_name: str, table_name: str) -> str:
+        return f"projects/{project_id}/datasets/{dataset_name}/tables/{table_name}"
+
+    def create_write_stream(self, parent: str, write_stream: types.WriteStream) -> types.WriteStream:
+        name = f"{parent}/streams/stream_{len(self.rows)}"
+        self.rows[name] = []
+        return types.WriteStream(name=name, type_=write_stream.type_)
+
+    def finalize_write_stream(self, name: str) -> None:
+        self.finalized.append(name)
+
+    def append(self, template: types.AppendRowsRequest, request: types.AppendRowsRequest) -> Future:
+        future = Future()
+        with self._lock:
+            self.requests.append(request)
+            stream_rows = self.rows.setdefault(template.write_stream, [])
+            response = types.AppendRowsResponse()
+            if types.AppendRowsRequest.pb(request).ByteSize() > MAX_APPEND_REQUEST_BYTES:
+                response.error.code, response.error.message = 3, "request too large"
+            elif "offset" in request and request.offset != len(stream_rows):
+                response.error.code, response.error.message = 11, f"offset {request.offset} out of range"
+            else:
+                message_class = get_proto_message_class(template.proto_rows.writer_schema.proto_descriptor)
+                for _serialized_row in request.proto_rows.rows.serialized_rows:
+                    stream_rows.append(message_class.FromString(_serialized_row))
+            self._pending.append((future, response))
+            self.max_pending = max(self.max_pending, len(self._pending))
+        if self.auto_ack:
+            self.ack()
+        return future
+
+    def ack(self, num_requests: int = None) -> int:
+        """
+        acknowledge the oldest pending appends
+        :return: int | number of acknowledged appends
+        """
+        with self._lock:
+            _num_acked = len(self._pending) if num_requests is None else min(num_requests, len(self._pending))
+            _acked, self._pending = self._pending[:_num_acked], self._pending[_num_acked:]
+        for _future, _response in _acked:
+            _future.set_result(_response)
+        return len(_acked)
+
+    @property
+    def num_pending(self) -> int:
+        with self._lock:
+            return len(self._pending)
+
+    def close(self) -> None:
+        pass
+
+
+class FakeAppendRowsStream:
+    def __init__(self, client: FakeWriteService, initial_request_template: types.AppendRowsRequest):
+        self._client = client
+        self._template = initial_request_template
+
+    def send(self, request: types.AppendRowsRequest) -> Future:
+        return self._client.append(self._template, request)
+
+    def close(self) -> None:
+        pass
+
+
+@pytest.fixture
+def write_service(monkeypatch) -> FakeWriteService:
+    monkeypatch.setattr(writer, "AppendRowsStream", FakeAppendRowsStream)
+    return FakeWriteService()
+
+
+def get_stream_writer(write_service: FakeWriteService, **kwargs) -> BigQueryStreamWriter:
+    return BigQueryStreamWriter(
+        write_client=write_service, table_id=f"{PROJECT_ID}.{DATASET_NAME}.events", schema=SCHEMA, **kwargs
+    )
+
+
+def test_rows_are_serialized_as_protobuf(write_service):
+    with get_stream_writer(write_service) as stream_writer:
+        stream_writer.append_rows(
+            pd.DataFrame(
+                {
+                    "id": [1, 2],
+                    "name": ["Jane", None],
+                    "score": [1.5, float("nan")],
+                    "created": [datetime(2024, 1, 1, 10, tzinfo=timezone.utc), None],
+                    "day": [date(2024, 1, 2), None],
+                    "tags": [["a", "b"], []],
+                    "address": [{"city": "Berlin"}, None],
+                }
+            )
+        )
+    first_row, second_row = write_service.rows[stream_writer.stream_name]
+    assert first_row.id == 1 and first_row.name == "Jane" and first_row.score == 1.5
+    assert first_row.created == 1704103200 * 1_000_000  # microseconds since epoch
+    assert first_row.day == 19724  # days since epoch
+    assert list(first_row.tags) == ["a", "b"] and first_row.address.city == "Berlin"
+    # NULLs are left unset
+    assert second_row.id == 2
+    assert not any(second_row.HasField(_field) for _field in ("name", "score", "created", "day", "address"))
+
+
+def test_requests_are_split_below_10mb(write_service):
+    with get_stream_writer(write_service) as stream_writer:
+        stream_writer.append_rows([{"id": _i, "name": "x" * 1024 * 1024} for _i in range(25)])
+    assert stream_writer.num_rows == 25
+    # 8 rows of just over 1MB fit into the 9MB default of max_request_bytes
+    assert stream_writer.num_requests == len(write_service.requests) == 4
+    assert all(
+        types.AppendRowsRequest.pb(_request).ByteSize() <= MAX_APPEND_REQUEST_BYTES
+        for _request in write_service.requests
+    )
+    assert [_row.id for _row in write_service.rows[stream_writer.stream_name]] == list(range(25))
+
+
+def test_committed_streams_send_offsets(write_service):
+    stream_writer = get_stream_writer(write_service, stream_type="committed", max_request_bytes=64)
+    stream_writer.append_rows([{"id": _i, "name": f"name {_i}"} for _i in range(10)])
+    stream_writer.append_rows({"id": 10})
+    assert stream_writer.close() == 11
+    offsets = [_request.offset for _request in write_service.requests]
+    assert offsets[0] == 0 and offsets == sorted(offsets) and len(offsets) > 2
+    assert write_service.finalized == [stream_writer.stream_name]
+    assert len(write_service.rows[stream_writer.stream_name]) == 11
+
+
+def test_default_streams_send_no_offsets(write_service):
+    with get_stream_writer(write_service) as stream_writer:
+        stream_writer.append_rows([{"id": 1}, {"id": 2}])
+    assert stream_writer.stream_name.endswith("/streams/_default")
+    assert all("offset" not in _request for _request in write_service.requests)
+    assert write_service.finalized == []
+
+
+def test_failed_appends_raise_on_flush(write_service):
+    stream_writer = get_stream_writer(write_service, stream_type="committed")
+    stream_writer.num_rows = 5  # e.g. out of sync after a retry
+    stream_writer.append_rows({"id": 1})
+    with pytest.raises(Exception, match="out of range"):
+        stream_writer.close()
+
+
+def test_errors_are_raised_once(write_service):
+    write_service.auto_ack = False
+    stream_writer = get_stream_writer(write_service, stream_type="committed")
+    stream_writer.num_rows = 5  # e.g. out of sync after a retry
+    stream_writer.append_rows({"id": 1})
+    # acknowledged on another thread, like by the stream's consumer
+    ack_thread = threading.Thread(target=write_service.ack)
+    ack_thread.start()
+    with pytest.raises(Exception, match="out of range"):
+        stream_writer.flush()
+    ack_thread.join()
+    assert stream_writer.flush() == 6
+
+
+def test_max_in_flight_bounds_unacknowledged_requests(write_service):
+    write_service.auto_ack = False
+    stream_writer = get_stream_writer(write_service, max_in_flight=3, max_request_bytes=64)
+    append_thread = threading.Thread(
+        target=stream_writer.append_rows, args=([{"id": _i, "name": f"name {_i}"} for _i in range(20)],)
+    )
+    append_thread.start()
+    while append_thread.is_alive():
+        time.sleep(0.01)
+        # blocked until an append is acknowledged
+        if write_service.num_pending == 3:
+            time.sleep(0.05)
+            assert write_service.num_pending == 3
+            write_service.ack(1)
+    append_thread.join()
+    write_service.ack()
+    assert stream_writer.close() == 20
+    assert write_service.max_pending == 3
+    assert len(write_service.requests) > 3
+
+
+def test_stream_rows_to_table(bq_client, write_service):
+    set_table_schemas({"EVENTS": {"id": "id:INT64", "name": "name:STRING"}})
+    get_shared_client(client_type="bigquery_write", project_id=PROJECT_ID, client_factory=lambda _: write_service)
+    table = BigQueryTable(project_id=PROJECT_ID, dataset_name=DATASET_NAME, table_name="events", p_key="id")
+    upload_results = table.stream_rows([{"id": 1, "name": "Jane"}, {"id": 2, "name": "John"}])
+    assert upload_results.num_rows == 2
+    assert upload_results.job_id.endswith("/streams/_default")
+    assert [_row.name for _row in write_service.rows[upload_results.job_id]] == ["Jane", "John"]
+    assert table.highest_pkey_value == 2
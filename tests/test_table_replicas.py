@@ -0,0 +1,114 @@
+import asyncio
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.gcp.base_client import get_shared_client
+from app.gcp.big_query.local_backend import LocalBigQueryClient
+from app.gcp.big_query.table_replicas import TableReplicas, is_replicable_query
+from app.main import app
+from conftest import PROJECT_ID
+
+
+@pytest.fixture
+def table_replicas(user_profiles) -> TableReplicas:
+    """
+    replicas of user_profiles, used by all BigQueryClients of the test
+    """
+    return get_shared_client(
+        client_type="table_replicas",
+        project_id=PROJECT_ID,
+        client_factory=lambda project_id: TableReplicas(
+            project_id=project_id,
+            table_ids=[user_profiles],
+            local_client=LocalBigQueryClient(project=project_id),
+        ),
+    )
+
+
+@pytest.mark.parametrize(
+    "sql_query",
+    [
+        "SELECT id, name FROM `local.test_data.user_profiles` WHERE country IN UNNEST(@countries)",
+        "SELECT country, COUNT(*) AS n, AVG(score) FROM local.test_data.user_profiles GROUP BY country",
+        "SELECT * FROM `local.test_data.user_profiles` WHERE LOWER(name) LIKE 'j%' ORDER BY score DESC",
+        "WITH t AS (SELECT id FROM `local.test_data.user_profiles`) SELECT MAX(id) FROM t",
+    ],
+)
+def test_replicable_queries(sql_query):
+    assert is_replicable_query(sql_query)
+
+
+@pytest.mark.parametrize(
+    "sql_query",
+    [
+        # NULL arguments are skipped by DuckDB, but make the result NULL in BigQuery
+        "SELECT CONCAT(name, country) FROM `local.test_data.user_profiles`",
+        "SELECT GREATEST(score, 1) FROM `local.test_data.user_profiles`",
+        # division by zero returns NULL in DuckDB, but fails in BigQuery
+        "SELECT score / 0 FROM `local.test_data.user_profiles`",
+        "SELECT id FROM `local.test_data.user_profiles` WHERE name = 'O\\'Neil'",
+        "SELECT EXTRACT(YEAR FROM created_at) FROM `local.test_data.user_profiles`",
+        "SELECT * EXCEPT(score) FROM `local.test_data.user_profiles`",
+        "SELECT id, ROW_NUMBER() OVER (ORDER BY id) FROM `local.test_data.user_profiles`",
+        "DELETE FROM `local.test_data.user_profiles` WHERE TRUE",
+    ],
+)
+def test_non_replicable_queries(sql_query):
+    assert not is_replicable_query(sql_query)
+
+
+def test_queries_outside_the_subset_go_to_bigquery(bq_client, table_replicas, user_profiles):
+    query_results = bq_client.execute_query(
+        sql_query=f"SELECT CONCAT(name, country) AS label FROM `{user_profiles}` ORDER BY id", as_json=True
+    )
+    assert query_results["errors"] is None
+    assert table_replicas.hits == 0
+
+
+def test_null_values_of_replica_results(bq_client, table_replicas, user_profiles):
+    sql_query = f"SELECT id, score FROM `{user_profiles}` ORDER BY score"
+    query_results = bq_client.execute_query(sql_query=sql_query, as_json=True)
+    assert table_replicas.hits == 1
+    # NULLs first in ascending order, like BigQuery
+    assert query_results["results"][0] == {"id": 2, "score": None}
+    json.dumps(query_results["results"], allow_nan=False)
+
+
+def test_null_values_of_replica_results_async(bq_client, table_replicas, user_profiles):
+    query_results = asyncio.run(
+        bq_client.execute_query_async(
+            sql_query=f"SELECT id, score FROM `{user_profiles}` WHERE id = 2", as_json=True
+        )
+    )
+    assert table_replicas.hits == 1
+    assert query_results["results"] == [{"id": 2, "score": None}]
+
+
+def test_api_returns_null_values_of_replica_results(table_replicas, user_profiles):
+    response = TestClient(app).post(
+        "/bigquery_operation_results",
+        json={"query": f"SELECT id, score FROM `{user_profiles}` ORDER BY id"},
+    )
+    assert response.status_code == 200
+    assert table_replicas.hits == 1
+    assert response.json()["query_results"]["results"][1] == {"id": 2, "score": None}
+
+
+def test_integer_sums_stay_integers(bq_client, table_replicas, user_profiles):
+    query_results = bq_client.execute_query(
+        sql_query=f"SELECT SUM(id) AS total FROM `{user_profiles}`", as_json=True
+    )
+    assert table_replicas.hits == 1
+    assert query_results["results"] == [{"total": 10}]
+    assert isinstance(query_results["results"][0]["total"], int)
+
+
+def test_replica_is_refreshed_after_the_table_changed(bq_client, table_replicas, user_profiles):
+    sql_query = f"SELECT COUNT(*) AS n FROM `{user_profiles}`"
+    assert bq_client.execute_query(sql_query=sql_query, as_json=True)["results"] == [{"n": 4}]
+    bq_client.execute_query(sql_query=f"DELETE FROM `{user_profiles}` WHERE id = 4")
+    table_replicas.check_interval_seconds = 0
+    assert bq_client.execute_query(sql_query=sql_query, as_json=True)["results"] == [{"n": 3}]
+    assert table_replicas.hits == 2
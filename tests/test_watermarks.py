@@ -0,0 +1,124 @@
+from decimal import Decimal
+
+import pandas as pd
+import pytest
+
+from app.gcp.big_query.big_query_table import BigQueryTable
+from app.gcp.big_query.big_query_uploader import BigQueryUploader
+from app.gcp.big_query.watermark_store import (
+    WatermarkStore,
+    is_higher_watermark,
+    to_watermark_value,
+    watermark_store,
+)
+from conftest import DATASET_NAME, PROJECT_ID, set_table_schemas
+
+
+@pytest.fixture
+def make_table(bq_client):
+    """
+    create an empty table EVENTS with the p_key column of the passed GBQ type, highest p_key value set by an insert
+    """
+    def _make_table(p_key_type: str, highest_pkey_literal: str) -> BigQueryTable:
+        set_table_schemas({"EVENTS": {"p_key": f"p_key:{p_key_type}", "name": "name:STRING"}})
+        table = BigQueryTable(project_id=PROJECT_ID, dataset_name=DATASET_NAME, table_name="events", p_key="p_key")
+        table.create()
+        bq_client.execute_query(
+            sql_query=f"INSERT INTO `{table.table_id}` (p_key, name) VALUES ({highest_pkey_literal}, 'a')"
+        )
+        return table
+    return _make_table
+
+
+def test_numeric_watermarks_are_stored_exactly():
+    assert to_watermark_value(Decimal("9")) == 9
+    assert isinstance(to_watermark_value(Decimal("9")), int)
+    value = Decimal("12345678901234567.123456789")
+    assert Decimal(to_watermark_value(value)) == value
+
+
+def test_numeric_watermarks_are_compared_as_decimals(tmp_path):
+    store = WatermarkStore(file_path=str(tmp_path / "watermarks.json"))
+    store.set("p.d.a", "id", Decimal("9.5"))
+    assert store.advance("p.d.a", "id", Decimal("10.25")) == "10.25"
+    assert store.advance("p.d.a", "id", Decimal("9.75")) == "10.25"
+    assert store.advance("p.d.a", "id", Decimal("12345678901234567.123456789")) == "12345678901234567.123456789"
+    assert store.advance("p.d.a", "id", Decimal("12345678901234567.123456788")) == "12345678901234567.123456789"
+    assert store.advance("p.d.a", "id", 12345678901234568) == 12345678901234568
+    # the watermark survives a round-trip through the file
+    assert WatermarkStore(file_path=store.file_path).get("p.d.a", "id") == 12345678901234568
+
+
+def test_numeric_keys_are_compared_as_numbers(make_table):
+    table = make_table("NUMERIC", "9")
+    assert table.highest_pkey_value == 9
+    data_df = pd.DataFrame({"p_key": [Decimal(9), Decimal(10), Decimal(11), None], "name": ["a", "b", "c", "d"]})
+    assert table.filter_above_watermark(data_df)["p_key"].tolist() == [Decimal(10), Decimal(11)]
+    assert table.advance_highest_pkey_value(data_df) == 11
+    assert watermark_store.get(table.table_id, "p_key") == 11
+    data_df = pd.DataFrame({"p_key": [Decimal("11.5"), Decimal("100.25")], "name": ["e", "f"]})
+    assert table.filter_above_watermark(data_df)["p_key"].tolist() == [Decimal("11.5"), Decimal("100.25")]
+    assert table.advance_highest_pkey_value(data_df) == "100.25"
+    assert table.filter_above_watermark(data_df).empty
+
+
+def test_timestamp_keys_are_compared_as_timestamps(make_table):
+    table = make_table("TIMESTAMP", "TIMESTAMP '2024-01-01 10:00:00+00'")
+    data_df = pd.DataFrame(
+        {
+            "p_key": ["2024-01-01T09:00:00", "2024-01-01T11:00:00+01:00", "2024-01-01T10:30:00Z"],
+            "name": ["a", "b", "c"],
+        }
+    )
+    assert table.filter_above_watermark(data_df)["p_key"].tolist() == ["2024-01-01T10:30:00Z"]
+
+
+def test_string_keys_are_compared_lower_cased(make_table):
+    table = make_table("STRING", "'b'")
+    data_df = pd.DataFrame({"p_key": ["A", "B", "C", "c"], "name": ["a", "b", "c", "d"]})
+    assert table.filter_above_watermark(data_df)["p_key"].tolist() == ["C", "c"]
+    assert table.advance_highest_pkey_value(data_df) == "c"
+
+
+def test_timestamp_watermarks_are_compared_as_timestamps():
+    assert not is_higher_watermark("2024-01-01t09:00", "2024-01-01T10:00+00:00")
+    assert is_higher_watermark("2024-01-01T10:30:00Z", "2024-01-01T11:00:00+01:00")
+    assert is_higher_watermark("2024-01-02", "2024-01-01T23:00:00")
+    assert is_higher_watermark("b", "a")
+
+
+def test_stores_of_other_workers_see_updates(tmp_path):
+    file_path = str(tmp_path / "shared" / "watermarks.json")
+    worker_1, worker_2 = WatermarkStore(file_path=file_path), WatermarkStore(file_path=file_path)
+    worker_1.set("p.d.a", "id", 10)
+    worker_1.set("p.d.b", "id", 1)
+    assert worker_2.get("p.d.a", "id") == 10
+    assert worker_2.advance("p.d.a", "id", 12) == 12
+    worker_1.delete("p.d.b")
+    # stale copies never overwrite updates of the other worker
+    assert worker_1.advance("p.d.a", "id", 11) == 12
+    assert worker_2.advance("p.d.a", "id", 13) == 13
+    assert worker_2.get("p.d.b", "id") is None
+    assert worker_1.get("p.d.a", "id") == 13
+
+
+def test_incremental_uploads_after_the_table_was_recreated(bq_client, user_profiles):
+    def _upload(data_df: pd.DataFrame) -> dict:
+        return BigQueryUploader(
+            project_id=PROJECT_ID,
+            dataset_name=DATASET_NAME,
+            table_name="user_profiles",
+            data_to_upload=data_df,
+            p_key="id",
+        ).do_upload(incremental=True)
+
+    data_df = pd.DataFrame({"id": [1, 2], "name": ["Jane", "John"], "country": ["DE", "AT"], "score": [1.0, 2.0]})
+    assert _upload(data_df)["skipped_rows"] == 2
+    assert watermark_store.get(user_profiles, "id") == 4
+    # recreated by another process, without deleting the watermark
+    bq_client.bq_client.delete_table(user_profiles)
+    BigQueryTable(project_id=PROJECT_ID, dataset_name=DATASET_NAME, table_name="user_profiles").create()
+    upload_results = _upload(data_df)
+    assert upload_results["skipped_rows"] == 0
+    assert upload_results["jobs"]["num_rows"] == 2
+    assert watermark_store.get(user_profiles, "id") == 2